@@ -0,0 +1,3 @@
+-- Canais importados de playlists M3U guardam a URL original em direct_source
+-- (vod_streams já possui a coluna).
+ALTER TABLE public.live_streams ADD COLUMN IF NOT EXISTS direct_source TEXT;
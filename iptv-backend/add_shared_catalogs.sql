@@ -0,0 +1,10 @@
+-- Catálogo compartilhado entre conexões do mesmo provedor (src/services/shared_catalog.py).
+-- Conexões com o mesmo server_url e a mesma impressão digital de catálogo
+-- apontam para a conexão dona (catalog_owner_id) e não guardam cópia própria
+-- de categorias, canais, filmes e séries. As credenciais continuam por conexão.
+
+ALTER TABLE public.xtream_connections
+    ADD COLUMN IF NOT EXISTS catalog_owner_id BIGINT REFERENCES public.xtream_connections(id) ON DELETE SET NULL,
+    ADD COLUMN IF NOT EXISTS catalog_fingerprint JSONB NOT NULL DEFAULT '{}'::jsonb;
+
+CREATE INDEX IF NOT EXISTS idx_xtream_connections_catalog_owner ON public.xtream_connections (catalog_owner_id);
@@ -0,0 +1,51 @@
+-- Campos tipados para as listas "adicionados recentemente", "mais bem avaliados"
+-- e "por ano" (/streams?sort=added|rating|year). O sync preenche added_at
+-- (epoch de added, ou last_modified nas séries), rating_value (0-10) e
+-- release_year; os índices servem a paginação por cursor (valor, id) no
+-- catálogo inteiro e dentro de cada categoria.
+
+ALTER TABLE public.vod_streams
+    ADD COLUMN IF NOT EXISTS added_at BIGINT,
+    ADD COLUMN IF NOT EXISTS rating_value NUMERIC,
+    ADD COLUMN IF NOT EXISTS release_year INT;
+
+ALTER TABLE public.series
+    ADD COLUMN IF NOT EXISTS added_at BIGINT,
+    ADD COLUMN IF NOT EXISTS rating_value NUMERIC,
+    ADD COLUMN IF NOT EXISTS release_year INT;
+
+-- Preenche as linhas existentes; categorias que o planejador não baixar de novo
+-- não passariam pelo mapeamento do sync tão cedo.
+UPDATE public.vod_streams SET
+    added_at = CASE WHEN added ~ '^[0-9]+$' AND added::BIGINT > 0 THEN added::BIGINT END,
+    rating_value = CASE
+        WHEN rating ~ '^[0-9]+(\.[0-9]+)?$' AND rating::NUMERIC > 0 AND rating::NUMERIC <= 10 THEN ROUND(rating::NUMERIC, 2)
+        WHEN rating_5based > 0 AND rating_5based <= 5 THEN ROUND(rating_5based * 2, 2)
+    END,
+    release_year = CASE WHEN LEFT(year, 4) ~ '^[0-9]{4}$' AND LEFT(year, 4)::INT BETWEEN 1870 AND 2100 THEN LEFT(year, 4)::INT END;
+
+UPDATE public.series SET
+    added_at = CASE WHEN last_modified ~ '^[0-9]+$' AND last_modified::BIGINT > 0 THEN last_modified::BIGINT END,
+    rating_value = CASE
+        WHEN rating ~ '^[0-9]+(\.[0-9]+)?$' AND rating::NUMERIC > 0 AND rating::NUMERIC <= 10 THEN ROUND(rating::NUMERIC, 2)
+        WHEN rating_5based > 0 AND rating_5based <= 5 THEN ROUND(rating_5based * 2, 2)
+    END,
+    release_year = CASE
+        WHEN LEFT(year, 4) ~ '^[0-9]{4}$' AND LEFT(year, 4)::INT BETWEEN 1870 AND 2100 THEN LEFT(year, 4)::INT
+        WHEN LEFT(release_date, 4) ~ '^[0-9]{4}$' AND LEFT(release_date, 4)::INT BETWEEN 1870 AND 2100 THEN LEFT(release_date, 4)::INT
+    END;
+
+-- Ordem decrescente com nulos no fim, a mesma das consultas.
+CREATE INDEX IF NOT EXISTS idx_vod_streams_connection_added ON public.vod_streams (connection_id, added_at DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_vod_streams_connection_rating ON public.vod_streams (connection_id, rating_value DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_vod_streams_connection_year ON public.vod_streams (connection_id, release_year DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_vod_streams_category_added ON public.vod_streams (connection_id, category_id, added_at DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_vod_streams_category_rating ON public.vod_streams (connection_id, category_id, rating_value DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_vod_streams_category_year ON public.vod_streams (connection_id, category_id, release_year DESC NULLS LAST, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_series_connection_added ON public.series (connection_id, added_at DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_series_connection_rating ON public.series (connection_id, rating_value DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_series_connection_year ON public.series (connection_id, release_year DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_series_category_added ON public.series (connection_id, category_id, added_at DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_series_category_rating ON public.series (connection_id, category_id, rating_value DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_series_category_year ON public.series (connection_id, category_id, release_year DESC NULLS LAST, id DESC);
@@ -0,0 +1,9 @@
+-- Índice de disponibilidade dos canais ao vivo, preenchido pelo StreamProber.
+ALTER TABLE public.live_streams ADD COLUMN IF NOT EXISTS alive BOOLEAN;
+ALTER TABLE public.live_streams ADD COLUMN IF NOT EXISTS probe_latency_ms INT;
+ALTER TABLE public.live_streams ADD COLUMN IF NOT EXISTS probed_at TIMESTAMPTZ;
+
+-- Próximo lote a verificar: os nunca verificados e depois os mais antigos.
+CREATE INDEX IF NOT EXISTS idx_live_streams_connection_probed_at ON public.live_streams (connection_id, probed_at NULLS FIRST);
+-- Filtro ?alive=1 e ordenação ?sort=latency em /streams.
+CREATE INDEX IF NOT EXISTS idx_live_streams_connection_alive_latency ON public.live_streams (connection_id, alive, probe_latency_ms);
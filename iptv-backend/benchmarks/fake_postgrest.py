@@ -0,0 +1,369 @@
+"""
+In-memory PostgREST stand-in for benchmarks.
+
+Implements the subset of the PostgREST HTTP API that supabase-py issues in
+this backend: select with column lists, eq/neq/gt/gte/lt/lte/like/ilike/in/is
+filters (optionally negated), or=(...), order with nulls first/last,
+limit/offset and Range paging, exact counts, single-object responses, and
+insert/upsert/update/delete. Unique keys are read from the repo's .sql files
+so upserts conflict exactly where they would in Supabase; tables that are
+not declared there are created on first write.
+
+    python -m benchmarks.fake_postgrest --port 0 --latency-ms 20
+
+The first line written to stdout is the bound port.
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlparse
+
+SQL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+OBJECT_MEDIA_TYPE = 'application/vnd.pgrst.object+json'
+
+CREATE_TABLE = re.compile(r'CREATE TABLE (?:IF NOT EXISTS )?(?:public\.)?"?(\w+)"?\s*\((.*?)\n\);', re.S | re.I)
+UNIQUE = re.compile(r'UNIQUE\s*\(([^)]*)\)', re.I)
+PRIMARY_KEY = re.compile(r'^\s*"?(\w+)"?\s+[^\n]*PRIMARY KEY', re.I | re.M)
+ADD_UNIQUE = re.compile(r'ALTER TABLE (?:public\.)?"?(\w+)"?\s+ADD CONSTRAINT \w+ UNIQUE\s*\(([^)]*)\)', re.I)
+
+
+def load_unique_keys(sql_dir=SQL_DIR):
+    """Returns {table: [tuple of columns, ...]} from the CREATE TABLE and ALTER TABLE statements."""
+    keys = {}
+    for path in sorted(glob.glob(os.path.join(sql_dir, '*.sql'))):
+        with open(path, encoding='utf-8') as sql_file:
+            sql = sql_file.read()
+        for table, body in CREATE_TABLE.findall(sql):
+            keys.setdefault(table, []).extend((column,) for column in PRIMARY_KEY.findall(body))
+            for columns in UNIQUE.findall(body):
+                keys.setdefault(table, []).append(_columns(columns))
+        for table, columns in ADD_UNIQUE.findall(sql):
+            keys.setdefault(table, []).append(_columns(columns))
+    return keys
+
+
+def _columns(text):
+    return tuple(column.strip().strip('"') for column in text.split(',') if column.strip())
+
+
+def _split_top_level(text):
+    """Splits on commas that are not inside parentheses or quotes."""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    if current:
+        parts.append(''.join(current))
+    return parts
+
+
+def _compare_value(stored, raw):
+    """Converts the raw filter value to the stored value's type."""
+    if isinstance(stored, bool):
+        return raw == 'true'
+    if isinstance(stored, (int, float)):
+        try:
+            return float(raw)
+        except ValueError:
+            return raw
+    return raw
+
+
+def _like(pattern):
+    return re.compile('^' + '.*'.join(re.escape(part) for part in pattern.replace('%', '*').split('*')) + '$', re.S)
+
+
+def parse_condition(column, expression):
+    """Builds a predicate for `column=expression` (e.g. `stream_id=in.(1,2)`)."""
+    if column in ('or', 'and'):
+        conditions = []
+        for part in _split_top_level(expression.strip()[1:-1]):
+            part = part.strip()
+            nested = re.match(r'(or|and)\(', part)
+            if nested:
+                conditions.append(parse_condition(nested.group(1), part[len(nested.group(1)):]))
+            else:
+                name, _, rest = part.partition('.')
+                conditions.append(parse_condition(name, rest))
+        combine = any if column == 'or' else all
+        return lambda row: combine(condition(row) for condition in conditions)
+
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[len('not.'):]
+    operator, _, raw = expression.partition('.')
+
+    if operator == 'in':
+        values = [value.strip().strip('"') for value in _split_top_level(raw.strip()[1:-1])]
+
+        def predicate(row):
+            stored = row.get(column)
+            return stored is not None and any(stored == _compare_value(stored, value) for value in values)
+    elif operator == 'is':
+        expected = {'null': None, 'true': True, 'false': False}.get(raw.lower(), raw)
+
+        def predicate(row):
+            return row.get(column) is expected or row.get(column) == expected
+    elif operator in ('like', 'ilike'):
+        pattern = _like(raw)
+        flags = re.I if operator == 'ilike' else 0
+        pattern = re.compile(pattern.pattern, re.S | flags)
+
+        def predicate(row):
+            stored = row.get(column)
+            return stored is not None and pattern.match(str(stored)) is not None
+    else:
+        compare = {
+            'eq': lambda a, b: a == b, 'neq': lambda a, b: a != b,
+            'gt': lambda a, b: a > b, 'gte': lambda a, b: a >= b,
+            'lt': lambda a, b: a < b, 'lte': lambda a, b: a <= b,
+        }.get(operator)
+        if compare is None:
+            raise ValueError(f'Unsupported operator: {operator}')
+
+        def predicate(row):
+            stored = row.get(column)
+            if stored is None:
+                return False
+            value = _compare_value(stored, raw)
+            try:
+                return compare(stored, value)
+            except TypeError:
+                return compare(str(stored), str(value))
+    return (lambda row: not predicate(row)) if negate else predicate
+
+
+def _sort(rows, order):
+    for term in reversed(order.split(',')):
+        parts = term.strip().split('.')
+        column = parts[0]
+        descending = 'desc' in parts[1:]
+        nulls_first = 'nullsfirst' in parts[1:] or ('nullslast' not in parts[1:] and descending)
+        present = [row for row in rows if row.get(column) is not None]
+        missing = [row for row in rows if row.get(column) is None]
+        present.sort(key=lambda row: row[column], reverse=descending)
+        rows = missing + present if nulls_first else present + missing
+    return rows
+
+
+def _project(row, select):
+    if not select or select.strip() == '*':
+        return dict(row)
+    columns = [column.strip().strip('"') for column in _split_top_level(select) if '(' not in column]
+    if '*' in columns:
+        return dict(row)
+    return {column: row.get(column) for column in columns}
+
+
+class Store:
+    """Tables as lists of dicts, with identity ids and unique keys from the SQL."""
+
+    def __init__(self, unique_keys):
+        self.unique_keys = unique_keys
+        self.tables = {}
+        self._ids = {}
+        self.lock = threading.Lock()
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = []
+            self._ids[name] = itertools.count(1)
+        return self.tables[name]
+
+    def _next_id(self, name, row):
+        if row.get('id') is None:
+            row['id'] = next(self._ids[name])
+        else:
+            # Keep generated ids above explicitly inserted ones.
+            current = next(self._ids[name])
+            self._ids[name] = itertools.count(max(current, int(row['id']) + 1))
+
+    def insert(self, name, rows, on_conflict=None, resolution=None):
+        table = self.table(name)
+        conflict = _columns(on_conflict) if on_conflict else None
+        keys = [conflict] if conflict else self.unique_keys.get(name) or [('id',)]
+        indexes = [{tuple(row.get(column) for column in key): row for row in table} for key in keys]
+        written = []
+        for row in rows:
+            existing = None
+            for key, index in zip(keys, indexes):
+                existing = index.get(tuple(row.get(column) for column in key))
+                if existing is not None:
+                    break
+            if existing is not None:
+                if resolution == 'merge-duplicates':
+                    existing.update({column: value for column, value in row.items() if column != 'id'})
+                    written.append(existing)
+                elif resolution != 'ignore-duplicates':
+                    raise ConflictError(f'duplicate key value violates unique constraint on {name}')
+                continue
+            new_row = dict(row)
+            self._next_id(name, new_row)
+            table.append(new_row)
+            for key, index in zip(keys, indexes):
+                index[tuple(new_row.get(column) for column in key)] = new_row
+            written.append(new_row)
+        return written
+
+
+class ConflictError(Exception):
+    pass
+
+
+class FakePostgrestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakePostgREST/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None, body=True):
+        data = json.dumps(payload, default=str).encode() if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data) if body else 0))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and data:
+            self.wfile.write(data)
+
+    def _error(self, status, message, code='PGRST000'):
+        self._send_json(status, {'code': code, 'message': message, 'details': None, 'hint': None})
+
+    def _parse(self):
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split('/') if part]
+        if len(parts) < 3 or parts[:2] != ['rest', 'v1']:
+            return None, None, None
+        params = parse_qsl(parsed.query, keep_blank_values=True)
+        prefer = {}
+        for item in self.headers.get('Prefer', '').split(','):
+            name, _, value = item.strip().partition('=')
+            if name:
+                prefer[name] = value
+        return unquote(parts[-1]) if parts[2] != 'rpc' else None, params, prefer
+
+    def _filtered(self, table, params):
+        conditions = [parse_condition(column, expression) for column, expression in params
+                      if column not in RESERVED_PARAMS]
+        return [row for row in table if all(condition(row) for condition in conditions)]
+
+    def _handle(self, method):
+        latency = self.server.options.latency_ms
+        if latency:
+            time.sleep(latency / 1000)
+        name, params, prefer = self._parse()
+        if name is None:
+            return self._error(404, 'Not found', 'PGRST202')
+        options = dict(params)
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length)) if length else None
+        store = self.server.store
+        try:
+            with store.lock:
+                table = store.table(name)
+                if method in ('GET', 'HEAD'):
+                    return self._select(table, params, options, prefer, body=method == 'GET')
+                if method == 'POST':
+                    rows = payload if isinstance(payload, list) else [payload or {}]
+                    written = store.insert(name, rows, options.get('on_conflict'), prefer.get('resolution'))
+                elif method == 'PATCH':
+                    written = self._filtered(table, params)
+                    for row in written:
+                        row.update(payload or {})
+                else:
+                    written = self._filtered(table, params)
+                    doomed = {id(row) for row in written}
+                    table[:] = [row for row in table if id(row) not in doomed]
+                if prefer.get('return') == 'representation':
+                    return self._send_json(201 if method == 'POST' else 200,
+                                           [_project(row, options.get('select')) for row in written])
+                return self._send_json(201 if method == 'POST' else 204, None)
+        except ConflictError as e:
+            return self._error(409, str(e), '23505')
+        except ValueError as e:
+            return self._error(400, str(e), 'PGRST100')
+
+    def _select(self, table, params, options, prefer, body=True):
+        rows = self._filtered(table, params)
+        total = len(rows)
+        if options.get('order'):
+            rows = _sort(rows, options['order'])
+        offset = int(options.get('offset') or 0)
+        limit = int(options['limit']) if options.get('limit') else None
+        range_header = self.headers.get('Range')
+        if range_header and '-' in range_header:
+            start, _, end = range_header.partition('-')
+            offset, limit = int(start), int(end) - int(start) + 1
+        rows = rows[offset:offset + limit if limit is not None else None]
+        rows = [_project(row, options.get('select')) for row in rows]
+        end = offset + len(rows) - 1
+        content_range = f"{offset}-{end}/{total if prefer.get('count') else '*'}" if rows else f"*/{total}"
+        headers = {'Content-Range': content_range}
+        if OBJECT_MEDIA_TYPE in self.headers.get('Accept', ''):
+            if len(rows) != 1:
+                return self._error(406, f'JSON object requested, multiple (or no) rows returned ({len(rows)})',
+                                   'PGRST116')
+            return self._send_json(200, rows[0], headers, body)
+        return self._send_json(200, rows, headers, body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_HEAD(self):
+        self._handle('HEAD')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def make_server(options, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, options.port), FakePostgrestHandler)
+    server.daemon_threads = True
+    server.options = options
+    server.store = Store(load_unique_keys())
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    server = make_server(parse_args(argv))
+    print(server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Fake Xtream Codes provider for benchmarks.
+
+Serves player_api.php (authentication, categories, streams, series info and
+short EPG) over a deterministic generated catalog, optionally with ETags,
+plus HLS live playlists, MPEG-TS segments and raw .ts streams. Latency and
+failures can be injected to reproduce slow or flaky providers.
+
+    python -m benchmarks.fake_xtream --port 0 --live 5000 --latency-ms 80 --failure-rate 0.01
+
+The first line written to stdout is the bound port.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+SEGMENT_SECONDS = 2
+PLAYLIST_SEGMENTS = 6
+SEGMENT_BYTES = 188 * 2048
+STREAM_CHUNK_BYTES = 188 * 64
+CATEGORY_ID_OFFSETS = {'live': 0, 'vod': 1000, 'series': 2000}
+WORDS = ('news', 'sport', 'movie', 'kids', 'music', 'documentary', 'comedy', 'drama',
+         'action', 'nature', 'travel', 'cooking', 'science', 'history', 'classic', 'series')
+
+
+class Catalog:
+    """Deterministic catalog: the same options always produce the same JSON."""
+
+    def __init__(self, live, vod, series, categories, seed=42):
+        rng = random.Random(seed)
+        self.responses = {}
+        for kind, count in (('live', live), ('vod', vod), ('series', series)):
+            category_rows = [{
+                'category_id': str(CATEGORY_ID_OFFSETS[kind] + index + 1),
+                'category_name': f"{kind.upper()} | {WORDS[index % len(WORDS)].title()} {index + 1}",
+                'parent_id': 0,
+            } for index in range(categories)]
+            items = [self._item(kind, index, rng, category_rows) for index in range(count)]
+            self.responses[f'get_{kind}_categories'] = category_rows
+            self.responses[self._items_action(kind)] = items
+        self._by_category = {}
+
+    @staticmethod
+    def _items_action(kind):
+        return {'live': 'get_live_streams', 'vod': 'get_vod_streams', 'series': 'get_series'}[kind]
+
+    @staticmethod
+    def _item(kind, index, rng, category_rows):
+        name = f"{WORDS[rng.randrange(len(WORDS))].title()} {WORDS[rng.randrange(len(WORDS))].title()} {index + 1}"
+        category_id = category_rows[index % len(category_rows)]['category_id'] if category_rows else '0'
+        added = str(1600000000 + rng.randrange(100000000))
+        if kind == 'live':
+            return {'num': index + 1, 'name': name, 'stream_type': 'live', 'stream_id': index + 1,
+                    'stream_icon': f'http://icons.invalid/live/{index + 1}.png',
+                    'epg_channel_id': f'ch{index + 1}.bench', 'added': added, 'is_adult': '0',
+                    'category_id': category_id, 'custom_sid': '', 'tv_archive': 0, 'direct_source': ''}
+        if kind == 'vod':
+            return {'num': index + 1, 'name': name, 'title': name, 'stream_type': 'movie',
+                    'stream_id': 100000 + index + 1, 'stream_icon': f'http://icons.invalid/vod/{index + 1}.jpg',
+                    'rating': str(round(rng.uniform(1, 10), 1)), 'rating_5based': round(rng.uniform(0.5, 5), 1),
+                    'added': added, 'category_id': category_id, 'container_extension': 'mp4',
+                    'custom_sid': '', 'direct_source': '', 'year': str(1970 + rng.randrange(55))}
+        return {'num': index + 1, 'name': name, 'series_id': 200000 + index + 1,
+                'cover': f'http://icons.invalid/series/{index + 1}.jpg', 'plot': f'Plot of {name}.',
+                'cast': 'Bench Cast', 'director': 'Bench Director', 'genre': WORDS[index % len(WORDS)].title(),
+                'releaseDate': '2020-01-01', 'last_modified': added, 'rating': '7.5', 'rating_5based': 3.8,
+                'backdrop_path': [], 'youtube_trailer': '', 'episode_run_time': '45', 'category_id': category_id}
+
+    def action(self, action, params):
+        data = self.responses.get(action)
+        if data is None:
+            if action == 'get_series_info':
+                return self._series_info(params.get('series_id'))
+            if action == 'get_short_epg':
+                return self._short_epg(params.get('stream_id'), int(params.get('limit') or 4))
+            return []
+        category_id = params.get('category_id')
+        if category_id:
+            key = (action, category_id)
+            if key not in self._by_category:
+                self._by_category[key] = [item for item in data if item.get('category_id') == category_id]
+            return self._by_category[key]
+        return data
+
+    @staticmethod
+    def _series_info(series_id):
+        episodes = {str(season): [{
+            'id': f"{series_id}{season:02d}{episode:02d}", 'episode_num': episode, 'title': f"S{season}E{episode}",
+            'container_extension': 'mkv', 'season': season,
+            'info': {'duration_secs': 2700, 'movie_image': ''},
+        } for episode in range(1, 11)] for season in range(1, 4)}
+        return {'seasons': [{'season_number': season, 'name': f'Season {season}'} for season in range(1, 4)],
+                'info': {'name': f'Series {series_id}'}, 'episodes': episodes}
+
+    @staticmethod
+    def _short_epg(stream_id, limit):
+        now = int(time.time()) // 3600 * 3600
+        return {'epg_listings': [{
+            'id': f"{stream_id}-{slot}", 'epg_id': f"ch{stream_id}.bench", 'title': 'UHJvZ3JhbQ==',
+            'start_timestamp': str(now + slot * 3600), 'stop_timestamp': str(now + (slot + 1) * 3600),
+            'description': 'RGVzY3JpcHRpb24=',
+        } for slot in range(limit)]}
+
+
+class FakeXtreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeXtream/1.0'
+    # Null TS packets: sync byte followed by padding.
+    packet = bytes([0x47]) + bytes(187)
+    segment = packet * (SEGMENT_BYTES // 188)
+    chunk = packet * (STREAM_CHUNK_BYTES // 188)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _inject(self):
+        """Applies latency and failures; returns False when the request must fail."""
+        options = self.server.options
+        if options.latency_ms or options.jitter_ms:
+            time.sleep(max(0.0, random.gauss(options.latency_ms, options.jitter_ms)) / 1000)
+        if options.failure_rate and random.random() < options.failure_rate:
+            self._send(503, b'unavailable', 'text/plain')
+            return False
+        return True
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        parts = [part for part in parsed.path.split('/') if part]
+        if not self._inject():
+            return
+        if parts == ['player_api.php']:
+            return self._player_api(params)
+        if len(parts) == 4 and parts[0] in ('live', 'movie', 'series'):
+            if parts[1:3] != [USERNAME, PASSWORD]:
+                return self._send(403, b'forbidden', 'text/plain')
+            stream_id, _, extension = parts[3].partition('.')
+            if extension == 'm3u8':
+                return self._playlist(stream_id)
+            return self._stream()
+        if len(parts) == 3 and parts[0] == 'hls':
+            return self._send(200, self.segment, 'video/mp2t')
+        self._send(404, b'not found', 'text/plain')
+
+    def _player_api(self, params):
+        if params.get('username') != USERNAME or params.get('password') != PASSWORD:
+            return self._send(200, json.dumps({'user_info': {'auth': 0}}).encode(), 'application/json')
+        action = params.get('action')
+        if not action:
+            host, port = self.server.server_address[:2]
+            data = {
+                'user_info': {'username': USERNAME, 'password': PASSWORD, 'auth': 1, 'status': 'Active',
+                              'exp_date': str(int(time.time()) + 365 * 86400), 'is_trial': '0',
+                              'active_cons': '0', 'max_connections': str(self.server.options.max_connections),
+                              'allowed_output_formats': ['m3u8', 'ts']},
+                'server_info': {'url': host, 'port': str(port), 'server_protocol': 'http',
+                                'timezone': 'UTC', 'timestamp_now': int(time.time())},
+            }
+            body = json.dumps(data).encode()
+        elif action in self.server.catalog.responses:
+            # Catalog responses never change: encode each one once.
+            key = (action, params.get('category_id'))
+            body = self.server.encoded.get(key)
+            if body is None:
+                body = self.server.encoded[key] = json.dumps(self.server.catalog.action(action, params)).encode()
+            if self.server.options.etags:
+                etag = f'"{zlib.crc32(body):08x}"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, b'', 'application/json', {'ETag': etag})
+                return self._send(200, body, 'application/json', {'ETag': etag})
+        else:
+            body = json.dumps(self.server.catalog.action(action, params)).encode()
+        self._send(200, body, 'application/json')
+
+    def _playlist(self, stream_id):
+        # Live window that slides with the clock, like a real live edge.
+        sequence = int(time.time()) // SEGMENT_SECONDS
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}',
+                 f'#EXT-X-MEDIA-SEQUENCE:{sequence}']
+        for offset in range(PLAYLIST_SEGMENTS):
+            lines.append(f'#EXTINF:{SEGMENT_SECONDS}.000,')
+            lines.append(f'/hls/{stream_id}/{sequence + offset}.ts')
+        self._send(200, ('\n'.join(lines) + '\n').encode(), 'application/vnd.apple.mpegurl')
+
+    def _stream(self):
+        # Endless MPEG-TS until the client disconnects.
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp2t')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            while True:
+                self.wfile.write(self.chunk)
+                time.sleep(0.01)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+def make_server(options, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, options.port), FakeXtreamHandler)
+    server.daemon_threads = True
+    server.options = options
+    server.catalog = Catalog(options.live, options.vod, options.series, options.categories, options.seed)
+    server.encoded = {}
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--live', type=int, default=2000)
+    parser.add_argument('--vod', type=int, default=5000)
+    parser.add_argument('--series', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=40)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--max-connections', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--etags', action='store_true', help='send ETags on catalog responses and answer 304')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    server = make_server(parse_args(argv))
+    print(server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
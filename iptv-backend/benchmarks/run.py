@@ -0,0 +1,310 @@
+"""
+Benchmark runner.
+
+Starts the fake Xtream provider and the PostgREST stand-in as subprocesses,
+points the backend at them, serves the Flask app on a local port and runs
+the scenarios in order. The report (throughput, latency percentiles, bytes,
+errors and peak RSS per scenario) is printed as a table and written as
+sorted, rounded JSON so two runs can be diffed or compared directly:
+
+    cd iptv-backend
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --provider-latency-ms 120 --compare bench.json
+
+Peak RSS is the backend process (the harness client runs in it too; the
+fakes do not). Scenarios whose endpoints do not exist yet
+(UNAVAILABLE_SCENARIOS) are reported as skipped unless asked for with
+--scenarios, and a scenario with a step in which every request failed is
+reported as failed rather than timed.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks import fake_xtream
+from benchmarks.scenarios import CONNECTION_ID, SCENARIOS, UNAVAILABLE_SCENARIOS
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# supabase-py only accepts keys shaped like a JWT.
+FAKE_SUPABASE_KEY = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYmVuY2gifQ.bench'
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+
+def _current_rss_bytes():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux; only the process-wide peak is available.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _RssSampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss_bytes())
+
+
+def _start_fake(module, args):
+    process = subprocess.Popen([sys.executable, '-m', module, '--port', '0', *args],
+                               cwd=BACKEND_DIR, stdout=subprocess.PIPE, text=True)
+    port = int(process.stdout.readline())
+    return process, f'http://127.0.0.1:{port}'
+
+
+class Bench:
+    """The running system under test plus the sample recorder scenarios write to."""
+
+    def __init__(self, options):
+        self.options = options
+        self.app = None
+        self.base_url = None
+        self._samples = []
+        self._lock = threading.Lock()
+        self._processes = []
+        self._server = None
+
+    def start(self):
+        options = self.options
+        xtream, xtream_url = _start_fake('benchmarks.fake_xtream', [
+            '--live', str(options.live), '--vod', str(options.vod), '--series', str(options.series),
+            '--categories', str(options.categories), '--latency-ms', str(options.provider_latency_ms),
+            '--jitter-ms', str(options.provider_jitter_ms), '--failure-rate', str(options.failure_rate)])
+        postgrest, postgrest_url = _start_fake('benchmarks.fake_postgrest', [
+            '--latency-ms', str(options.db_latency_ms)])
+        self._processes = [xtream, postgrest]
+
+        requests.post(f'{postgrest_url}/rest/v1/xtream_connections', json={
+            'id': CONNECTION_ID, 'server_url': xtream_url, 'username': fake_xtream.USERNAME,
+            'password': fake_xtream.PASSWORD, 'user_info': {'max_connections': '4', 'status': 'Active'},
+            'server_info': {},
+        }).raise_for_status()
+
+        scratch = tempfile.mkdtemp(prefix='iptv-bench-')
+        os.environ.update({
+            'SUPABASE_URL': postgrest_url,
+            'SUPABASE_KEY': FAKE_SUPABASE_KEY,
+            'SESSION_SECRET_KEY': 'bench',
+            'IMAGE_CACHE_DIR': os.path.join(scratch, 'images'),
+            'PLAYLIST_CACHE_DIR': os.path.join(scratch, 'playlists'),
+            # Fresh shared cache and event log: another run's entries point at other fake ports.
+            'IPTV_DATA_DIR': os.path.join(scratch, 'data'),
+        })
+        # Imported only now: services read their configuration at import time.
+        from werkzeug.serving import make_server
+        from src.main import app
+
+        self.app = app
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self._server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.base_url = f'http://127.0.0.1:{self._server.server_port}'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+        # Background work (thumbnail prewarm, probes) fails noisily once the fakes are gone.
+        logging.disable(logging.CRITICAL)
+        for process in self._processes:
+            process.terminate()
+            process.wait()
+
+    def record(self, name, seconds, status, size=0):
+        with self._lock:
+            self._samples.append((name, seconds, status, size))
+
+    def request(self, session, method, path, name, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, self.base_url + path, timeout=self.options.timeout, **kwargs)
+            size = len(response.content)
+            self.record(name, time.perf_counter() - started, response.status_code, size)
+            return response
+        except requests.exceptions.RequestException:
+            self.record(name, time.perf_counter() - started, 0)
+            raise
+
+    def run_scenario(self, name):
+        with self._lock:
+            self._samples = []
+        started = time.perf_counter()
+        error = None
+        with _RssSampler() as rss:
+            try:
+                SCENARIOS[name](self)
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            samples = list(self._samples)
+        return summarize(samples, elapsed, rss.peak, error)
+
+
+def _stats(samples, elapsed):
+    latencies = [seconds for _, seconds, _, _ in samples]
+    stats = {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, status, _ in samples if not 200 <= status < 400),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0,
+        'bytes': sum(size for _, _, _, size in samples),
+        'max_ms': round(max(latencies) * 1000, 2) if latencies else None,
+    }
+    for fraction in PERCENTILES:
+        value = percentile(latencies, fraction)
+        stats[f'p{int(fraction * 100)}_ms'] = round(value * 1000, 2) if value is not None else None
+    return stats
+
+
+def summarize(samples, elapsed, peak_rss, error=None):
+    by_name = {}
+    for sample in samples:
+        by_name.setdefault(sample[0], []).append(sample)
+    total = _stats(samples, elapsed)
+    requests_stats = {name: _stats(group, elapsed) for name, group in sorted(by_name.items())}
+    # A step that only got error responses timed nothing worth reporting.
+    broken = [f"{name} {stats['errors']}/{stats['requests']}" for name, stats in requests_stats.items()
+              if stats['requests'] and stats['errors'] == stats['requests']]
+    if error is None and broken:
+        error = f"every request failed for {', '.join(broken)}"
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'peak_rss_mb': round(peak_rss / (1024 * 1024), 1),
+        'status': 'failed' if error else 'ok',
+        'error': error,
+        'total': total,
+        'requests': requests_stats,
+    }
+
+
+def format_report(report, baseline=None):
+    lines = [f"{'scenario / request':<36}{'req':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p90 ms':>10}"
+             f"{'p99 ms':>10}{'MB':>9}{'RSS MB':>9}"]
+    for scenario, result in report['scenarios'].items():
+        rows = [(scenario, result['total'], result['peak_rss_mb'])]
+        rows += [(f'  {name}', stats, None) for name, stats in result['requests'].items()]
+        for label, stats, rss in rows:
+            line = (f"{label:<36}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput_rps']:>9}"
+                    f"{_fmt(stats['p50_ms']):>10}{_fmt(stats['p90_ms']):>10}{_fmt(stats['p99_ms']):>10}"
+                    f"{stats['bytes'] / (1024 * 1024):>9.1f}{_fmt(rss):>9}")
+            lines.append(line)
+            base = _baseline_stats(baseline, scenario, label.strip(), rss is not None)
+            if base:
+                lines.append(f"{'    vs baseline':<36}{'':>7}{'':>6}{_delta(stats, base, 'throughput_rps'):>9}"
+                             f"{_delta(stats, base, 'p50_ms'):>10}{_delta(stats, base, 'p90_ms'):>10}"
+                             f"{_delta(stats, base, 'p99_ms'):>10}")
+        if result['error']:
+            lines.append(f"  ! {result['status']}: {result['error']}")
+    for scenario, reason in report.get('skipped', {}).items():
+        lines.append(f"{scenario:<36}skipped: {reason}")
+    return '\n'.join(lines)
+
+
+def _fmt(value):
+    return '-' if value is None else value
+
+
+def _baseline_stats(baseline, scenario, name, is_total):
+    result = (baseline or {}).get('scenarios', {}).get(scenario)
+    if not result:
+        return None
+    return result['total'] if is_total else result['requests'].get(name)
+
+
+def _delta(stats, base, key):
+    if not stats.get(key) or not base.get(key):
+        return '-'
+    return f"{(stats[key] - base[key]) / base[key] * 100:+.0f}%"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(name for name in SCENARIOS if name not in UNAVAILABLE_SCENARIOS),
+                        help='comma-separated, run in this order (full_sync first fills the catalog); '
+                             f"not run by default: {', '.join(UNAVAILABLE_SCENARIOS)}")
+    parser.add_argument('--users', type=int, default=8, help='concurrent frontend users per scenario')
+    parser.add_argument('--viewers', type=int, default=8, help='concurrent viewers for proxy_viewers')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of viewing for proxy_viewers')
+    parser.add_argument('--categories-per-user', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=3, help='pages opened per category')
+    parser.add_argument('--live', type=int, default=2000)
+    parser.add_argument('--vod', type=int, default=5000)
+    parser.add_argument('--series', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=40)
+    parser.add_argument('--provider-latency-ms', type=float, default=50)
+    parser.add_argument('--provider-jitter-ms', type=float, default=10)
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--db-latency-ms', type=float, default=5)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='JSON report of a previous run to compare against')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    names = [name.strip() for name in options.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    bench = Bench(options)
+    report = {
+        'options': {key: value for key, value in sorted(vars(options).items()) if key not in ('output', 'compare')},
+        'scenarios': {},
+        'skipped': {name: reason for name, reason in UNAVAILABLE_SCENARIOS.items() if name not in names},
+    }
+    try:
+        bench.start()
+        for name in names:
+            print(f"running {name}...", file=sys.stderr, flush=True)
+            report['scenarios'][name] = bench.run_scenario(name)
+    finally:
+        bench.stop()
+    report['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print(format_report(report, baseline))
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+            output_file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
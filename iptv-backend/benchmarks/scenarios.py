@@ -0,0 +1,133 @@
+"""
+Scripted scenarios that replay what the frontend does against the backend.
+
+Each scenario takes the running Bench (see run.py) and issues its requests
+through bench.request(), which records latency, status and bytes per
+request name.
+"""
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+CONNECTION_ID = 1
+SEARCH_TERMS = ('sport', 'news', 'movie', 'documentary')
+# The frontend waits this long after a keystroke before searching.
+TYPING_INTERVAL_SECONDS = 0.15
+# EPGScreen lists 20 live channels and fetches the EPG of the first 10.
+EPG_LIST_SIZE = 20
+EPG_CHANNELS = 10
+
+
+def _run_users(count, target):
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        for future in [pool.submit(target, user) for user in range(count)]:
+            future.result()
+
+
+def full_sync(bench):
+    """One full live, VOD and series sync, timed per content type."""
+    from src.services.xtream_service import XtreamService
+
+    service = XtreamService(bench.app)
+    for content_type, sync in (('live', service.sync_live_data), ('vod', service.sync_vod_data),
+                               ('series', service.sync_series_data)):
+        started = time.perf_counter()
+        result = sync(CONNECTION_ID)
+        bench.record(f'sync {content_type}', time.perf_counter() - started,
+                     200 if result.get('success') else 500)
+
+
+def category_browse(bench):
+    """CategoryBrowser: list categories, open some, page through each 500 at a time."""
+    def user(index):
+        session = requests.Session()
+        rng = random.Random(index)
+        for content_type in ('live', 'vod', 'series'):
+            response = bench.request(session, 'GET', f'/api/iptv/categories/{CONNECTION_ID}/{content_type}',
+                                     f'categories {content_type}')
+            categories = response.json().get('categories', []) if response.ok else []
+            for category in rng.sample(categories, min(len(categories), bench.options.categories_per_user)):
+                for page in range(1, bench.options.pages + 1):
+                    response = bench.request(
+                        session, 'GET', f'/api/iptv/streams/{CONNECTION_ID}/{content_type}',
+                        f'streams {content_type}',
+                        params={'category_id': category['category_id'], 'page': page, 'limit': 500})
+                    if not response.ok or len(response.json().get('streams', [])) < 500:
+                        break
+
+    _run_users(bench.options.users, user)
+
+
+def epg_grid(bench):
+    """EPGScreen: 20 live channels, then one EPG call for each of the first 10."""
+    def user(index):
+        session = requests.Session()
+        response = bench.request(session, 'GET', f'/api/iptv/streams/{CONNECTION_ID}/live', 'epg channels',
+                                 params={'limit': EPG_LIST_SIZE})
+        channels = response.json().get('streams', [])[:EPG_CHANNELS] if response.ok else []
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            list(pool.map(lambda channel: bench.request(
+                session, 'GET', f"/api/iptv/epg/{CONNECTION_ID}/{channel['stream_id']}", 'epg channel'), channels))
+
+    _run_users(bench.options.users, user)
+
+
+def search_typing(bench):
+    """SearchScreen: one search per keystroke, live/vod/series in parallel."""
+    def user(index):
+        session = requests.Session()
+        term = SEARCH_TERMS[index % len(SEARCH_TERMS)]
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            for length in range(1, len(term) + 1):
+                query = term[:length]
+                list(pool.map(lambda content_type: bench.request(
+                    session, 'GET', f'/api/iptv/search/{CONNECTION_ID}/{content_type}', f'search {content_type}',
+                    params={'q': query}), ('live', 'vod', 'series')))
+                time.sleep(TYPING_INTERVAL_SECONDS)
+
+    _run_users(bench.options.users, user)
+
+
+def proxy_viewers(bench):
+    """N viewers on HLS channels through /proxy: poll the playlist, fetch new segments."""
+    deadline = time.monotonic() + bench.options.duration
+
+    def viewer(index):
+        session = requests.Session()
+        response = bench.request(session, 'GET', f'/api/iptv/stream-url/{CONNECTION_ID}/{index + 1}', 'stream-url',
+                                 params={'type': 'live'})
+        if not response.ok:
+            return
+        playlist_url = f"/api/iptv/proxy?url={quote(response.json()['url'], safe='')}"
+        seen = set()
+        while time.monotonic() < deadline:
+            response = bench.request(session, 'GET', playlist_url, 'proxy playlist')
+            if response.ok:
+                for segment in re.findall(r'^/api/iptv/proxy/s/\S+$', response.text, re.M):
+                    if segment not in seen:
+                        seen.add(segment)
+                        bench.request(session, 'GET', segment, 'proxy segment')
+            time.sleep(1)
+
+    _run_users(bench.options.viewers, viewer)
+
+
+# Scenarios whose endpoints the backend does not serve yet. They only time
+# error responses, so the default run leaves them out; asked for explicitly
+# they run and are reported as failed when every request errors.
+UNAVAILABLE_SCENARIOS = {
+    'epg_grid': 'no /api/iptv/epg route in the backend',
+    'search_typing': 'search_streams is not implemented',
+}
+
+SCENARIOS = {
+    'full_sync': full_sync,
+    'category_browse': category_browse,
+    'epg_grid': epg_grid,
+    'search_typing': search_typing,
+    'proxy_viewers': proxy_viewers,
+}
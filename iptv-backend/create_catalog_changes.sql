@@ -0,0 +1,22 @@
+-- Log de alterações do catálogo usado pelo endpoint /changes (sync incremental).
+-- Cada item aparece no máximo uma vez por conexão: o sync faz upsert em
+-- (connection_id, entity, item_key), o que compacta o log automaticamente.
+
+CREATE TABLE IF NOT EXISTS public.catalog_versions (
+    connection_id BIGINT PRIMARY KEY REFERENCES public.xtream_connections(id) ON DELETE CASCADE,
+    version BIGINT NOT NULL DEFAULT 0,
+    compacted_through BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS public.catalog_changes (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    connection_id BIGINT REFERENCES public.xtream_connections(id) ON DELETE CASCADE,
+    version BIGINT NOT NULL,
+    entity TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    op TEXT NOT NULL,
+    UNIQUE(connection_id, entity, item_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_catalog_changes_connection_version ON public.catalog_changes (connection_id, version);
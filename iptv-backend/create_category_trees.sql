@@ -0,0 +1,23 @@
+-- Árvore de categorias pré-calculada no sync (src/services/category_tree.py).
+-- Um documento por (conexão, tipo) com as categorias na ordem do provedor,
+-- contagem de itens (própria e da subárvore), flag de conteúdo adulto, capa
+-- do primeiro item e filhos de cada categoria. /categories serve esse
+-- documento numa única leitura.
+
+ALTER TABLE public.sync_category_state
+    ADD COLUMN IF NOT EXISTS adult BOOLEAN,
+    ADD COLUMN IF NOT EXISTS artwork TEXT;
+
+-- is_adult de filmes e séries, antes só guardado nos canais ao vivo.
+ALTER TABLE public.vod_streams ADD COLUMN IF NOT EXISTS is_adult TEXT;
+ALTER TABLE public.series ADD COLUMN IF NOT EXISTS is_adult TEXT;
+
+CREATE TABLE IF NOT EXISTS public.category_trees (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    connection_id BIGINT REFERENCES public.xtream_connections(id) ON DELETE CASCADE,
+    content_type TEXT NOT NULL,
+    version INT NOT NULL DEFAULT 0,
+    tree JSONB NOT NULL DEFAULT '{}'::jsonb,
+    built_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(connection_id, content_type)
+);
@@ -0,0 +1,45 @@
+-- Temporadas e episódios materializados pelo crawler de episódios
+-- (src/services/episode_crawler.py), a partir de get_series_info.
+-- series_crawl_state guarda o last_modified de cada série já visitada, para
+-- que só séries alteradas sejam buscadas novamente.
+
+CREATE TABLE IF NOT EXISTS public.series_seasons (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    connection_id BIGINT REFERENCES public.xtream_connections(id) ON DELETE CASCADE,
+    series_id BIGINT NOT NULL,
+    season_number INT NOT NULL,
+    name TEXT,
+    episode_count INT,
+    cover TEXT,
+    air_date TEXT,
+    overview TEXT,
+    UNIQUE(connection_id, series_id, season_number)
+);
+
+CREATE TABLE IF NOT EXISTS public.series_episodes (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    connection_id BIGINT REFERENCES public.xtream_connections(id) ON DELETE CASCADE,
+    series_id BIGINT NOT NULL,
+    episode_id TEXT NOT NULL,
+    season_number INT NOT NULL,
+    episode_num INT,
+    title TEXT,
+    container_extension TEXT,
+    duration_secs INT,
+    added TEXT,
+    info JSONB,
+    UNIQUE(connection_id, episode_id)
+);
+
+-- Próximo episódio e listagem por temporada: busca direta no índice.
+CREATE INDEX IF NOT EXISTS idx_series_episodes_order ON public.series_episodes (connection_id, series_id, season_number, episode_num);
+
+CREATE TABLE IF NOT EXISTS public.series_crawl_state (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    connection_id BIGINT REFERENCES public.xtream_connections(id) ON DELETE CASCADE,
+    series_id BIGINT NOT NULL,
+    last_modified TEXT,
+    episode_count INT NOT NULL DEFAULT 0,
+    crawled_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(connection_id, series_id)
+);
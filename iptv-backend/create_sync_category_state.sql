@@ -0,0 +1,18 @@
+-- Estado de cada categoria após o último sync (src/services/sync_planner.py).
+-- O planejador compara a lista de categorias com este estado e só baixa as
+-- categorias novas, as que o provedor não confirma como inalteradas (304 via
+-- ETag/Last-Modified) e uma fração rotativa das demais para verificação.
+
+CREATE TABLE IF NOT EXISTS public.sync_category_state (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    connection_id BIGINT REFERENCES public.xtream_connections(id) ON DELETE CASCADE,
+    content_type TEXT NOT NULL,
+    category_id TEXT NOT NULL,
+    item_count INT NOT NULL DEFAULT 0,
+    max_added BIGINT,
+    content_hash TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    verified_at TIMESTAMPTZ,
+    UNIQUE(connection_id, content_type, category_id)
+);
@@ -0,0 +1,15 @@
+-- Preferências do usuário (favoritos, recentes e configurações do player).
+-- Gravadas em lote pelo PreferencesStore (write-behind), uma linha por usuário.
+CREATE TABLE IF NOT EXISTS public.user_preferences (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    user_id TEXT NOT NULL DEFAULT 'default',
+    favorite_channels TEXT,
+    recent_channels TEXT,
+    quality_preference TEXT DEFAULT 'auto',
+    volume_level REAL DEFAULT 1.0,
+    subtitle_enabled BOOLEAN DEFAULT FALSE,
+    subtitle_language TEXT DEFAULT 'pt',
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(user_id)
+);
@@ -3,6 +3,7 @@ from flask import Flask, jsonify
 from flask_cors import CORS
 from src.routes.iptv import iptv_bp
 from src.routes.user import user_bp
+from src.services import metrics, profiler
 
 app = Flask(__name__)
 
@@ -13,6 +14,11 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
 app.register_blueprint(iptv_bp, url_prefix='/api/iptv')
 app.register_blueprint(user_bp, url_prefix='/api/user')
 
+# Request timing and the Prometheus endpoint at /metrics
+metrics.init_app(app)
+# Opt-in request profiling (PROFILE_TOKEN / PROFILE_SAMPLE_RATE)
+profiler.init_app(app)
+
 @app.route('/')
 def index():
     return jsonify({'message': 'IPTV Backend is running'})
\ No newline at end of file
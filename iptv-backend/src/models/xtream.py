@@ -13,6 +13,9 @@ class XtreamConnection(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_used = db.Column(db.DateTime, default=datetime.utcnow)
     last_synced_at = db.Column(db.DateTime, nullable=True)
+    # Catálogo compartilhado com outra conexão do mesmo provedor (ver shared_catalog.py)
+    catalog_owner_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id', ondelete='SET NULL'), nullable=True)
+    catalog_fingerprint = db.Column(db.Text)  # JSON string
     
     # Informações do servidor
     server_info = db.Column(db.Text)  # JSON string
@@ -38,10 +41,15 @@ class XtreamConnection(db.Model):
 
 class Category(db.Model):
     __tablename__ = 'categories'
+    __table_args__ = (
+        # Upsert key of the sync; its (connection_id, stream_type) prefix also
+        # serves the dashboard counts (idx_categories_connection_id).
+        db.UniqueConstraint('connection_id', 'stream_type', 'category_id', name='uq_categories_connection_type_category'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     category_id = db.Column(db.String(50), nullable=False)
-    category_name = db.Column(db.String(255), nullable=False)
+    category_name = db.Column(db.String(255))
     parent_id = db.Column(db.Integer, nullable=True)
     stream_type = db.Column(db.String(50), nullable=False) # New field: live, movie, series
     connection_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id'), nullable=False)
@@ -50,10 +58,25 @@ class Category(db.Model):
 
 class Channel(db.Model):
     __tablename__ = 'channels'
+    __table_args__ = (
+        # Upsert key of the sync; its prefix covers idx_channels_connection_stream_type.
+        db.UniqueConstraint('connection_id', 'stream_type', 'stream_id', name='uq_channels_connection_type_stream'),
+        # Category pages, keyset-paginated by id.
+        db.Index('idx_channels_connection_type_category', 'connection_id', 'stream_type', 'category_id', 'id'),
+        # StreamProber batches and the ?alive=1 / ?sort=latency listing.
+        db.Index('idx_channels_connection_type_probed_at', 'connection_id', 'stream_type', 'probed_at'),
+        db.Index('idx_channels_connection_type_alive_latency', 'connection_id', 'stream_type', 'alive', 'probe_latency_ms'),
+        # ?sort=added|rating|year rails, keyset-paginated by (value, id), whole catalog and per category.
+        *(db.Index(f'idx_channels_connection_type_{column}', 'connection_id', 'stream_type', column, 'id')
+          for column in ('added_at', 'rating_value', 'release_year')),
+        *(db.Index(f'idx_channels_connection_type_category_{column}', 'connection_id', 'stream_type', 'category_id',
+                   column, 'id')
+          for column in ('added_at', 'rating_value', 'release_year')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    stream_id = db.Column(db.String(50), nullable=False)
-    name = db.Column(db.String(255), nullable=False)
+    stream_id = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(255))
     stream_type = db.Column(db.String(50), nullable=False)  # live, movie, series
     stream_icon = db.Column(db.String(500))
     epg_channel_id = db.Column(db.String(100))
@@ -64,6 +87,24 @@ class Channel(db.Model):
     direct_source = db.Column(db.String(500))
     tv_archive_duration = db.Column(db.Integer, default=0)
     connection_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id'), nullable=False)
+
+    # Campos de VOD/séries usados em filtros e ordenação
+    num = db.Column(db.Integer)
+    title = db.Column(db.String(255))
+    is_adult = db.Column(db.String(10))
+    container_extension = db.Column(db.String(20))
+    rating = db.Column(db.String(20))
+    rating_5based = db.Column(db.Float)
+    year = db.Column(db.String(10))
+    # Versões tipadas de added/rating/year, preenchidas pelo sync para ordenação
+    added_at = db.Column(db.BigInteger)
+    rating_value = db.Column(db.Float)
+    release_year = db.Column(db.Integer)
+
+    # Disponibilidade, preenchida pelo StreamProber
+    alive = db.Column(db.Boolean)
+    probe_latency_ms = db.Column(db.Integer)
+    probed_at = db.Column(db.DateTime)
     
     # Informações adicionais
     extra_info = db.Column(db.Text)  # JSON string para informações extras
@@ -82,6 +123,9 @@ class Channel(db.Model):
 
 class EPGProgram(db.Model):
     __tablename__ = 'epg_programs'
+    __table_args__ = (
+        db.Index('idx_epg_programs_connection_channel_start', 'connection_id', 'channel_id', 'start_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     epg_id = db.Column(db.String(100), nullable=False)
@@ -99,7 +143,7 @@ class UserPreferences(db.Model):
     __tablename__ = 'user_preferences'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String(100), nullable=False, default='default')
+    user_id = db.Column(db.String(100), nullable=False, default='default', unique=True)
     favorite_channels = db.Column(db.Text)  # JSON array de stream_ids
     recent_channels = db.Column(db.Text)    # JSON array de stream_ids
     quality_preference = db.Column(db.String(20), default='auto')  # auto, 4k, fullhd, hd, sd
@@ -128,3 +172,104 @@ class UserPreferences(db.Model):
         except json.JSONDecodeError:
             return []
 
+class CatalogVersion(db.Model):
+    __tablename__ = 'catalog_versions'
+
+    connection_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id'), primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    compacted_through = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CatalogChange(db.Model):
+    __tablename__ = 'catalog_changes'
+    __table_args__ = (
+        db.UniqueConstraint('connection_id', 'entity', 'item_key', name='uq_catalog_changes_connection_entity_item'),
+        db.Index('idx_catalog_changes_connection_version', 'connection_id', 'version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    entity = db.Column(db.String(50), nullable=False)
+    item_key = db.Column(db.String(100), nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+
+class SyncCategoryState(db.Model):
+    __tablename__ = 'sync_category_state'
+    __table_args__ = (
+        db.UniqueConstraint('connection_id', 'content_type', 'category_id', name='uq_sync_category_state'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id'), nullable=False)
+    content_type = db.Column(db.String(10), nullable=False)
+    category_id = db.Column(db.String(50), nullable=False)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    max_added = db.Column(db.BigInteger)
+    content_hash = db.Column(db.String(40))
+    adult = db.Column(db.Boolean)
+    artwork = db.Column(db.String(500))
+    etag = db.Column(db.String(255))
+    last_modified = db.Column(db.String(64))
+    verified_at = db.Column(db.DateTime)
+
+class SeriesSeason(db.Model):
+    __tablename__ = 'series_seasons'
+    __table_args__ = (
+        db.UniqueConstraint('connection_id', 'series_id', 'season_number', name='uq_series_seasons'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id'), nullable=False)
+    series_id = db.Column(db.Integer, nullable=False)
+    season_number = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(255))
+    episode_count = db.Column(db.Integer)
+    cover = db.Column(db.String(500))
+    air_date = db.Column(db.String(50))
+    overview = db.Column(db.Text)
+
+class SeriesEpisode(db.Model):
+    __tablename__ = 'series_episodes'
+    __table_args__ = (
+        db.UniqueConstraint('connection_id', 'episode_id', name='uq_series_episodes'),
+        db.Index('idx_series_episodes_order', 'connection_id', 'series_id', 'season_number', 'episode_num'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id'), nullable=False)
+    series_id = db.Column(db.Integer, nullable=False)
+    episode_id = db.Column(db.String(50), nullable=False)
+    season_number = db.Column(db.Integer, nullable=False)
+    episode_num = db.Column(db.Integer)
+    title = db.Column(db.String(255))
+    container_extension = db.Column(db.String(10))
+    duration_secs = db.Column(db.Integer)
+    added = db.Column(db.String(50))
+    info = db.Column(db.Text)  # JSON string
+
+class SeriesCrawlState(db.Model):
+    __tablename__ = 'series_crawl_state'
+    __table_args__ = (
+        db.UniqueConstraint('connection_id', 'series_id', name='uq_series_crawl_state'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id'), nullable=False)
+    series_id = db.Column(db.Integer, nullable=False)
+    last_modified = db.Column(db.String(50))
+    episode_count = db.Column(db.Integer, nullable=False, default=0)
+    crawled_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CategoryTree(db.Model):
+    __tablename__ = 'category_trees'
+    __table_args__ = (
+        db.UniqueConstraint('connection_id', 'content_type', name='uq_category_trees'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey('xtream_connections.id'), nullable=False)
+    content_type = db.Column(db.String(10), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    tree = db.Column(db.Text)  # JSON string
+    built_at = db.Column(db.DateTime, default=datetime.utcnow)
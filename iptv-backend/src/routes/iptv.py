@@ -1,12 +1,26 @@
 # Test comment to trigger Vercel deployment
-from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app, send_file
 from urllib.parse import urljoin
 import requests
 import urllib3
 import os
+import json
+import time
 import logging
+import threading
 from concurrent.futures import ThreadPoolExecutor
+from src.services import upstream
+from src.services.circuit_breaker import circuit_breakers
+from src.services.hls_optimizer import optimize_playlist, playlist_options
+from src.services.image_cache import image_cache
+from src.services.m3u_export import EXPORT_TYPES, M3UExporter
+from src.services.metrics import log_event, metrics, preview
+from src.services.preferences import preferences_store
+from src.services.segment_tokens import segment_tokens
+from src.services.stream_prober import free_connections
+from src.services.sync_events import sync_events
 from src.services.xtream_service import XtreamService
+from src.services.zapping import MAX_WARM_STREAMS, is_hls_content_type, zapping_accelerator
 from flask_cors import CORS # Import CORS
 from concurrent.futures import ThreadPoolExecutor
 
@@ -16,6 +30,23 @@ CORS(iptv_bp) # Apply CORS to the blueprint
 # Executor for background tasks
 executor = ThreadPoolExecutor(max_workers=2)
 
+# Imagens processadas nunca mudam para a mesma URL/largura
+IMAGE_MAX_AGE_SECONDS = 30 * 24 * 3600
+
+# Comentário enviado aos clientes SSE ociosos, para proxies não fecharem a conexão
+SSE_HEARTBEAT_SECONDS = 20
+# Cada cliente SSE ocupa uma thread do worker enquanto está conectado: limite por
+# processo e duração máxima do stream (o EventSource reconecta com Last-Event-ID)
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 100))
+SSE_MAX_STREAM_SECONDS = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 300))
+SSE_RECONNECT_MS = 5000
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_SUBSCRIBERS)
+
+# Leitura de streams de mídia: fixa, pois um stream ao vivo pode demorar a começar
+# ou engasgar alguns segundos, bem acima do p99 das playlists e da API do host
+MEDIA_READ_TIMEOUT_SECONDS = int(os.environ.get('MEDIA_READ_TIMEOUT_SECONDS', 30))
+PLAYLIST_EXTENSIONS = ('.m3u8', '.m3u')
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 def get_xtream_service():
@@ -77,12 +108,112 @@ def request_sync_granular(content_type, connection_id):
         return jsonify({'success': False, 'error': 'Tipo de conteúdo inválido para sincronização.'}), 400
 
     try:
-        executor.submit(sync_function, connection_id)
+        # ?full=1 baixa todas as categorias, ignorando o planejamento incremental
+        full = request.args.get('full', '').lower() in ('1', 'true', 'yes')
+        executor.submit(sync_function, connection_id, full)
         return jsonify({'success': True, 'message': f"{message} Pode levar alguns minutos para ser concluída."}), 202
     except Exception as e:
         logging.error(f"Failed to submit sync job for {content_type} for connection {connection_id}: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@iptv_bp.route('/import_m3u/<int:connection_id>', methods=['POST'])
+def import_m3u(connection_id):
+    """Importa uma playlist M3U/M3U8 como catálogo da conexão, em segundo plano."""
+    data = request.get_json() or {}
+    url = data.get('url', '')
+    if not url.startswith(('http://', 'https://')):
+        return jsonify({'success': False, 'error': 'URL da playlist inválida.'}), 400
+
+    try:
+        executor.submit(get_xtream_service().import_m3u_playlist, connection_id, url)
+        return jsonify({'success': True, 'message': "Importação da playlist iniciada em segundo plano."}), 202
+    except Exception as e:
+        logging.error(f"Failed to submit M3U import for connection {connection_id}: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@iptv_bp.route('/changes/<int:connection_id>', methods=['GET'])
+def get_changes(connection_id):
+    """Retorna as alterações do catálogo desde a versão que o cliente possui."""
+    try:
+        since = request.args.get('since', 0, type=int)
+        result = get_xtream_service().get_catalog_changes(connection_id, since)
+        return jsonify(result), 200 if result.get('success') else 500
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@iptv_bp.route('/events/<int:connection_id>', methods=['GET'])
+def sync_event_stream(connection_id):
+    """
+    Canal SSE da conexão: progresso dos syncs ('sync'), novas versões do
+    catálogo ('catalog', buscar /changes?since=) e episódios atualizados
+    ('episodes'). Com Last-Event-ID os eventos perdidos são reenviados; se
+    forem muitos, chega um 'resync' e o cliente recarrega tudo.
+
+    Cada cliente prende uma thread do worker: em produção o endpoint exige
+    workers gevent ou com threads (gunicorn -k gevent, ou --threads N); com
+    workers sync, poucas abas abertas bloqueiam todas as outras requisições.
+    Por processo são no máximo SSE_MAX_SUBSCRIBERS clientes (acima disso, 503
+    com Retry-After), e cada stream termina após SSE_MAX_STREAM_SECONDS com
+    um 'retry:' para o cliente reconectar.
+    """
+    if not _sse_slots.acquire(blocking=False):
+        response = jsonify({'success': False, 'error': 'Muitos clientes de eventos conectados'})
+        response.headers['Retry-After'] = str(SSE_RECONNECT_MS // 1000)
+        return response, 503
+    try:
+        return _sync_event_stream(connection_id)
+    except Exception:
+        _sse_slots.release()
+        raise
+
+def _sync_event_stream(connection_id):
+    service = get_xtream_service()
+    catalog_id = service.catalog_id(connection_id)
+    hello = {'catalog_id': catalog_id, 'version': service.get_catalog_version(connection_id)}
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is None:
+        last_event_id = request.args.get('last_event_id', type=int)
+
+    def stream():
+        subscription = sync_events.subscribe({connection_id, catalog_id}, last_event_id)
+        last_seq = last_event_id or 0
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        try:
+            yield f"retry: {SSE_RECONNECT_MS}\nevent: hello\ndata: {json.dumps(hello)}\n\n"
+            while True:
+                if subscription.overflowed:
+                    yield "event: resync\ndata: {}\n\n"
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Libera a thread; o cliente volta com Last-Event-ID e nada se perde
+                    yield f"retry: {SSE_RECONNECT_MS}\n\n"
+                    return
+                event = subscription.next(min(SSE_HEARTBEAT_SECONDS, remaining))
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                seq, channel, name, data = event
+                if seq <= last_seq:
+                    # Já entregue pelo replay
+                    continue
+                last_seq = seq
+                if name == 'catalog' and channel == connection_id:
+                    # A conexão passou a compartilhar (ou deixou de compartilhar) um catálogo
+                    moved_to = json.loads(data).get('catalog_id')
+                    if moved_to is not None:
+                        sync_events.resubscribe(subscription, {connection_id, moved_to})
+                yield f"id: {seq}\nevent: {name}\ndata: {data}\n\n"
+        finally:
+            sync_events.unsubscribe(subscription)
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Chamado pelo servidor ao fim da resposta, mesmo se o stream nunca começou
+    response.call_on_close(_sse_slots.release)
+    return response
+
 @iptv_bp.route('/categories/<int:connection_id>/<category_type>', methods=['GET'])
 def get_categories(connection_id, category_type):
     """Busca categorias por tipo (live, vod, series) do Supabase"""
@@ -108,11 +239,16 @@ def get_streams(connection_id, stream_type):
         limit = request.args.get('limit', 50, type=int) # Add limit parameter
 
         if stream_type == 'live':
-            result = get_xtream_service().get_live_streams(connection_id, category_id, page)
+            only_alive = request.args.get('alive') in ('1', 'true')
+            sort = request.args.get('sort')
+            result = get_xtream_service().get_live_streams(connection_id, category_id, page, only_alive=only_alive, sort=sort)
         elif stream_type == 'vod':
-            result = get_xtream_service().get_vod_streams(connection_id, category_id, page)
+            # sort=added|rating|year: listas ordenadas, paginadas por ?cursor=
+            result = get_xtream_service().get_vod_streams(connection_id, category_id, page,
+                                                          sort=request.args.get('sort'), cursor=request.args.get('cursor'))
         elif stream_type == 'series':
-            result = get_xtream_service().get_series(connection_id, category_id, page, limit)
+            result = get_xtream_service().get_series(connection_id, category_id, page, limit,
+                                                     sort=request.args.get('sort'), cursor=request.args.get('cursor'))
         else:
             return jsonify({'success': False, 'error': 'Tipo de stream inválido'}), 400
         
@@ -123,6 +259,15 @@ def get_streams(connection_id, stream_type):
         print(traceback_str)
         return jsonify({'success': False, 'error': str(e), 'traceback': traceback_str}), 500
 
+@iptv_bp.route('/probe/<int:connection_id>', methods=['POST'])
+def probe_streams(connection_id):
+    """Inicia a verificação em segundo plano dos canais ao vivo que estão fora do ar."""
+    try:
+        result = get_xtream_service().probe_live_streams(connection_id)
+        return jsonify(result), 202 if result.get('success') else 500
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @iptv_bp.route('/search/<int:connection_id>/<stream_type>', methods=['GET'])
 def search(connection_id, stream_type):
     """Searches for streams by name."""
@@ -141,8 +286,11 @@ def get_stream_details():
         stream_ids = data.get('stream_ids', [])
         if not stream_ids:
             return jsonify({'success': True, 'streams': []})
-            
-        result = get_xtream_service().get_streams_by_ids(stream_ids)
+        connection_id = data.get('connection_id')
+        if connection_id is None:
+            return jsonify({'success': False, 'error': 'connection_id é obrigatório.'}), 400
+
+        result = get_xtream_service().get_streams_by_ids(int(connection_id), stream_ids)
         return jsonify(result), 200 if result.get('success') else 500
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -167,66 +315,167 @@ def get_stream_url(connection_id, stream_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@iptv_bp.route('/stream-urls/<int:connection_id>', methods=['POST'])
+def get_stream_urls(connection_id):
+    """Gera as URLs de todos os canais visíveis numa única chamada"""
+    try:
+        data = request.get_json() or {}
+        stream_ids = data.get('stream_ids', [])
+        stream_type = data.get('type', 'live')
+        result = get_xtream_service().get_stream_urls(connection_id, stream_ids, stream_type, data.get('container'))
+        return jsonify(result), 200 if result['success'] else 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@iptv_bp.route('/warmup/<int:connection_id>', methods=['POST'])
+def warmup(connection_id):
+    """Pré-carrega a playlist dos canais vizinhos ao atual para acelerar a troca de canal"""
+    try:
+        data = request.get_json() or {}
+        service = get_xtream_service()
+        # Cada pré-carga ocupa uma conexão da conta: só as livres, sempre deixando uma para o espectador
+        limit = min(MAX_WARM_STREAMS, free_connections(service, connection_id))
+        if limit <= 0:
+            return jsonify({'success': True, 'queued': 0, 'skipped': 'no free connection'}), 202
+        stream_ids = data.get('stream_ids', [])[:limit]
+        result = service.get_stream_urls(connection_id, stream_ids, data.get('type', 'live'), 'm3u8')
+        if not result['success']:
+            return jsonify(result), 400
+        queued = zapping_accelerator.warm(list(result['urls'].values()), limit)
+        return jsonify({'success': True, 'queued': queued}), 202
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _rewrite_playlist(playlist_content, url, options=None):
+    """
+    Reescreve as URLs dos segmentos de uma playlist HLS para passarem pelo proxy,
+    como caminhos curtos assinados (segment_tokens): sem credenciais do provedor
+    e sem a URL completa codificada em cada linha. Antes disso aplica as opções
+    do hls_optimizer (variantes pela qualidade, janela ao vivo curta), que seguem
+    junto com a base para as sub-playlists.
+    """
+    playlist_content = optimize_playlist(playlist_content, options)
+    base_url = url.rsplit('/', 1)[0] + '/'
+    # Um registro por diretório de segmentos, não por linha
+    base_ids = {}
+
+    new_playlist = []
+    for line in playlist_content.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            absolute_segment_url = urljoin(base_url, line)
+            path, sep, query = absolute_segment_url.partition('?')
+            directory, _, name = path.rpartition('/')
+            base_id = base_ids.get(directory)
+            if base_id is None:
+                base_id = base_ids[directory] = segment_tokens.register_base(directory + '/', options)
+            line = segment_tokens.segment_path(base_id, name + sep + query)
+        new_playlist.append(line)
+
+    return "\n".join(new_playlist)
+
 @iptv_bp.route('/proxy')
 def proxy():
     """Proxy para streams de vídeo que reescreve URLs de playlists HLS."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'success': False, 'error': 'URL é obrigatória'}), 400
+    # Resolvidas só se a resposta for uma playlist: segmentos e mídia não leem preferências
+    return _proxy(url, options=_playlist_options)
+
+def _playlist_options():
+    """
+    Opções do otimizador de playlists: ?quality= (auto, 4k, fullhd, hd, sd) e
+    ?live_segments= vindos do player; sem dica de qualidade vale a
+    quality_preference salva do usuário (?user_id=, 'default' por padrão).
+    """
+    quality = request.args.get('quality')
+    if not quality:
+        try:
+            user_id = request.args.get('user_id', 'default')
+            quality = preferences_store.get(get_xtream_service().supabase, user_id).get('quality_preference')
+        except Exception as e:
+            # Sem preferência o stream segue como o provedor envia
+            logging.info(f"Could not read the quality preference: {e}")
+    return playlist_options(quality, request.args.get('live_segments'))
+
+@iptv_bp.route('/proxy/s/<base_id>/<signature>/<path:path>')
+def proxy_segment(base_id, signature, path):
+    """Segmento (ou sub-playlist) de uma playlist reescrita, pelo caminho assinado."""
+    query = request.query_string.decode('utf-8', 'replace')
+    if not segment_tokens.verify(base_id, signature, path, query):
+        return jsonify({'success': False, 'error': 'Assinatura do segmento inválida'}), 403
+    resolved = segment_tokens.resolve(base_id, path, query)
+    if resolved is None:
+        # Base expirada: o player recarrega a playlist e recebe caminhos novos
+        return jsonify({'success': False, 'error': 'Segmento expirado, recarregue a playlist'}), 410
+    url, headers, options = resolved
+    return _proxy(url, headers, options)
+
+def _proxy(url, headers=None, options=None):
+    """`options` do hls_optimizer, ou uma função que as devolve, chamada só ao reescrever uma playlist."""
     try:
-        url = request.args.get('url')
-        if not url:
-            return jsonify({'success': False, 'error': 'URL é obrigatória'}), 400
-        
-        # Tenta extrair o domínio base da URL original para o Referer
+        is_playlist = url.split('?', 1)[0].lower().endswith(PLAYLIST_EXTENSIONS)
+        # Playlist já buscada pelo /warmup durante a troca de canal (só playlists são pré-carregadas;
+        # segmentos não consultam o cache compartilhado)
+        warm_playlist = zapping_accelerator.take_playlist(url) if is_playlist else None
+        if is_playlist:
+            metrics.cache_result('warm_playlist', warm_playlist is not None)
+        if warm_playlist:
+            playlist = _rewrite_playlist(warm_playlist['text'], url, _resolve_options(options))
+            metrics.inc('iptv_proxy_bytes_total', {'kind': 'playlist'}, len(playlist))
+            return Response(playlist, content_type=warm_playlist['content_type'])
+
+        # Servidor fora do ar: falha imediata em vez de prender o worker até o timeout
+        breaker = circuit_breakers.for_url(url)
+        if not breaker.allow():
+            response = jsonify({'success': False, 'error': 'Servidor do stream indisponível no momento'})
+            response.headers['Retry-After'] = '15'
+            return response, 503
+
+        # Conexão com timeout adaptativo (no máximo 10s); leitura adaptativa só para playlists
+        # (no máximo 60s), mídia usa MEDIA_READ_TIMEOUT_SECONDS
+        kind = 'playlist' if is_playlist else 'media'
+        read_timeout = breaker.timeout(60, kind) if is_playlist else MEDIA_READ_TIMEOUT_SECONDS
+        started = time.monotonic()
         try:
-            from urllib.parse import urlparse
-            parsed_url = urlparse(url)
-            referer_domain = f"{parsed_url.scheme}://{parsed_url.netloc}/"
+            req = upstream.session.get(url, stream=True, timeout=(breaker.timeout(10, kind), read_timeout),
+                                       headers=headers or upstream.proxy_headers(url), verify=False)
         except Exception:
-            referer_domain = "" # Fallback se a URL for malformada
-
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Connection': 'keep-alive',
-            'Referer': referer_domain # Usar o domínio base extraído
-        }
-        
-        # Aumentar o timeout para 60 segundos
-        req = requests.get(url, stream=True, timeout=60, headers=headers, verify=False)
+            breaker.record_failure()
+            raise
+        if req.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success(time.monotonic() - started, kind)
 
         # Check if the request to the target was successful
         if req.status_code >= 400:
-            logging.error(f"Proxy target failed with status {req.status_code}. Reason: {req.reason}. Target URL: {url}. Response body: {req.text}") # ADDED LOG
+            body = preview(req.text)
+            log_event('proxy_target_failed', logging.ERROR, status=req.status_code, reason=req.reason,
+                      url=url, body=body)
             return jsonify({
                 'success': False,
                 'error': 'Proxy target failed',
                 'target_status': req.status_code,
                 'target_reason': req.reason,
-                'target_url': url,
-                'target_response_body': req.text # Incluir corpo da resposta para depuração
+                # Caminhos assinados existem justamente para não expor a URL (com credenciais) do provedor
+                'target_url': url if headers is None else None,
+                'target_response_body': body # Incluir corpo da resposta para depuração
             }), 502
 
         content_type = req.headers.get('content-type', '').lower()
 
         # Se for uma playlist HLS, precisamos reescrever as URLs dos segmentos
-        if 'application/vnd.apple.mpegurl' in content_type or 'application/x-mpegurl' in content_type:
-            playlist_content = req.text
-            base_url = url.rsplit('/', 1)[0] + '/'
-
-            new_playlist = []
-            for line in playlist_content.splitlines():
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    absolute_segment_url = urljoin(base_url, line)
-                    line = f"/api/iptv/proxy?url={requests.utils.quote(absolute_segment_url)}"
-                new_playlist.append(line)
-            
-            rewritten_playlist = "\n".join(new_playlist)
-            return Response(rewritten_playlist, content_type=content_type)
+        if is_hls_content_type(content_type):
+            playlist = _rewrite_playlist(req.text, url, _resolve_options(options))
+            metrics.inc('iptv_proxy_bytes_total', {'kind': 'playlist'}, len(playlist))
+            return Response(playlist, content_type=content_type)
 
         # Para todos os outros tipos de conteúdo, apenas faz o proxy direto
         else:
-            return Response(stream_with_context(req.iter_content(chunk_size=1024)), content_type=content_type)
+            return Response(stream_with_context(_count_bytes(req.iter_content(chunk_size=1024), 'media')),
+                            content_type=content_type)
 
     except requests.exceptions.Timeout:
         return jsonify({'success': False, 'error': 'Timeout ao acessar a URL do stream'}), 504
@@ -236,6 +485,67 @@ def proxy():
 
 
 
+def _resolve_options(options):
+    return options() if callable(options) else options
+
+
+def _count_bytes(chunks, kind):
+    """Repassa os chunks contando os bytes enviados; contabiliza uma vez ao fim do stream."""
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.inc('iptv_proxy_bytes_total', {'kind': kind}, sent)
+
+
+@iptv_bp.route('/playlist/<int:connection_id>.m3u', methods=['GET'])
+def export_playlist(connection_id):
+    """Exporta o catálogo como playlist M3U, com cache por versão do catálogo"""
+    try:
+        types = [t for t in request.args.get('type', 'live,vod').split(',') if t in EXPORT_TYPES]
+        if not types:
+            return jsonify({'success': False, 'error': 'Tipo de conteúdo inválido'}), 400
+
+        service = get_xtream_service()
+        version = service.get_catalog_version(connection_id)
+        exporter = M3UExporter(service)
+        etag = exporter.etag(connection_id, version, types)
+        headers = {'ETag': etag, 'Cache-Control': 'private, max-age=300'}
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=304, headers=headers)
+
+        path = exporter.cache_path(connection_id, version, types)
+        if os.path.exists(path):
+            response = send_file(path, mimetype='audio/x-mpegurl', etag=False)
+            response.headers.update(headers)
+            return response
+        return Response(stream_with_context(exporter.stream(connection_id, types, version)),
+                        mimetype='audio/x-mpegurl', headers=headers)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@iptv_bp.route('/image')
+def image():
+    """Proxy de imagens (logos e capas) redimensionadas e cacheadas em disco."""
+    try:
+        url = request.args.get('url')
+        if not url or not url.startswith(('http://', 'https://')):
+            return jsonify({'success': False, 'error': 'URL é obrigatória'}), 400
+        width = request.args.get('w', type=int)
+        accept_webp = 'image/webp' in request.headers.get('Accept', '')
+
+        path, mimetype, digest = image_cache.get(url, width, accept_webp)
+        response = send_file(path, mimetype=mimetype, etag=digest, max_age=IMAGE_MAX_AGE_SECONDS, conditional=True)
+        response.headers['Cache-Control'] = f'public, max-age={IMAGE_MAX_AGE_SECONDS}, immutable'
+        response.headers['Vary'] = 'Accept'
+        return response
+    except requests.exceptions.Timeout:
+        return jsonify({'success': False, 'error': 'Timeout ao buscar a imagem'}), 504
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 502
+
 @iptv_bp.route('/series_info/<int:connection_id>/<int:series_id>', methods=['GET'])
 def get_series_info(connection_id, series_id):
     """Busca detalhes de uma serie"""
@@ -245,6 +555,15 @@ def get_series_info(connection_id, series_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@iptv_bp.route('/series_info/<int:connection_id>/<int:series_id>/next/<episode_id>', methods=['GET'])
+def get_next_episode(connection_id, series_id, episode_id):
+    """Próximo episódio da série (ordem temporada/episódio), ou null no último"""
+    try:
+        result = get_xtream_service().get_next_episode(connection_id, series_id, episode_id)
+        return jsonify(result), 200 if result['success'] else 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @iptv_bp.route('/all_streams_by_category/<int:connection_id>/<stream_type>', methods=['GET'])
 def get_all_streams_by_category(connection_id, stream_type):
     """Busca todos os streams agrupados por categoria para um tipo específico."""
@@ -270,12 +589,14 @@ def get_dashboard_data(connection_id):
         server_info = connection_req.data.get('server_info', {})
 
         # 2. Calcula estatísticas contando as linhas nas tabelas do Supabase
+        # (o catálogo pode ser compartilhado com outra conexão do mesmo provedor)
+        catalog_id = service.catalog_id(connection_id)
         # O método `count='exact'` é uma forma eficiente de obter a contagem total.
-        live_count_req = supabase.from_('live_streams').select('id', count='exact').eq('connection_id', connection_id).execute()
-        vod_count_req = supabase.from_('vod_streams').select('id', count='exact').eq('connection_id', connection_id).execute()
-        series_count_req = supabase.from_('series').select('id', count='exact').eq('connection_id', connection_id).execute()
-        live_cat_count_req = supabase.from_('live_categories').select('id', count='exact').eq('connection_id', connection_id).execute()
-        vod_cat_count_req = supabase.from_('vod_categories').select('id', count='exact').eq('connection_id', connection_id).execute()
+        live_count_req = supabase.from_('live_streams').select('id', count='exact').eq('connection_id', catalog_id).execute()
+        vod_count_req = supabase.from_('vod_streams').select('id', count='exact').eq('connection_id', catalog_id).execute()
+        series_count_req = supabase.from_('series').select('id', count='exact').eq('connection_id', catalog_id).execute()
+        live_cat_count_req = supabase.from_('live_categories').select('id', count='exact').eq('connection_id', catalog_id).execute()
+        vod_cat_count_req = supabase.from_('vod_categories').select('id', count='exact').eq('connection_id', catalog_id).execute()
 
         stats = {
             'total_live_channels': live_count_req.count or 0,
@@ -310,13 +631,20 @@ def get_dashboard_data(connection_id):
 def user_preferences():
     """Gerencia preferências do usuário (agora no Supabase)"""
     try:
+        service = get_xtream_service()
         user_id = request.args.get('user_id', 'default')
+        # Um token de sessão válido identifica o usuário sem consultar o banco.
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if token:
+            session = service.verify_session(token)
+            if session['success']:
+                user_id = str(session['user']['id'])
         if request.method == 'GET':
-            result = get_xtream_service().get_user_preferences(user_id) # Need to add this method to XtreamService
+            result = service.get_user_preferences(user_id)
             return jsonify(result), 200 if result['success'] else 500
         elif request.method == 'POST':
             data = request.get_json()
-            result = get_xtream_service().update_user_preferences(user_id, data) # Need to add this method to XtreamService
+            result = service.update_user_preferences(user_id, data)
             return jsonify(result), 200 if result['success'] else 500
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -10,6 +10,12 @@ def get_xtream_service():
     app = current_app._get_current_object()
     return XtreamService(app)
 
+def _busy(result):
+    """Fila de hashing cheia: 503 imediato com Retry-After, em vez de prender a thread."""
+    response = jsonify(result)
+    response.headers['Retry-After'] = str(result['retry_after'])
+    return response, 503
+
 @user_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -22,6 +28,8 @@ def register():
 
     result = get_xtream_service().register_user(username, email, password)
 
+    if result.get('retry_after'):
+        return _busy(result)
     if result['success']:
         return jsonify(result), 201
     else:
@@ -38,6 +46,19 @@ def login():
 
     result = get_xtream_service().login(username, password)
 
+    if result.get('retry_after'):
+        return _busy(result)
+    if result['success']:
+        return jsonify(result), 200
+    else:
+        return jsonify(result), 401
+
+
+@user_bp.route('/session', methods=['GET'])
+def session():
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    result = get_xtream_service().verify_session(token)
+
     if result['success']:
         return jsonify(result), 200
     else:
@@ -0,0 +1,95 @@
+import logging
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(2, os.cpu_count() or 1)))
+# Hashes allowed to wait for a worker; beyond that logins are refused instead
+# of piling up behind a login storm.
+HASH_QUEUE_LIMIT = HASH_WORKERS * 8
+HASH_TIMEOUT_SECONDS = 10
+# Sent as Retry-After when the queue is full.
+HASH_RETRY_AFTER_SECONDS = 2
+
+SESSION_MAX_AGE_SECONDS = int(os.environ.get('SESSION_MAX_AGE_SECONDS', 7 * 24 * 3600))
+SESSION_SALT = 'iptv-session'
+
+
+class HashingBusyError(Exception):
+    pass
+
+
+class PasswordHasher:
+    """
+    Runs werkzeug password hashing in a bounded process pool so the CPU-heavy
+    key derivation neither holds the GIL nor stalls the proxy's I/O threads.
+    Falls back to a thread pool where processes are unavailable (serverless).
+    """
+
+    def __init__(self, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    try:
+                        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                    except (OSError, NotImplementedError) as e:
+                        logging.warning(f"Process pool unavailable for password hashing ({e}); using threads.")
+                        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _run(self, fn, *args):
+        # A full queue is refused right away: waiting here would hold the
+        # request thread, which is what the bound exists to prevent.
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusyError('Too many concurrent logins, try again shortly.')
+        try:
+            return self._get_pool().submit(fn, *args).result(timeout=HASH_TIMEOUT_SECONDS)
+        finally:
+            self._slots.release()
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password)
+
+
+def _session_secret():
+    secret = os.environ.get('SESSION_SECRET_KEY')
+    if not secret:
+        logging.warning("SESSION_SECRET_KEY is not set; session tokens will only be valid in this process.")
+        secret = secrets.token_hex(32)
+    return secret
+
+
+class SessionTokens:
+    """Signed, expiring session tokens carrying the user's public fields."""
+
+    def __init__(self, secret=None, max_age=SESSION_MAX_AGE_SECONDS):
+        self._serializer = URLSafeTimedSerializer(secret or _session_secret(), salt=SESSION_SALT)
+        self.max_age = max_age
+
+    def issue(self, user):
+        return self._serializer.dumps({'id': user.get('id'), 'username': user.get('username'), 'email': user.get('email')})
+
+    def verify(self, token):
+        """Returns the user dict embedded in a valid token, or None."""
+        if not token:
+            return None
+        try:
+            return self._serializer.loads(token, max_age=self.max_age)
+        except (SignatureExpired, BadSignature):
+            return None
+
+
+password_hasher = PasswordHasher()
+session_tokens = SessionTokens()
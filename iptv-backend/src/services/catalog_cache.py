@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from src.services.change_log import ENTITY_KEYS
+from src.services.metrics import metrics
+
+# Catalog table that holds each stream type.
+STREAM_TABLES = {
+    'live': 'live_streams',
+    'vod': 'vod_streams',
+    'series': 'series',
+}
+
+MAX_CONNECTIONS = 32
+# Budget for the rows of every connection together, per process.
+CATALOG_CACHE_MAX_BYTES = int(os.environ.get('CATALOG_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Approximate cost of a decoded row: the dict and index entry, plus one str/int object per field.
+ROW_OVERHEAD_BYTES = 100
+FIELD_OVERHEAD_BYTES = 50
+# How long a cached catalog version is trusted before it is re-read.
+VERSION_TTL_SECONDS = 5
+
+
+class CatalogCache:
+    """
+    Per-process cache of catalog rows with a hash index per connection.
+
+    Rows are indexed by (stream_type, id) so lookups by id never hit
+    Supabase once a row has been seen. Each connection's index is tagged with
+    the catalog version it was filled from and dropped as soon as a newer
+    version is observed. The rows of all connections share one budget of
+    approximate bytes; connections are evicted in LRU order when it (or
+    max_connections) is exceeded.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_bytes=CATALOG_CACHE_MAX_BYTES,
+                 version_ttl=VERSION_TTL_SECONDS):
+        self.max_connections = max_connections
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _row_bytes(row):
+        return ROW_OVERHEAD_BYTES + sum(FIELD_OVERHEAD_BYTES + len(str(value)) for value in row.values())
+
+    def _entry(self, connection_id):
+        entry = self._entries.get(connection_id)
+        if entry is None:
+            entry = {'version': None, 'checked_at': 0.0, 'index': {}, 'bytes': 0, 'facts': {}}
+            self._entries[connection_id] = entry
+            while len(self._entries) > self.max_connections:
+                self._evict_oldest()
+        else:
+            self._entries.move_to_end(connection_id)
+        return entry
+
+    def _evict_oldest(self):
+        _, entry = self._entries.popitem(last=False)
+        self._bytes -= entry['bytes']
+
+    def _clear(self, entry):
+        entry['index'] = {}
+        entry['facts'] = {}
+        self._bytes -= entry['bytes']
+        entry['bytes'] = 0
+
+    def validate(self, connection_id, load_version):
+        """
+        Drops the connection's index if the catalog moved on. `load_version`
+        is only called when the cached version is older than version_ttl.
+        """
+        with self._lock:
+            entry = self._entry(connection_id)
+            if time.monotonic() - entry['checked_at'] < self.version_ttl:
+                return
+        version = load_version()
+        with self._lock:
+            entry = self._entry(connection_id)
+            if entry['version'] != version:
+                self._clear(entry)
+                entry['version'] = version
+            entry['checked_at'] = time.monotonic()
+
+    def get_rows(self, connection_id, stream_type, ids):
+        """Returns ({id: row} for cached ids, [ids not cached])."""
+        found = {}
+        missing = []
+        with self._lock:
+            index = self._entry(connection_id)['index']
+            for item_id in ids:
+                row = index.get((stream_type, str(item_id)))
+                if row is None:
+                    missing.append(item_id)
+                else:
+                    found[str(item_id)] = row
+        metrics.cache_result('catalog_rows', True, len(found))
+        metrics.cache_result('catalog_rows', False, len(missing))
+        return found, missing
+
+    def put_rows(self, connection_id, stream_type, rows):
+        key = ENTITY_KEYS[STREAM_TABLES[stream_type]]
+        sized = [((stream_type, str(row[key])), row, self._row_bytes(row)) for row in rows if row.get(key) is not None]
+        added = sum(size for _, _, size in sized)
+        if added > self.max_bytes:
+            return
+        with self._lock:
+            entry = self._entry(connection_id)
+            if entry['bytes'] + added > self.max_bytes:
+                self._clear(entry)
+            index = entry['index']
+            for index_key, row, size in sized:
+                previous = index.get(index_key)
+                if previous is not None:
+                    added -= self._row_bytes(previous)
+                index[index_key] = row
+            entry['bytes'] += added
+            self._bytes += added
+            # The connection just written is the most recent one: older ones go first.
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._evict_oldest()
+
+    def get_fact(self, connection_id, name):
+        """A value derived from the whole catalog version (e.g. whether any row has a direct_source), or None."""
+        with self._lock:
+            return self._entry(connection_id)['facts'].get(name)
+
+    def put_fact(self, connection_id, name, value):
+        with self._lock:
+            self._entry(connection_id)['facts'][name] = value
+
+    @property
+    def size_bytes(self):
+        """Approximate bytes held by the cached rows."""
+        with self._lock:
+            return self._bytes
+
+    def invalidate(self, connection_id):
+        with self._lock:
+            entry = self._entries.pop(connection_id, None)
+            if entry is not None:
+                self._bytes -= entry['bytes']
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,106 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+ADULT_FLAGS = ('1', 'true', 'yes')
+
+
+def _is_adult(value):
+    return str(value).strip().lower() in ADULT_FLAGS if value is not None else False
+
+
+def category_summary(rows):
+    """Item count, adult flag and first artwork of one category's item rows."""
+    return {
+        'item_count': len(rows),
+        'adult': any(_is_adult(row.get('is_adult')) for row in rows),
+        'artwork': next((row.get('stream_icon') or row.get('cover') for row in rows
+                         if row.get('stream_icon') or row.get('cover')), None),
+    }
+
+
+def build_category_tree(category_rows, summaries):
+    """
+    The category document served by /categories: the provider's category
+    rows in their order, each with its own item count, adult flag and
+    artwork, the total count of its subtree and the ids of its children,
+    plus the ids of the root categories. Categories whose parent is
+    unknown (0 on most panels) are roots.
+    """
+    nodes = {}
+    for row in category_rows:
+        category_id = str(row.get('category_id'))
+        if row.get('category_id') is None or category_id in nodes:
+            continue
+        summary = summaries.get(category_id) or {}
+        nodes[category_id] = {
+            'category_id': category_id,
+            'category_name': row.get('category_name'),
+            'parent_id': row.get('parent_id'),
+            'item_count': summary.get('item_count') or 0,
+            'adult': bool(summary.get('adult')),
+            'artwork': summary.get('artwork'),
+            'children': [],
+        }
+
+    roots = []
+    for category_id, node in nodes.items():
+        parent = nodes.get(str(node['parent_id'])) if node['parent_id'] not in (None, '', 0, '0') else None
+        if parent is None or parent is node:
+            roots.append(category_id)
+        else:
+            parent['children'].append(category_id)
+
+    def total(node, seen):
+        # Broken panels produce parent cycles; a category is counted once.
+        seen.add(node['category_id'])
+        node['total_count'] = node['item_count'] + sum(total(nodes[child], seen) for child in node['children']
+                                                       if child not in seen)
+        return node['total_count']
+
+    seen = set()
+    for category_id in roots:
+        total(nodes[category_id], seen)
+    for category_id, node in nodes.items():
+        if category_id not in seen:
+            # Only reachable through a cycle: surface it as a root.
+            roots.append(category_id)
+            total(node, seen)
+    return {'categories': list(nodes.values()), 'roots': roots}
+
+
+class CategoryTrees:
+    """
+    One precomputed category document per (connection, content type), kept
+    in category_trees. The sync rebuilds it from the per-category summaries
+    of the SyncPlanner state, so the category screen needs one small read
+    instead of paging through every stream to learn category sizes.
+    """
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def save(self, connection_id, content_type, category_rows, summaries, version):
+        tree = build_category_tree(category_rows, summaries)
+        self.supabase.from_('category_trees').upsert({
+            'connection_id': connection_id,
+            'content_type': content_type,
+            'version': version,
+            'tree': tree,
+            'built_at': datetime.now(timezone.utc).isoformat(),
+        }, on_conflict='connection_id,content_type').execute()
+        return tree
+
+    def load(self, connection_id, content_type):
+        response = self.supabase.from_('category_trees').select('tree, version') \
+            .eq('connection_id', connection_id).eq('content_type', content_type).execute()
+        if not response.data:
+            return None
+        tree = response.data[0]['tree']
+        if isinstance(tree, str):
+            try:
+                tree = json.loads(tree)
+            except json.JSONDecodeError:
+                logging.warning(f"Unreadable category tree for connection {connection_id} ({content_type}).")
+                return None
+        return dict(tree, version=response.data[0]['version'])
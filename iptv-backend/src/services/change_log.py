@@ -0,0 +1,180 @@
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from src.services.sync_events import sync_events
+
+# Primary key of every catalog table that takes part in the change log.
+ENTITY_KEYS = {
+    'live_categories': 'category_id',
+    'vod_categories': 'category_id',
+    'series_categories': 'category_id',
+    'live_streams': 'stream_id',
+    'vod_streams': 'stream_id',
+    'series': 'series_id',
+}
+
+# Tombstones older than this many versions are dropped; clients behind the
+# horizon are told to reset instead of receiving an incomplete delta.
+TOMBSTONE_RETENTION_VERSIONS = 50
+
+CHUNK_SIZE = 500
+PAGE_SIZE = 1000
+# Attempts at claiming the next version when other processes keep recording.
+MAX_VERSION_ATTEMPTS = 20
+
+_version_locks = {}
+_version_locks_guard = threading.Lock()
+
+
+def _version_lock(connection_id):
+    with _version_locks_guard:
+        lock = _version_locks.get(connection_id)
+        if lock is None:
+            lock = _version_locks[connection_id] = threading.Lock()
+        return lock
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class CatalogChangeLog:
+    """
+    Per-connection change log for the catalog tables.
+
+    The log keeps at most one entry per item: recording a change upserts on
+    (connection_id, entity, item_key), so an item modified in ten syncs costs
+    one row, not ten. Deletions are kept as tombstones for
+    TOMBSTONE_RETENTION_VERSIONS versions and then compacted away.
+
+    Versions are claimed with a compare-and-set on catalog_versions (update
+    where version = the version read), since gunicorn workers and
+    sync_local.py record for the same connection concurrently. A writer
+    that loses the race writes its entries again under the next version,
+    so an entry is never visible under a version a client already holds.
+    """
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def get_version(self, connection_id):
+        state = self._state(connection_id)
+        return {'version': state['version'], 'compacted_through': state['compacted_through']}
+
+    def _state(self, connection_id):
+        response = self.supabase.from_('catalog_versions').select('version, compacted_through') \
+            .eq('connection_id', connection_id).execute()
+        if response.data:
+            row = response.data[0]
+            return {'version': row.get('version') or 0, 'compacted_through': row.get('compacted_through') or 0,
+                    'exists': True}
+        return {'version': 0, 'compacted_through': 0, 'exists': False}
+
+    def _claim(self, connection_id, state, version, compacted_through):
+        """Moves the connection from state['version'] to `version`; False if another writer got there first."""
+        row = {
+            'version': version,
+            'compacted_through': compacted_through,
+            'updated_at': datetime.utcnow().isoformat(),
+        }
+        if state['exists']:
+            response = self.supabase.from_('catalog_versions').update(row) \
+                .eq('connection_id', connection_id).eq('version', state['version']).execute()
+            return bool(response.data)
+        try:
+            self.supabase.from_('catalog_versions').insert(dict(row, connection_id=connection_id)).execute()
+            return True
+        except Exception:
+            # Another writer created the row in the meantime (a unique violation): retry on top of it.
+            if self._state(connection_id)['exists']:
+                return False
+            raise
+
+    def record(self, connection_id, changes):
+        """
+        Records a list of (entity, item_key, op) tuples under a new version.
+        Returns the connection's catalog version after recording.
+        """
+        with _version_lock(connection_id):
+            for _ in range(MAX_VERSION_ATTEMPTS):
+                state = self._state(connection_id)
+                if not changes:
+                    return state['version']
+
+                version = state['version'] + 1
+                entries = [{
+                    'connection_id': connection_id,
+                    'version': version,
+                    'entity': entity,
+                    'item_key': str(item_key),
+                    'op': op,
+                } for entity, item_key, op in changes]
+
+                # Entries first: once the version is claimed, everything under it is in the log.
+                for chunk in _chunks(entries):
+                    self.supabase.from_('catalog_changes').upsert(chunk, on_conflict='connection_id,entity,item_key').execute()
+
+                compacted_through = max(state['compacted_through'], version - TOMBSTONE_RETENTION_VERSIONS)
+                if self._claim(connection_id, state, version, compacted_through):
+                    break
+            else:
+                raise RuntimeError(f"Could not claim a catalog version for connection {connection_id}")
+
+            self._compact(connection_id, compacted_through, state['compacted_through'])
+            logging.info(f"Catalog {connection_id}: recorded {len(entries)} changes at version {version}.")
+            # Clients fetch /changes?since=<their version> for exactly these tables.
+            sync_events.publish(connection_id, 'catalog', {
+                'version': version,
+                'changes': dict(Counter(entity for entity, _, _ in changes)),
+            })
+            return version
+
+    def _compact(self, connection_id, horizon, compacted_through):
+        # Clients behind the horizon already get a reset, so the tombstones can go.
+        if horizon <= compacted_through:
+            return
+        self.supabase.from_('catalog_changes').delete() \
+            .eq('connection_id', connection_id).eq('op', 'delete').lte('version', horizon).execute()
+
+    def changes_since(self, connection_id, since):
+        """Returns the rows upserted and the keys deleted per entity after version `since`."""
+        state = self.get_version(connection_id)
+        if since <= 0 or since < state['compacted_through'] or since > state['version']:
+            # The client has no replica, fell behind the tombstone horizon or
+            # holds a version from a catalog that was rebuilt: full resync.
+            return {'success': True, 'reset': True, 'version': state['version'], 'changes': {}}
+
+        entries = []
+        start = 0
+        while True:
+            response = self.supabase.from_('catalog_changes').select('entity, item_key, op') \
+                .eq('connection_id', connection_id).gt('version', since) \
+                .order('id').range(start, start + PAGE_SIZE - 1).execute()
+            entries.extend(response.data or [])
+            if len(response.data or []) < PAGE_SIZE:
+                break
+            start += PAGE_SIZE
+
+        grouped = {}
+        for entry in entries:
+            bucket = grouped.setdefault(entry['entity'], {'upserted': [], 'deleted': []})
+            if entry['op'] == 'delete':
+                bucket['deleted'].append(entry['item_key'])
+            else:
+                bucket['upserted'].append(entry['item_key'])
+
+        changes = {}
+        for entity, bucket in grouped.items():
+            key = ENTITY_KEYS.get(entity)
+            if not key:
+                continue
+            rows = []
+            for chunk in _chunks(bucket['upserted']):
+                response = self.supabase.from_(entity).select('*') \
+                    .eq('connection_id', connection_id).in_(key, chunk).execute()
+                rows.extend(response.data or [])
+            changes[entity] = {'upserted': rows, 'deleted': bucket['deleted']}
+
+        return {'success': True, 'reset': False, 'version': state['version'], 'changes': changes}
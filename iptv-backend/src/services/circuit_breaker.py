@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+import requests
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+FAILURE_THRESHOLD = 5
+OPEN_SECONDS = 15
+MAX_OPEN_SECONDS = 120
+LATENCY_WINDOW = 100
+# Timeout = TIMEOUT_MULTIPLIER x p99 of the recent latencies of the same kind
+# of call, clamped to [MIN_TIMEOUT_SECONDS, the caller's ceiling].
+TIMEOUT_MULTIPLIER = 3
+TIMEOUT_PERCENTILE = 0.99
+MIN_TIMEOUT_SECONDS = 2.0
+MIN_SAMPLES = 10
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of contacting a provider host whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker for one provider host, plus the latency
+    windows its adaptive timeouts are derived from: one per kind of call
+    (e.g. per API action), so a multi-megabyte listing is not timed by the
+    p99 of small lookups.
+
+    FAILURE_THRESHOLD consecutive failures open the circuit; while open every
+    call fails immediately. After the open period one trial call is let
+    through (half-open): success closes the circuit, failure re-opens it for
+    twice as long, up to MAX_OPEN_SECONDS.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.state = CLOSED
+        self._failures = 0
+        self._open_seconds = OPEN_SECONDS
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self._open_seconds:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit open for {self.host}")
+
+    def record_success(self, latency, kind=None):
+        with self._lock:
+            window = self._latencies.get(kind)
+            if window is None:
+                window = self._latencies[kind] = deque(maxlen=LATENCY_WINDOW)
+            window.append(latency)
+            self._failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self._open_seconds = OPEN_SECONDS
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN:
+                self._open_seconds = min(MAX_OPEN_SECONDS, self._open_seconds * 2)
+                self._open()
+            elif self.state == CLOSED and self._failures >= FAILURE_THRESHOLD:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def timeout(self, ceiling, kind=None):
+        """Adaptive timeout: a multiple of the recent p99 of `kind` calls, never above `ceiling`."""
+        with self._lock:
+            window = self._latencies.get(kind) or ()
+            if len(window) < MIN_SAMPLES:
+                return ceiling
+            ordered = sorted(window)
+        p99 = ordered[min(len(ordered) - 1, int(TIMEOUT_PERCENTILE * len(ordered)))]
+        return min(ceiling, max(MIN_TIMEOUT_SECONDS, p99 * TIMEOUT_MULTIPLIER))
+
+    def snapshot(self):
+        with self._lock:
+            return {'host': self.host, 'state': self.state, 'failures': self._failures}
+
+
+class CircuitBreakerRegistry:
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def for_url(self, url):
+        host = urlparse(url).netloc or url
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(host)
+            return breaker
+
+    def snapshot(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [breaker.snapshot() for breaker in breakers]
+
+
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,319 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from src.services.sync_engine import BatchedDiffWriter
+from src.services.sync_events import sync_events
+
+# Series crawled per background run; the rest follows in the next runs.
+CRAWL_BATCH_SIZE = int(os.environ.get('EPISODE_CRAWL_BATCH_SIZE', '200'))
+CRAWL_INTERVAL_SECONDS = 600
+MAX_CRAWL_CONCURRENCY = 4
+# Series ids listed in an 'episodes' event; clients refetch everything beyond that.
+MAX_EVENT_SERIES_IDS = 200
+# get_series_info calls per second, across every connection of this process.
+CRAWL_REQUESTS_PER_SECOND = float(os.environ.get('EPISODE_CRAWL_RATE', '4'))
+PAGE_SIZE = 1000
+CHUNK_SIZE = 500
+
+EPISODE_COLUMNS = ['series_id', 'season_number', 'episode_num', 'title', 'container_extension',
+                   'duration_secs', 'added', 'info']
+
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _user_info(row):
+    info = (row or {}).get('user_info') or {}
+    if isinstance(info, str):
+        try:
+            info = json.loads(info)
+        except json.JSONDecodeError:
+            info = {}
+    return info if isinstance(info, dict) else {}
+
+
+def _map_seasons(connection_id, series_id, data):
+    rows = {}
+    for season in data.get('seasons') or []:
+        number = _int(season.get('season_number'))
+        if number is None:
+            continue
+        rows[number] = {
+            'connection_id': connection_id,
+            'series_id': series_id,
+            'season_number': number,
+            'name': season.get('name'),
+            'episode_count': _int(season.get('episode_count')),
+            'cover': season.get('cover_big') or season.get('cover'),
+            'air_date': season.get('air_date'),
+            'overview': season.get('overview'),
+        }
+    return rows
+
+
+def _map_episodes(connection_id, series_id, data):
+    episodes = data.get('episodes') or {}
+    # Keyed by season number on most panels, a list of per-season lists on others.
+    groups = episodes.items() if isinstance(episodes, dict) else ((None, group) for group in episodes)
+    rows = []
+    for season_key, group in groups:
+        for episode in group if isinstance(group, list) else []:
+            season_number = _int(episode.get('season')) if episode.get('season') is not None else _int(season_key)
+            if episode.get('id') is None or season_number is None:
+                continue
+            info = episode.get('info') if isinstance(episode.get('info'), dict) else {}
+            rows.append({
+                'connection_id': connection_id,
+                'series_id': series_id,
+                'episode_id': str(episode['id']),
+                'season_number': season_number,
+                'episode_num': _int(episode.get('episode_num')),
+                'title': episode.get('title'),
+                'container_extension': episode.get('container_extension'),
+                'duration_secs': _int(info.get('duration_secs')),
+                'added': episode.get('added'),
+                'info': info,
+            })
+    return rows
+
+
+class _RequestRate:
+    """Spaces calls 1/rate seconds apart, shared by every crawl thread."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class EpisodeCrawler:
+    """
+    Materializes seasons and episodes of series into series_seasons and
+    series_episodes.
+
+    Each run compares the catalog's series (series_id, last_modified) with
+    series_crawl_state and calls get_series_info only for series that are
+    new or whose last_modified moved, a few at a time and under one request
+    rate for the whole process. Episodes are diffed per series, so an
+    unchanged episode is never rewritten; series gone from the catalog lose
+    their seasons and episodes. Afterwards seasons, episodes and "next
+    episode" are plain index lookups instead of upstream calls.
+    """
+
+    def __init__(self, rate=CRAWL_REQUESTS_PER_SECOND):
+        self._rate = _RequestRate(rate)
+        self._scheduled = set()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._service = None
+
+    def schedule(self, service, connection_id):
+        """Registers the connection for background crawling and starts a run now."""
+        with self._lock:
+            self._scheduled.add(connection_id)
+            self._service = service
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._schedule_loop, name='episode-crawler', daemon=True)
+                self._scheduler.start()
+        threading.Thread(target=self.crawl, args=(service, connection_id), daemon=True).start()
+
+    def _schedule_loop(self):
+        while True:
+            time.sleep(CRAWL_INTERVAL_SECONDS)
+            with self._lock:
+                connection_ids = list(self._scheduled)
+                service = self._service
+            for connection_id in connection_ids:
+                self.crawl(service, connection_id)
+
+    def crawl(self, service, connection_id, limit=CRAWL_BATCH_SIZE):
+        """Crawls up to `limit` changed series (all of them with limit=None)."""
+        catalog_id = service.catalog_id(connection_id)
+        with self._lock:
+            if catalog_id in self._running:
+                return {'success': False, 'error': 'Episode crawl already running for this catalog.'}
+            self._running.add(catalog_id)
+        try:
+            return self._crawl(service, connection_id, catalog_id, limit)
+        except Exception as e:
+            logging.error(f"Episode crawl failed for connection {connection_id}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+        finally:
+            with self._lock:
+                self._running.discard(catalog_id)
+
+    def _select_all(self, supabase, table, columns, catalog_id):
+        rows = []
+        start = 0
+        while True:
+            response = supabase.from_(table).select(columns).eq('connection_id', catalog_id) \
+                .order('id').range(start, start + PAGE_SIZE - 1).execute()
+            batch = response.data or []
+            rows.extend(batch)
+            if len(batch) < PAGE_SIZE:
+                return rows
+            start += PAGE_SIZE
+
+    def _crawl(self, service, connection_id, catalog_id, limit):
+        supabase = service.supabase
+        started = time.monotonic()
+        series = {_int(row['series_id']): row.get('last_modified')
+                  for row in self._select_all(supabase, 'series', 'series_id, last_modified', catalog_id)
+                  if _int(row.get('series_id')) is not None}
+        crawled = {_int(row['series_id']): row.get('last_modified')
+                   for row in self._select_all(supabase, 'series_crawl_state', 'series_id, last_modified', catalog_id)}
+
+        removed = [series_id for series_id in crawled if series_id not in series]
+        for i in range(0, len(removed), CHUNK_SIZE):
+            chunk = removed[i:i + CHUNK_SIZE]
+            for table in ('series_episodes', 'series_seasons', 'series_crawl_state'):
+                supabase.from_(table).delete().eq('connection_id', catalog_id).in_('series_id', chunk).execute()
+
+        due = [series_id for series_id, last_modified in series.items()
+               if series_id not in crawled or crawled[series_id] != last_modified]
+        batch = due if limit is None else due[:limit]
+        if not batch:
+            return {'success': True, 'crawled': 0, 'failed': 0, 'removed': len(removed), 'remaining': 0}
+
+        connection = supabase.from_('xtream_connections').select('user_info').eq('id', connection_id).execute()
+        max_connections = _int(_user_info((connection.data or [None])[0]).get('max_connections')) or 1
+        concurrency = max(1, min(MAX_CRAWL_CONCURRENCY, max_connections - 1))
+
+        stored = []
+        failed = 0
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='episode-crawl') as pool:
+            results = pool.map(lambda series_id: (series_id, self._fetch(service, connection_id, series_id)), batch)
+            for series_id, data in results:
+                if data is None:
+                    failed += 1
+                    continue
+                self.store(supabase, catalog_id, series_id, data, series[series_id])
+                stored.append(series_id)
+        if stored:
+            sync_events.publish(catalog_id, 'episodes', {
+                'crawled': len(stored),
+                'series_ids': stored if len(stored) <= MAX_EVENT_SERIES_IDS else None,
+            })
+
+        logging.info(f"Crawled episodes of {len(stored)} series for connection {connection_id} in "
+                     f"{time.monotonic() - started:.1f}s ({failed} failed, {len(due) - len(batch)} left).")
+        return {'success': True, 'crawled': len(stored), 'failed': failed, 'removed': len(removed),
+                'remaining': len(due) - len(batch)}
+
+    def _fetch(self, service, connection_id, series_id):
+        self._rate.acquire()
+        result = service._make_xtream_request(connection_id, 'get_series_info', {'series_id': series_id})
+        if not result.get('success') or result.get('stale') or not isinstance(result.get('data'), dict):
+            logging.info(f"get_series_info failed for series {series_id}: {result.get('error')}")
+            return None
+        return result['data']
+
+    def store(self, supabase, catalog_id, series_id, data, last_modified):
+        seasons = _map_seasons(catalog_id, series_id, data)
+        episodes = _map_episodes(catalog_id, series_id, data)
+        for episode in episodes:
+            # Panels often list episodes of seasons they do not describe.
+            seasons.setdefault(episode['season_number'], {
+                'connection_id': catalog_id, 'series_id': series_id, 'season_number': episode['season_number'],
+                'name': None, 'episode_count': None, 'cover': None, 'air_date': None, 'overview': None,
+            })
+
+        writer = BatchedDiffWriter(supabase, catalog_id, 'series_episodes', EPISODE_COLUMNS,
+                                   scope={'series_id': series_id}, key='episode_id')
+        for episode in episodes:
+            writer.add(episode)
+        writer.finish()
+
+        existing = supabase.from_('series_seasons').select('season_number') \
+            .eq('connection_id', catalog_id).eq('series_id', series_id).execute()
+        gone = [row['season_number'] for row in existing.data or [] if row['season_number'] not in seasons]
+        if seasons:
+            supabase.from_('series_seasons').upsert(list(seasons.values()),
+                                                    on_conflict='connection_id,series_id,season_number').execute()
+        if gone:
+            supabase.from_('series_seasons').delete().eq('connection_id', catalog_id) \
+                .eq('series_id', series_id).in_('season_number', gone).execute()
+
+        supabase.from_('series_crawl_state').upsert({
+            'connection_id': catalog_id,
+            'series_id': series_id,
+            'last_modified': last_modified,
+            'episode_count': len(episodes),
+            'crawled_at': datetime.now(timezone.utc).isoformat(),
+        }, on_conflict='connection_id,series_id').execute()
+
+    def series_info(self, service, connection_id, series_id):
+        """
+        Show info, seasons and episodes (grouped by season, as get_series_info
+        returns them) from the local tables. A series never crawled is
+        crawled on the spot.
+        """
+        supabase = service.supabase
+        catalog_id = service.catalog_id(connection_id)
+        state = supabase.from_('series_crawl_state').select('series_id') \
+            .eq('connection_id', catalog_id).eq('series_id', series_id).execute()
+        if not state.data:
+            data = self._fetch(service, connection_id, series_id)
+            if data is None:
+                return None
+            show = supabase.from_('series').select('last_modified') \
+                .eq('connection_id', catalog_id).eq('series_id', series_id).execute()
+            self.store(supabase, catalog_id, series_id, data, (show.data or [{}])[0].get('last_modified'))
+
+        show = supabase.from_('series').select('*').eq('connection_id', catalog_id).eq('series_id', series_id).execute()
+        info = dict((show.data or [{}])[0])
+        if isinstance(info.get('backdrop_path'), str):
+            info['backdrop_path'] = [path.strip() for path in info['backdrop_path'].split(',') if path.strip()]
+        seasons = supabase.from_('series_seasons').select('*').eq('connection_id', catalog_id) \
+            .eq('series_id', series_id).order('season_number').execute().data or []
+        episodes = supabase.from_('series_episodes').select('*').eq('connection_id', catalog_id) \
+            .eq('series_id', series_id).order('season_number').order('episode_num').execute().data or []
+
+        grouped = {}
+        for episode in episodes:
+            grouped.setdefault(str(episode['season_number']), []).append({
+                'id': episode['episode_id'],
+                'episode_num': episode['episode_num'],
+                'title': episode['title'],
+                'container_extension': episode['container_extension'],
+                'season': episode['season_number'],
+                'added': episode['added'],
+                'info': episode.get('info') or {},
+            })
+        return {'info': info, 'seasons': seasons, 'episodes': grouped}
+
+    def next_episode(self, service, connection_id, series_id, episode_id):
+        """The episode after `episode_id` in season/episode order, or None."""
+        supabase = service.supabase
+        catalog_id = service.catalog_id(connection_id)
+        current = supabase.from_('series_episodes').select('season_number, episode_num') \
+            .eq('connection_id', catalog_id).eq('episode_id', str(episode_id)).execute()
+        if not current.data:
+            return None
+        season_number = current.data[0]['season_number']
+        episode_num = current.data[0]['episode_num'] or 0
+        response = supabase.from_('series_episodes').select('*').eq('connection_id', catalog_id) \
+            .eq('series_id', series_id) \
+            .or_(f'season_number.gt.{season_number},and(season_number.eq.{season_number},episode_num.gt.{episode_num})') \
+            .order('season_number').order('episode_num').limit(1).execute()
+        return (response.data or [None])[0]
+
+
+episode_crawler = EpisodeCrawler()
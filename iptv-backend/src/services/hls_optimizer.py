@@ -0,0 +1,151 @@
+import os
+import re
+
+# Highest variant (by RESOLUTION height) each quality_preference allows; 'auto' leaves the ladder alone.
+QUALITY_MAX_HEIGHT = {'sd': 480, 'hd': 720, 'fullhd': 1080, '4k': 2160}
+# Live media playlists are cut to their last N segments; 0 keeps the provider's whole window.
+HLS_LIVE_SEGMENTS = int(os.environ.get('HLS_LIVE_SEGMENTS', 0))
+# Players hold back about three target durations from the live edge; fewer segments make them stall.
+MIN_LIVE_SEGMENTS = 3
+MAX_LIVE_SEGMENTS = 100
+
+# Playlist-level tags: they stay in the header when segments are dropped.
+HEADER_TAGS = ('#EXTM3U', '#EXT-X-VERSION', '#EXT-X-TARGETDURATION', '#EXT-X-MEDIA-SEQUENCE',
+               '#EXT-X-DISCONTINUITY-SEQUENCE', '#EXT-X-PLAYLIST-TYPE', '#EXT-X-INDEPENDENT-SEGMENTS',
+               '#EXT-X-START', '#EXT-X-ALLOW-CACHE', '#EXT-X-SERVER-CONTROL', '#EXT-X-PART-INF')
+# Low-latency and delta playlists number parts and skipped segments; they are served untouched.
+UNTRIMMABLE_TAGS = ('#EXT-X-PART:', '#EXT-X-SKIP', '#EXT-X-PRELOAD-HINT', '#EXT-X-PLAYLIST-TYPE')
+
+_RESOLUTION = re.compile(r'(?:^|,)RESOLUTION=(\d+)x(\d+)')
+_BANDWIDTH = re.compile(r'(?:^|,)BANDWIDTH=(\d+)')
+
+
+def playlist_options(quality=None, live_segments=None):
+    """
+    Normalizes the client hints (or stored preferences) of a playlist
+    request. Returns None when there is nothing to optimize, so the common
+    case keeps its playlists (and segment base ids) exactly as before.
+    """
+    options = {}
+    quality = (quality or '').strip().lower()
+    if quality in QUALITY_MAX_HEIGHT:
+        options['quality'] = quality
+    try:
+        live_segments = int(live_segments) if live_segments not in (None, '') else HLS_LIVE_SEGMENTS
+    except (TypeError, ValueError):
+        live_segments = HLS_LIVE_SEGMENTS
+    if live_segments > 0:
+        options['live_segments'] = min(max(live_segments, MIN_LIVE_SEGMENTS), MAX_LIVE_SEGMENTS)
+    return options or None
+
+
+def optimize_playlist(text, options):
+    """
+    Applies `options` to an HLS playlist: a master playlist keeps only the
+    variants allowed by the quality, best allowed first (players start with
+    the first variant listed); a live media playlist is trimmed to its last
+    live_segments segments. Anything else is returned unchanged.
+    """
+    if not options:
+        return text
+    lines = text.splitlines()
+    if any(line.startswith('#EXT-X-STREAM-INF') for line in lines):
+        if options.get('quality'):
+            return '\n'.join(_filter_variants(lines, QUALITY_MAX_HEIGHT[options['quality']]))
+        return text
+    if options.get('live_segments'):
+        return '\n'.join(_trim_live(lines, options['live_segments']))
+    return text
+
+
+def _variant(info_line, uri_lines):
+    resolution = _RESOLUTION.search(info_line.partition(':')[2])
+    bandwidth = _BANDWIDTH.search(info_line.partition(':')[2])
+    return {
+        'lines': [info_line] + uri_lines,
+        'height': int(resolution.group(2)) if resolution else None,
+        'bandwidth': int(bandwidth.group(1)) if bandwidth else 0,
+    }
+
+
+def _filter_variants(lines, max_height):
+    head, variants, tail = [], [], []
+    index = 0
+    while index < len(lines):
+        line = lines[index].strip()
+        if line.startswith('#EXT-X-STREAM-INF'):
+            # The variant's URI is the next line that is not a blank or a comment.
+            end = index + 1
+            while end < len(lines) and (not lines[end].strip() or lines[end].startswith('#')
+                                        and not lines[end].startswith('#EXT')):
+                end += 1
+            variants.append(_variant(line, [lines[i].strip() for i in range(index + 1, min(end + 1, len(lines)))]))
+            index = end + 1
+            continue
+        (tail if variants else head).append(line)
+        index += 1
+
+    # Variants without RESOLUTION (audio-only, or panels that omit it) cannot be judged and are kept.
+    allowed = [v for v in variants if v['height'] is None or v['height'] <= max_height]
+    if not any(v['height'] is not None for v in allowed):
+        # Nothing fits the cap: the smallest known variant is the best the device can get.
+        sized = [v for v in variants if v['height'] is not None]
+        if sized:
+            allowed.append(min(sized, key=lambda v: (v['height'], v['bandwidth'])))
+    sized = [v for v in allowed if v['height'] is not None]
+    if sized:
+        best = max(sized, key=lambda v: (v['height'], v['bandwidth']))
+        allowed = [best] + [v for v in allowed if v is not best]
+    return head + [line for v in allowed for line in v['lines']] + tail
+
+
+def _tag_value(line):
+    try:
+        return int(line.partition(':')[2].strip())
+    except ValueError:
+        return 0
+
+
+def _trim_live(lines, keep):
+    lines = [line.strip() for line in lines]
+    if (not any(line.startswith('#EXTINF') for line in lines) or '#EXT-X-ENDLIST' in lines
+            or any(line.startswith(UNTRIMMABLE_TAGS) for line in lines)):
+        # VOD and EVENT playlists must keep every segment; LL-HLS is left to the player.
+        return lines
+
+    head, segments, pending = [], [], []
+    for line in lines:
+        if not segments and not pending and (not line or line.startswith(HEADER_TAGS)):
+            head.append(line)
+        elif line and not line.startswith('#'):
+            segments.append(pending + [line])
+            pending = []
+        elif line:
+            pending.append(line)
+    if len(segments) <= keep:
+        return lines
+
+    dropped, kept = segments[:-keep], segments[-keep:]
+    discontinuities = sum(line == '#EXT-X-DISCONTINUITY' for segment in dropped for line in segment)
+    # EXT-X-KEY and EXT-X-MAP apply until replaced: the last ones dropped move to the first kept segment.
+    carried = []
+    for prefix in ('#EXT-X-KEY', '#EXT-X-MAP'):
+        if not any(line.startswith(prefix) for line in kept[0]):
+            last = next((line for segment in reversed(dropped) for line in reversed(segment)
+                         if line.startswith(prefix)), None)
+            if last:
+                carried.append(last)
+    kept[0] = carried + kept[0]
+
+    sequence_tags = {'#EXT-X-MEDIA-SEQUENCE': len(dropped), '#EXT-X-DISCONTINUITY-SEQUENCE': discontinuities}
+    new_head = []
+    for line in head:
+        tag = line.partition(':')[0]
+        if tag in sequence_tags:
+            line = f'{tag}:{_tag_value(line) + sequence_tags.pop(tag)}'
+        new_head.append(line)
+    # A missing sequence tag means 0; it has to be written once segments are dropped.
+    for tag, offset in sequence_tags.items():
+        if offset:
+            new_head.append(f'{tag}:{offset}')
+    return new_head + [line for segment in kept for line in segment] + pending
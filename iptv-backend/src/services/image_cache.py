@@ -0,0 +1,240 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.services import upstream
+from src.services.metrics import metrics
+from src.services.shared_cache import IPTV_DATA_DIR, private_dir
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional: without it images are cached as-is
+    Image = None
+
+# Private like the shared cache: whoever can write here chooses what the clients are served.
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', os.path.join(IPTV_DATA_DIR, 'images'))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Requested widths are rounded up to one of these so the cache holds a
+# handful of variants per image, not one per pixel width.
+WIDTHS = (80, 160, 240, 320, 480, 640, 960, 1280)
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+# A few compressed KB can declare gigapixels; decoding stops at this size (about 8K x 5K).
+MAX_SOURCE_PIXELS = 40 * 1000 * 1000
+if Image is not None:
+    # Pillow raises DecompressionBombError past twice this, and only warns below.
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+FETCH_TIMEOUT_SECONDS = 10
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+
+PREWARM_WIDTH = 240
+PREWARM_CATEGORIES = 3
+PREWARM_ITEMS_PER_CATEGORY = 50
+
+MIMETYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+
+# Prewarm sources: (categories table, items table, image column) per content type.
+PREWARM_SOURCES = {
+    'live': ('live_categories', 'live_streams', 'stream_icon'),
+    'vod': ('vod_categories', 'vod_streams', 'stream_icon'),
+    'series': ('series_categories', 'series', 'cover'),
+}
+
+
+def normalize_width(width):
+    if not width:
+        return None
+    for allowed in WIDTHS:
+        if width <= allowed:
+            return allowed
+    return WIDTHS[-1]
+
+
+class ImageCache:
+    """
+    Fetch-resize-reencode cache for provider artwork.
+
+    Encoded images are stored once per content hash under blobs/; a small
+    ref file per (url, width, format) points at its blob, so identical
+    artwork reused across channels or connections is stored once. Blob
+    mtimes are bumped on every hit and the least recently used blobs are
+    evicted once the cache exceeds IMAGE_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, root=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._blobs = os.path.join(root, 'blobs')
+        self._refs = os.path.join(root, 'refs')
+        self._size = None
+        self._checked = False
+        self._lock = threading.Lock()
+        self._prewarm_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-prewarm')
+
+    def _ref_path(self, url, width, fmt):
+        key = hashlib.sha256(f"{url}|{width}|{fmt}".encode('utf-8')).hexdigest()
+        return os.path.join(self._refs, key[:2], key)
+
+    def _blob_path(self, digest, fmt):
+        return os.path.join(self._blobs, digest[:2], f"{digest}.{fmt}")
+
+    def get(self, url, width=None, accept_webp=False):
+        """Returns (path, mimetype, etag) for the processed image, fetching it on a miss."""
+        if not self._checked:
+            private_dir(self.root)
+            self._checked = True
+        width = normalize_width(width)
+        fmt = 'webp' if accept_webp and Image is not None else None
+        ref_path = self._ref_path(url, width, fmt)
+        try:
+            with open(ref_path) as ref_file:
+                blob_name = ref_file.read().strip()
+            blob_path = os.path.join(self._blobs, blob_name[:2], blob_name)
+            os.utime(blob_path)
+            digest, ext = blob_name.rsplit('.', 1)
+            metrics.cache_result('image', True)
+            return blob_path, MIMETYPES.get(ext, 'application/octet-stream'), digest
+        except (OSError, ValueError):
+            pass
+
+        metrics.cache_result('image', False)
+        data, ext = self._process(self._fetch(url), width, fmt)
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(digest, ext)
+        if not os.path.exists(blob_path):
+            self._write_atomic(blob_path, data)
+            self._account(len(data))
+        self._write_atomic(ref_path, f"{digest}.{ext}".encode('utf-8'))
+        return blob_path, MIMETYPES.get(ext, 'application/octet-stream'), digest
+
+    def _fetch(self, url):
+        with upstream.session.get(url, stream=True, timeout=FETCH_TIMEOUT_SECONDS,
+                                  headers=upstream.proxy_headers(url), verify=False) as response:
+            response.raise_for_status()
+            try:
+                declared = int(response.headers.get('Content-Length') or 0)
+            except ValueError:
+                declared = 0
+            if declared > MAX_SOURCE_BYTES:
+                raise ValueError('Image too large.')
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > MAX_SOURCE_BYTES:
+                    raise ValueError('Image too large.')
+                chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _process(self, data, width, fmt):
+        """Downscales and re-encodes; returns (bytes, extension)."""
+        if Image is None:
+            return data, self._sniff(data)
+        try:
+            image = Image.open(io.BytesIO(data))
+        except Image.DecompressionBombError:
+            raise ValueError('Image too large.')
+        with image:
+            if image.width * image.height > MAX_SOURCE_PIXELS:
+                raise ValueError('Image too large.')
+            if width:
+                # draft() lets the JPEG decoder skip detail we would throw away
+                image.draft('RGB', (width, width * 4))
+                if image.width > width:
+                    image.thumbnail((width, image.height * width // image.width or 1))
+            has_alpha = image.mode in ('RGBA', 'LA', 'P')
+            if fmt is None:
+                fmt = 'png' if has_alpha else 'jpeg'
+            if fmt == 'jpeg' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            elif fmt == 'webp' and image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if has_alpha else 'RGB')
+            output = io.BytesIO()
+            if fmt == 'jpeg':
+                image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            elif fmt == 'webp':
+                image.save(output, 'WEBP', quality=WEBP_QUALITY, method=4)
+            else:
+                image.save(output, 'PNG', optimize=True)
+        return output.getvalue(), fmt
+
+    @staticmethod
+    def _sniff(data):
+        if data.startswith(b'\x89PNG'):
+            return 'png'
+        if data[8:12] == b'WEBP':
+            return 'webp'
+        return 'jpeg'
+
+    @staticmethod
+    def _write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+
+    def _scan_blobs(self):
+        blobs = []
+        for dirpath, _, filenames in os.walk(self._blobs):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+        return blobs
+
+    def _account(self, added):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan_blobs())
+            else:
+                self._size += added
+            if self._size <= self.max_bytes:
+                return
+            # Evict down to 90% of the budget, least recently used first.
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(self._scan_blobs()):
+                if self._size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self._size -= size
+                except OSError:
+                    pass
+
+    def prewarm(self, service, connection_id, content_type, width=PREWARM_WIDTH):
+        """Queues thumbnails for the first categories of a content type in the background."""
+        if content_type in PREWARM_SOURCES:
+            self._prewarm_executor.submit(self._prewarm, service, connection_id, content_type, width)
+
+    def _prewarm(self, service, connection_id, content_type, width):
+        categories_table, items_table, image_column = PREWARM_SOURCES[content_type]
+        try:
+            categories = service.supabase.from_(categories_table).select('category_id') \
+                .eq('connection_id', connection_id).order('id').limit(PREWARM_CATEGORIES).execute()
+            warmed = 0
+            for category in categories.data or []:
+                items = service.supabase.from_(items_table).select(image_column) \
+                    .eq('connection_id', connection_id).eq('category_id', category['category_id']) \
+                    .limit(PREWARM_ITEMS_PER_CATEGORY).execute()
+                for item in items.data or []:
+                    url = item.get(image_column)
+                    if not url:
+                        continue
+                    try:
+                        self.get(url, width, accept_webp=True)
+                        warmed += 1
+                    except Exception as e:
+                        logging.info(f"Prewarm skipped {url}: {e}")
+            logging.info(f"Prewarmed {warmed} {content_type} thumbnails for connection {connection_id}.")
+        except Exception as e:
+            logging.error(f"Thumbnail prewarm failed for connection {connection_id}: {e}", exc_info=True)
+
+
+image_cache = ImageCache()
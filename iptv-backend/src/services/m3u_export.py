@@ -0,0 +1,111 @@
+import glob
+import logging
+import os
+import tempfile
+from src.services.mirrors import mirror_selector
+from src.services.shared_cache import IPTV_DATA_DIR, private_dir
+from src.services.xtream_service import build_stream_url
+
+PAGE_SIZE = 1000
+# Exported playlists carry the connection's credentials in every URL: private directory, like the shared cache.
+PLAYLIST_CACHE_DIR = os.environ.get('PLAYLIST_CACHE_DIR', os.path.join(IPTV_DATA_DIR, 'playlists'))
+
+# Exportable stream types and their (streams table, categories table).
+EXPORT_TYPES = {
+    'live': ('live_streams', 'live_categories'),
+    'vod': ('vod_streams', 'vod_categories'),
+}
+
+
+def _attr(value):
+    return str(value or '').replace('"', "'").replace('\r', ' ').replace('\n', ' ')
+
+
+class M3UExporter:
+    """
+    Renders a connection's catalog as an M3U playlist.
+
+    Rows are read with keyset pagination (id > last id) and emitted page by
+    page, so memory stays constant whatever the catalog size and the first
+    bytes leave before the catalog has been read. While streaming, the output
+    is teed into a file named after the catalog version; later requests for
+    the same version are served from that file (and answered 304 via ETag).
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.supabase = service.supabase
+
+    @staticmethod
+    def etag(connection_id, version, types):
+        return f'"m3u-{connection_id}-{version}-{"-".join(types)}"'
+
+    @staticmethod
+    def cache_path(connection_id, version, types):
+        # Checked before every read or write: a directory someone else can write is never trusted.
+        return os.path.join(private_dir(PLAYLIST_CACHE_DIR), f"{connection_id}-{version}-{'-'.join(types)}.m3u")
+
+    def render(self, connection_id, types):
+        """Yields the playlist in page-sized text chunks."""
+        conn_details = self.service._get_xtream_connection_details(connection_id)
+        if not conn_details:
+            raise ValueError('Xtream connection details not found.')
+        server_url = mirror_selector.best(connection_id, conn_details)
+        # Rows may be shared with another connection; URLs use this connection's credentials.
+        catalog_id = self.service.catalog_id(connection_id)
+
+        yield '#EXTM3U\n'
+        for stream_type in types:
+            streams_table, categories_table = EXPORT_TYPES[stream_type]
+            categories = self.supabase.from_(categories_table).select('category_id, category_name') \
+                .eq('connection_id', catalog_id).execute()
+            groups = {row['category_id']: row['category_name'] for row in categories.data or []}
+
+            last_id = 0
+            while True:
+                response = self.supabase.from_(streams_table).select('*').eq('connection_id', catalog_id) \
+                    .gt('id', last_id).order('id').limit(PAGE_SIZE).execute()
+                rows = response.data or []
+                if not rows:
+                    break
+                yield ''.join(self._entry(conn_details, server_url, stream_type, row, groups) for row in rows)
+                last_id = rows[-1]['id']
+                if len(rows) < PAGE_SIZE:
+                    break
+
+    def _entry(self, conn_details, server_url, stream_type, row, groups):
+        container = 'ts' if stream_type == 'live' else (row.get('container_extension') or 'mp4')
+        # Imported M3U entries are played from their own URL, not from the Xtream layout.
+        url = row.get('direct_source') or build_stream_url(conn_details, row['stream_id'], stream_type, container, server_url)
+        return (f'#EXTINF:-1 tvg-id="{_attr(row.get("epg_channel_id"))}" tvg-name="{_attr(row.get("name"))}" '
+                f'tvg-logo="{_attr(row.get("stream_icon"))}" group-title="{_attr(groups.get(row.get("category_id")))}",'
+                f'{_attr(row.get("name"))}\n{url}\n')
+
+    def stream(self, connection_id, types, version):
+        """Renders the playlist while writing it to the version's cache file."""
+        path = self.cache_path(connection_id, version, types)
+        fd, tmp_path = tempfile.mkstemp(dir=PLAYLIST_CACHE_DIR, suffix='.part')
+        completed = False
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as cache_file:
+                for chunk in self.render(connection_id, types):
+                    cache_file.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+            completed = True
+            self._drop_old_versions(connection_id, version)
+        finally:
+            if not completed:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _drop_old_versions(connection_id, version):
+        for path in glob.glob(os.path.join(PLAYLIST_CACHE_DIR, f"{connection_id}-*.m3u")):
+            if not os.path.basename(path).startswith(f"{connection_id}-{version}-"):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.info(f"Could not remove stale playlist {path}: {e}")
@@ -0,0 +1,209 @@
+import logging
+import os
+import re
+import time
+import zlib
+from urllib.parse import urlsplit
+from src.services import upstream
+from src.services.catalog_cache import catalog_cache
+from src.services.category_tree import CategoryTrees
+from src.services.shared_catalog import shared_catalogs
+from src.services.sync_engine import BatchedDiffWriter, CatalogSyncEngine
+
+EXTINF_ATTRIBUTE = re.compile(r'([\w-]+)="([^"]*)"')
+VOD_EXTENSIONS = ('mp4', 'mkv', 'avi', 'mov', 'm4v', 'wmv', 'flv', 'webm')
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 30
+
+LIVE_COLUMNS = ['stream_id', 'name', 'stream_icon', 'category_id', 'epg_channel_id', 'is_adult', 'direct_source']
+VOD_COLUMNS = ['stream_id', 'name', 'stream_icon', 'category_id', 'container_extension', 'direct_source', 'stream_type']
+CATEGORY_COLUMNS = ['category_id', 'category_name', 'parent_id']
+
+
+def _stable_id(text):
+    # crc32 fits the INT id columns and is stable across runs and processes.
+    return zlib.crc32(text.encode('utf-8')) & 0x7fffffff
+
+
+def parse_m3u(lines):
+    """
+    Incremental M3U/M3U8 parser. Takes an iterable of text lines and yields
+    {'title', 'url', 'attributes'} per entry without holding the playlist.
+    """
+    pending = None
+    group = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXTINF'):
+            # The title starts at the first comma after the attributes, whose
+            # quoted values may contain commas themselves.
+            last_quote = line.rfind('"')
+            comma = line.find(',', last_quote + 1 if last_quote != -1 else 0)
+            header = line if comma == -1 else line[:comma]
+            title = '' if comma == -1 else line[comma + 1:]
+            pending = {'title': title.strip(), 'attributes': dict(EXTINF_ATTRIBUTE.findall(header))}
+            group = None
+        elif line.startswith('#EXTGRP:'):
+            group = line[len('#EXTGRP:'):].strip()
+        elif line.startswith('#'):
+            continue
+        elif pending is not None:
+            if group and 'group-title' not in pending['attributes']:
+                pending['attributes']['group-title'] = group
+            pending['url'] = line
+            yield pending
+            pending = None
+
+
+def _iter_source_lines(source):
+    if os.path.exists(source):
+        with open(source, encoding='utf-8', errors='replace') as playlist_file:
+            yield from playlist_file
+        return
+    with upstream.session.get(source, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS,
+                              headers=upstream.proxy_headers(source), verify=False) as response:
+        response.raise_for_status()
+        response.encoding = response.encoding or 'utf-8'
+        yield from response.iter_lines(chunk_size=DOWNLOAD_CHUNK_SIZE, decode_unicode=True)
+
+
+def _host(url):
+    try:
+        return urlsplit(url if '//' in url else f'http://{url}').netloc.lower()
+    except ValueError:
+        return ''
+
+
+def _stream_id(url, server_host):
+    # Xtream-style URLs of the connection's own server end in /<stream_id>.<ext>
+    # and keep that id; anything else (other hosts reuse the same small
+    # numbers) gets a stable hash of the whole URL.
+    name = url.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+    stem = name.split('.', 1)[0]
+    return int(stem) if stem.isdigit() and server_host and _host(url) == server_host else _stable_id(url)
+
+
+def _unique_id(stream_id, url, taken):
+    # 31-bit hashes do collide in large playlists; the writer would drop the
+    # second entry. A taken id is re-hashed with a salt until it is free, in
+    # playlist order, so re-imports of the same playlist keep their ids.
+    # `taken` maps each id to a hash of its URL, not the URL itself.
+    url_hash = hash(url)
+    salt = 0
+    while taken.setdefault(stream_id, url_hash) != url_hash:
+        salt += 1
+        stream_id = _stable_id(f'{salt}:{url}')
+    return stream_id
+
+
+def _extension(url):
+    name = url.split('?', 1)[0].rsplit('/', 1)[-1]
+    return name.rsplit('.', 1)[-1].lower() if '.' in name else None
+
+
+class M3UImporter:
+    """
+    Imports a plain M3U playlist as a connection's catalog.
+
+    The playlist is parsed line by line as it downloads (or is read from
+    disk); groups become categories, entries pointing at video files become
+    vod_streams rows and everything else live_streams rows, with the entry's
+    URL kept in direct_source, which playback and export use as is. Rows go through the same BatchedDiffWriter as
+    the Xtream sync, so only changes are written and recorded in the change
+    log, and memory is bounded by the number of keys rather than the
+    playlist size.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.supabase = service.supabase
+
+    def import_playlist(self, connection_id, source):
+        started = time.monotonic()
+        logging.info(f"Starting M3U import for connection {connection_id}")
+        # The playlist replaces whatever catalog the connection shared with others.
+        shared_catalogs.unlink(self.supabase, connection_id)
+        writers = {
+            'live': BatchedDiffWriter(self.supabase, connection_id, 'live_streams', LIVE_COLUMNS),
+            'vod': BatchedDiffWriter(self.supabase, connection_id, 'vod_streams', VOD_COLUMNS),
+        }
+        conn_details = self.service._get_xtream_connection_details(connection_id) or {}
+        server_host = _host(conn_details.get('server_url') or '')
+        try:
+            groups = {'live': {}, 'vod': {}}
+            taken = {'live': {}, 'vod': {}}
+            # Per category: what the category tree needs, gathered while streaming.
+            summaries = {'live': {}, 'vod': {}}
+            entries = 0
+
+            for entry in parse_m3u(_iter_source_lines(source)):
+                url = entry['url']
+                attributes = entry['attributes']
+                extension = _extension(url)
+                kind = 'vod' if extension in VOD_EXTENSIONS or '/movie/' in url else 'live'
+                group_name = attributes.get('group-title') or 'Sem categoria'
+                category_id = groups[kind].setdefault(group_name, str(_stable_id(group_name)))
+                name = attributes.get('tvg-name') or entry['title']
+                stream_id = _unique_id(_stream_id(url, server_host), url, taken[kind])
+
+                if kind == 'live':
+                    row = {
+                        'connection_id': connection_id,
+                        'stream_id': stream_id,
+                        'name': name,
+                        'stream_icon': attributes.get('tvg-logo'),
+                        'category_id': category_id,
+                        'epg_channel_id': attributes.get('tvg-id'),
+                        'is_adult': '0',
+                        'direct_source': url,
+                    }
+                else:
+                    row = {
+                        'connection_id': connection_id,
+                        'stream_id': stream_id,
+                        'name': name,
+                        'stream_icon': attributes.get('tvg-logo'),
+                        'category_id': category_id,
+                        'container_extension': extension,
+                        'direct_source': url,
+                        'stream_type': 'movie',
+                    }
+                writers[kind].add(row)
+                summary = summaries[kind].setdefault(category_id, {'item_count': 0, 'adult': False, 'artwork': None})
+                summary['item_count'] += 1
+                summary['artwork'] = summary['artwork'] or row['stream_icon']
+                entries += 1
+
+            # Only reached when the whole playlist was read: a truncated
+            # download must not delete the entries it did not get to.
+            changes = []
+            for kind, writer in writers.items():
+                changes += writer.finish()
+                category_writer = BatchedDiffWriter(self.supabase, connection_id, f'{kind}_categories', CATEGORY_COLUMNS)
+                for name, category_id in groups[kind].items():
+                    category_writer.add({'connection_id': connection_id, 'category_id': category_id,
+                                         'category_name': name, 'parent_id': None})
+                changes += category_writer.finish()
+
+            version = CatalogSyncEngine(self.service).change_log.record(connection_id, changes)
+            if changes:
+                catalog_cache.invalidate(connection_id)
+            for kind, names in groups.items():
+                CategoryTrees(self.supabase).save(connection_id, kind, [
+                    {'category_id': category_id, 'category_name': name, 'parent_id': None}
+                    for name, category_id in names.items()], summaries[kind], version)
+
+            elapsed = time.monotonic() - started
+            logging.info(f"M3U import for connection {connection_id} completed in {elapsed:.1f}s: "
+                         f"{entries} entries, {len(changes)} changes, version {version}.")
+            return {'success': True, 'entries': entries, 'changes': len(changes), 'version': version}
+        except Exception as e:
+            logging.error(f"Error during M3U import for connection {connection_id}: {e}", exc_info=True)
+            # Batches already upserted must still reach the change log.
+            written = [change for writer in writers.values() for change in writer.changes]
+            if written:
+                CatalogSyncEngine(self.service).change_log.record(connection_id, written)
+                catalog_cache.invalidate(connection_id)
+            return {'success': False, 'error': str(e)}
@@ -0,0 +1,163 @@
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600)
+
+# Structured log sampling: fraction of sampled events that are written, and
+# the most characters of any payload preview a log line may carry.
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+LOG_PREVIEW_CHARS = 512
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra) if extra else [])
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    In-process counters, gauges and histograms rendered in the Prometheus
+    text format. Recording is a dict lookup and an increment under one lock,
+    cheap enough for every request and every upstream call.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, labels=None, amount=1):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, labels=None):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def cache_result(self, cache, hit, amount=1):
+        self.inc('iptv_cache_requests_total', {'cache': cache, 'result': 'hit' if hit else 'miss'}, amount)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+                for name, series in sorted(metrics.items()):
+                    help_kind, help_text = self._help.get(name, (kind, name))
+                    lines.append(f'# HELP {name} {help_text}')
+                    lines.append(f'# TYPE {name} {help_kind}')
+                    for key, value in series.items():
+                        lines.append(f'{name}{_format_labels(key)} {value}')
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f'# HELP {name} {self._help.get(name, ("histogram", name))[1]}')
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {histogram.total}')
+                    lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.describe('iptv_http_request_duration_seconds', 'histogram', 'Flask request latency by route, method and status.')
+metrics.describe('iptv_http_requests_total', 'counter', 'Flask requests by route, method and status.')
+metrics.describe('iptv_upstream_request_duration_seconds', 'histogram', 'Xtream API latency by action and outcome.')
+metrics.describe('iptv_proxy_bytes_total', 'counter', 'Bytes sent to clients by /proxy, by kind.')
+metrics.describe('iptv_cache_requests_total', 'counter', 'Cache lookups by cache and result.')
+metrics.describe('iptv_shared_cache_evictions_total', 'counter', 'Entries evicted from the cross-worker cache to stay within budget.')
+metrics.describe('iptv_sync_duration_seconds', 'histogram', 'Catalog sync duration by content type and outcome.')
+metrics.describe('iptv_sync_rows_total', 'counter', 'Rows read from the provider during syncs, by content type.')
+metrics.describe('iptv_sync_changes_total', 'counter', 'Rows changed by syncs, by content type.')
+
+
+def preview(value, limit=LOG_PREVIEW_CHARS):
+    """Size-capped text form of a payload, for logs."""
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text)} chars)"
+
+
+def log_event(event, level=logging.INFO, sample_rate=1.0, **fields):
+    """
+    Writes one JSON log line for `event`, keeping only `sample_rate` of the
+    calls. Payload-like fields should go through preview() first.
+    """
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    logging.log(level, json.dumps({'event': event, **fields}, default=str))
+
+
+def init_app(app):
+    """Times every request and exposes the registry at /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            labels = {'route': route, 'method': request.method, 'status': response.status_code}
+            metrics.observe('iptv_http_request_duration_seconds', time.perf_counter() - started, labels)
+            metrics.inc('iptv_http_requests_total', labels)
+        return response
+
+    @app.route('/metrics')
+    def _metrics():
+        token = os.environ.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('unauthorized\n', status=401, mimetype='text/plain')
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from src.services import upstream
+from src.services.circuit_breaker import OPEN, circuit_breakers
+from src.services.shared_cache import shared_cache
+
+EWMA_ALPHA = 0.3
+# Latency assumed for a mirror that has not been measured yet; keeps the
+# stored server_url first until probes say otherwise.
+DEFAULT_LATENCY_SECONDS = 1.0
+UNHEALTHY_ERROR_RATE = 0.5
+PROBE_INTERVAL_SECONDS = 30
+PROBE_TIMEOUT_SECONDS = 5
+# One worker of the box probes a mirror per interval and shares the result with the others.
+PROBE_LEASE_SECONDS = PROBE_INTERVAL_SECONDS * 0.8
+PROBE_RESULT_TTL_SECONDS = PROBE_INTERVAL_SECONDS * 3
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_DELAY_SECONDS = 0.3
+HEDGE_MAX_DELAY_SECONDS = 3.0
+# Threads for hedged calls (two attempts each) per process. Connections with a
+# single mirror never hedge and call from the request's own thread.
+HEDGED_REQUEST_WORKERS = int(os.environ.get('HEDGED_REQUEST_WORKERS', 8))
+LATENCY_WINDOW = 200
+# Connections without provider traffic for this long are no longer probed.
+CONNECTION_IDLE_SECONDS = 15 * 60
+# Listings that, without a category_id, return the whole catalog.
+BULK_ACTIONS = ('get_live_streams', 'get_vod_streams', 'get_series')
+
+
+def _server_info(conn_details):
+    info = conn_details.get('server_info') or {}
+    if isinstance(info, str):
+        try:
+            info = json.loads(info)
+        except json.JSONDecodeError:
+            info = {}
+    return info if isinstance(info, dict) else {}
+
+
+def mirror_urls(conn_details):
+    """
+    Candidate base URLs for a connection: the stored server_url first, then
+    the http/https endpoints advertised in the provider's server_info.
+    """
+    primary = conn_details['server_url'].rstrip('/')
+    if primary.endswith('/player_api.php'):
+        primary = primary[:-len('/player_api.php')]
+    mirrors = [primary]
+    info = _server_info(conn_details)
+    host = info.get('url')
+    if host:
+        if info.get('https_port'):
+            mirrors.append(f"https://{host}:{info['https_port']}")
+        if info.get('port'):
+            mirrors.append(f"http://{host}:{info['port']}")
+    return list(dict.fromkeys(mirrors))
+
+
+def _latency_kind(params):
+    """The breaker's latency window for a call: its action, whole-catalog listings apart."""
+    params = params or {}
+    action = params.get('action')
+    if action in BULK_ACTIONS and not params.get('category_id'):
+        return f'{action}:all'
+    return action
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _MirrorStats:
+    def __init__(self):
+        self.latency = None
+        self.error_rate = 0.0
+
+    def observe(self, latency, ok):
+        if ok:
+            self.latency = latency if self.latency is None else (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * latency
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA * (0.0 if ok else 1.0)
+
+    @property
+    def healthy(self):
+        return self.error_rate < UNHEALTHY_ERROR_RATE
+
+    def score(self):
+        latency = DEFAULT_LATENCY_SECONDS if self.latency is None else self.latency
+        return latency * (1 + self.error_rate)
+
+
+class MirrorSelector:
+    """
+    Routes provider traffic to the fastest healthy mirror of a connection.
+
+    Every mirror keeps EWMAs of latency and error rate, fed by real requests
+    and by a background prober that pings player_api.php on each registered
+    connection. API calls are hedged: if the best mirror has not answered
+    after the recent p95 latency, the same request goes to the runner-up and
+    the first good answer wins. The hedge delay counts from the moment the
+    first attempt actually starts, so time queued behind other requests in
+    the pool never triggers extra hedges. Connections idle for
+    CONNECTION_IDLE_SECONDS stop being probed, and each mirror is probed by
+    one worker of the box per interval (a lease in the shared cache); the
+    others adopt its published result.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._connections = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=HEDGED_REQUEST_WORKERS, thread_name_prefix='mirror-request')
+        self._prober = None
+        # Time of the last shared probe result observed, per mirror.
+        self._adopted = {}
+
+    def _stats_for(self, mirror):
+        stats = self._stats.get(mirror)
+        if stats is None:
+            stats = self._stats[mirror] = _MirrorStats()
+        return stats
+
+    def ranked(self, connection_id, conn_details):
+        """Mirrors for the connection, best first. Registers them for probing."""
+        mirrors = mirror_urls(conn_details)
+        with self._lock:
+            self._connections[connection_id] = {
+                'mirrors': mirrors,
+                'username': conn_details['username'],
+                'password': conn_details['password'],
+                'used_at': time.monotonic(),
+            }
+            stats = [self._stats_for(mirror) for mirror in mirrors]
+        self._ensure_prober()
+        open_circuits = [circuit_breakers.for_url(mirror).state == OPEN for mirror in mirrors]
+        order = sorted(range(len(mirrors)), key=lambda i: (open_circuits[i], not stats[i].healthy, stats[i].score()))
+        return [mirrors[i] for i in order]
+
+    def best(self, connection_id, conn_details):
+        return self.ranked(connection_id, conn_details)[0]
+
+    def observe(self, mirror, latency, ok):
+        with self._lock:
+            self._stats_for(mirror).observe(latency, ok)
+            if ok:
+                self._latencies.append(latency)
+
+    def hedge_delay(self):
+        with self._lock:
+            p = percentile(self._latencies, HEDGE_PERCENTILE)
+        if p is None:
+            return HEDGE_MAX_DELAY_SECONDS
+        return min(HEDGE_MAX_DELAY_SECONDS, max(HEDGE_MIN_DELAY_SECONDS, p))
+
+    def _timed_get(self, mirror, path, params, headers, timeout, started_event=None):
+        if started_event is not None:
+            started_event.set()
+        breaker = circuit_breakers.for_url(mirror)
+        breaker.check()
+        kind = _latency_kind(params)
+        started = time.monotonic()
+        try:
+            response = upstream.session.get(f"{mirror}/{path}", params=params, headers=headers,
+                                            timeout=breaker.timeout(timeout, kind))
+        except Exception:
+            self.observe(mirror, time.monotonic() - started, False)
+            breaker.record_failure()
+            raise
+        latency = time.monotonic() - started
+        ok = response.status_code < 500
+        self.observe(mirror, latency, ok)
+        if ok:
+            breaker.record_success(latency, kind)
+        else:
+            breaker.record_failure()
+        return response
+
+    def get(self, connection_id, conn_details, path, params=None, headers=None, timeout=10):
+        """
+        GETs `path` from the best mirror, hedging to the next one after the
+        percentile-based delay or as soon as the first attempt fails.
+        """
+        mirrors = self.ranked(connection_id, conn_details)
+        spare = mirrors[1:2]
+        if not spare:
+            return self._timed_get(mirrors[0], path, params, headers, timeout)
+        started = threading.Event()
+        futures = {self._pool.submit(self._timed_get, mirrors[0], path, params, headers, timeout, started)}
+        # A busy pool delays the start; only the provider's own slowness counts toward hedging.
+        started.wait(timeout)
+        done, _ = wait(futures, timeout=self.hedge_delay())
+        if started.is_set() and (not done or not self._succeeded(next(iter(done)))):
+            futures.add(self._pool.submit(self._timed_get, spare[0], path, params, headers, timeout))
+
+        last_response = None
+        last_error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    last_error = e
+                    continue
+                if response.status_code < 500:
+                    return response
+                last_response = response
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    @staticmethod
+    def _succeeded(future):
+        try:
+            return future.result().status_code < 500
+        except requests.exceptions.RequestException:
+            return False
+
+    def _ensure_prober(self):
+        if self._prober is not None:
+            return
+        with self._lock:
+            if self._prober is None:
+                self._prober = threading.Thread(target=self._probe_loop, name='mirror-prober', daemon=True)
+                self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(PROBE_INTERVAL_SECONDS)
+            with self._lock:
+                idle_since = time.monotonic() - CONNECTION_IDLE_SECONDS
+                for connection_id in [connection_id for connection_id, connection in self._connections.items()
+                                      if connection['used_at'] < idle_since]:
+                    del self._connections[connection_id]
+                # Stats of mirrors no connection uses any more are rebuilt when needed.
+                in_use = {mirror for connection in self._connections.values() for mirror in connection['mirrors']}
+                for mirror in [mirror for mirror in self._stats if mirror not in in_use]:
+                    del self._stats[mirror]
+                    self._adopted.pop(mirror, None)
+                connections = list(self._connections.values())
+            probed = set()
+            for connection in connections:
+                for mirror in connection['mirrors']:
+                    # Mirrors shared by several connections are probed once per round.
+                    if mirror in probed:
+                        continue
+                    probed.add(mirror)
+                    if shared_cache.acquire(f'mirror_probe_lease:{mirror}', PROBE_LEASE_SECONDS):
+                        self._probe(mirror, connection['username'], connection['password'])
+                    else:
+                        self._adopt(mirror)
+
+    def _probe(self, mirror, username, password):
+        started = time.monotonic()
+        try:
+            response = upstream.session.get(f"{mirror}/player_api.php", params={'username': username, 'password': password},
+                                            headers={'User-Agent': upstream.USER_AGENT}, timeout=PROBE_TIMEOUT_SECONDS)
+            ok = response.status_code < 400 and 'user_info' in response.text
+        except requests.exceptions.RequestException as e:
+            logging.info(f"Mirror probe failed for {mirror}: {e}")
+            ok = False
+        latency = time.monotonic() - started
+        self.observe(mirror, latency, ok)
+        shared_cache.set(f'mirror_probe:{mirror}', {'latency': latency, 'ok': ok, 'at': time.time()},
+                         PROBE_RESULT_TTL_SECONDS)
+
+    def _adopt(self, mirror):
+        """Observes the probe result another worker published for `mirror`, once."""
+        result, _ = shared_cache.get(f'mirror_probe:{mirror}')
+        if not isinstance(result, dict) or result.get('at', 0) <= self._adopted.get(mirror, 0):
+            return
+        self._adopted[mirror] = result['at']
+        self.observe(mirror, result['latency'], result['ok'])
+
+
+mirror_selector = MirrorSelector()
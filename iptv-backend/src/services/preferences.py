@@ -0,0 +1,280 @@
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+RECENTS_LIMIT = 50
+FLUSH_INTERVAL_SECONDS = 5
+# Clean (already flushed) users kept in memory; dirty ones are never evicted.
+MAX_CACHED_USERS = 10000
+# Reads re-load a cached row after this long, to pick up changes made through other workers.
+REVALIDATE_SECONDS = 10
+LOAD_CHUNK_SIZE = 200
+
+SCALAR_FIELDS = {
+    'quality_preference': 'auto',
+    'volume_level': 1.0,
+    'subtitle_enabled': False,
+    'subtitle_language': 'pt',
+}
+
+
+def _load_json_list(value):
+    if isinstance(value, list):
+        return value
+    try:
+        return json.loads(value) if value else []
+    except (TypeError, json.JSONDecodeError):
+        return []
+
+
+class _UserState:
+    def __init__(self, row=None):
+        row = row or {}
+        self.scalars = {field: default if row.get(field) is None else row[field]
+                        for field, default in SCALAR_FIELDS.items()}
+        self.favorites = list(dict.fromkeys(_load_json_list(row.get('favorite_channels'))))
+        self.recents = deque(_load_json_list(row.get('recent_channels'))[:RECENTS_LIMIT], maxlen=RECENTS_LIMIT)
+        # Row version for the conditional write; None when the user has no row yet.
+        self.exists = bool(row.get('user_id'))
+        self.updated_at = row.get('updated_at')
+        # Updates not flushed yet, replayed on top of every fresher row.
+        self.pending = []
+        self.loaded_at = time.monotonic()
+
+    def to_dict(self):
+        data = dict(self.scalars)
+        data['favorite_channels'] = list(self.favorites)
+        data['recent_channels'] = list(self.recents)
+        return data
+
+    def to_row(self, user_id):
+        row = dict(self.scalars)
+        row['user_id'] = user_id
+        row['favorite_channels'] = json.dumps(self.favorites)
+        row['recent_channels'] = json.dumps(list(self.recents))
+        row['updated_at'] = datetime.utcnow().isoformat()
+        return row
+
+    def apply(self, data):
+        """
+        Applies a partial update. Besides the plain fields, `add_favorite`,
+        `remove_favorite`, `toggle_favorite` and `add_recent` apply a
+        single-item change to the collections.
+        """
+        for field in SCALAR_FIELDS:
+            if field in data:
+                self.scalars[field] = data[field]
+        if 'favorite_channels' in data:
+            self.favorites = list(dict.fromkeys(data['favorite_channels'] or []))
+        if 'recent_channels' in data:
+            self.recents = deque((data['recent_channels'] or [])[:RECENTS_LIMIT], maxlen=RECENTS_LIMIT)
+        if data.get('toggle_favorite') is not None:
+            self.toggle_favorite(data['toggle_favorite'])
+        if data.get('add_favorite') is not None and data['add_favorite'] not in self.favorites:
+            self.favorites.append(data['add_favorite'])
+        if data.get('remove_favorite') is not None and data['remove_favorite'] in self.favorites:
+            self.favorites.remove(data['remove_favorite'])
+        if data.get('add_recent') is not None:
+            self.add_recent(data['add_recent'])
+
+    def resolved(self, data):
+        """
+        `data` with a toggle_favorite turned into the add_favorite or
+        remove_favorite it means for this state. Pending updates are replayed
+        on rows other workers may have changed, where replaying a toggle
+        could undo the very change the user saw.
+        """
+        if data.get('toggle_favorite') is None:
+            return dict(data)
+        data = dict(data)
+        item = data.pop('toggle_favorite')
+        favorites = (data['favorite_channels'] or []) if 'favorite_channels' in data else self.favorites
+        data['remove_favorite' if item in favorites else 'add_favorite'] = item
+        return data
+
+    @classmethod
+    def rebased(cls, row, pending):
+        """A state built from a fresher row with the given updates replayed on it."""
+        state = cls(row)
+        for data in pending:
+            state.apply(data)
+        state.pending = list(pending)
+        return state
+
+    def add_recent(self, item):
+        try:
+            self.recents.remove(item)
+        except ValueError:
+            pass
+        self.recents.appendleft(item)
+
+    def toggle_favorite(self, item):
+        if item in self.favorites:
+            self.favorites.remove(item)
+        else:
+            self.favorites.append(item)
+
+
+class PreferencesStore:
+    """
+    In-memory user preferences with coalesced write-behind to Supabase.
+
+    Writes only touch process memory and are kept as a list of updates
+    (a field set, a favorite added or removed, a recent added); a background thread
+    flushes every user changed since the last flush each
+    FLUSH_INTERVAL_SECONDS (and once more at shutdown). Favorite toggles and
+    recents updates on every zap therefore never wait on the database, and
+    ten zaps between flushes cost a single row write.
+
+    Other workers write the same rows, so a flush never writes the cached
+    row back: it re-reads the dirty users' rows, replays the pending
+    updates on them and writes each with a conditional update on
+    updated_at; a row changed in between is merged again on the next
+    attempt. That re-read is also what refreshes a writing user's cached
+    row, so updates never wait on the database; reads re-load a cached row
+    older than REVALIDATE_SECONDS, so changes made through another worker
+    show up within that time.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL_SECONDS, revalidate_seconds=REVALIDATE_SECONDS):
+        self.flush_interval = flush_interval
+        self.revalidate_seconds = revalidate_seconds
+        self._states = OrderedDict()
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._supabase = None
+        self._flusher = None
+        self._stop = threading.Event()
+
+    def _load(self, supabase, user_ids):
+        rows = {}
+        for i in range(0, len(user_ids), LOAD_CHUNK_SIZE):
+            response = supabase.from_('user_preferences').select('*') \
+                .in_('user_id', user_ids[i:i + LOAD_CHUNK_SIZE]).execute()
+            rows.update({row['user_id']: row for row in response.data or []})
+        return rows
+
+    def _state(self, supabase, user_id, revalidate=True):
+        with self._lock:
+            self._supabase = supabase
+            state = self._states.get(user_id)
+            if state is not None and (not revalidate or time.monotonic() - state.loaded_at < self.revalidate_seconds):
+                self._states.move_to_end(user_id)
+                return state
+
+        row = self._load(supabase, [user_id]).get(user_id)
+        with self._lock:
+            current = self._states.get(user_id)
+            # Updates made while the row was read are replayed on it as well.
+            state = _UserState.rebased(row, current.pending if current is not None else [])
+            self._states[user_id] = state
+            self._states.move_to_end(user_id)
+            self._evict_clean()
+            return state
+
+    def _evict_clean(self):
+        for user_id in list(self._states.keys()):
+            if len(self._states) <= MAX_CACHED_USERS:
+                return
+            if user_id not in self._dirty:
+                del self._states[user_id]
+
+    def get(self, supabase, user_id):
+        state = self._state(supabase, user_id)
+        with self._lock:
+            return state.to_dict()
+
+    def update(self, supabase, user_id, data):
+        """
+        Applies a partial update (see _UserState.apply) and queues it for the
+        next flush, which re-reads the row; only a user not cached yet is
+        loaded first.
+        """
+        state = self._state(supabase, user_id, revalidate=False)
+        with self._lock:
+            state = self._states.get(user_id, state)
+            data = state.resolved(data)
+            state.apply(data)
+            state.pending.append(data)
+            self._dirty.add(user_id)
+            result = state.to_dict()
+        self._ensure_flusher()
+        return result
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._run, name='preferences-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Merges and writes every dirty user. Users whose write failed or lost a race stay dirty."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty or self._supabase is None:
+                    return 0
+                # Users stay dirty (and cached) until their write went through.
+                dirty = sorted(self._dirty)
+                supabase = self._supabase
+            try:
+                rows = self._load(supabase, dirty)
+            except Exception as e:
+                logging.error(f"Failed to read {len(dirty)} user preferences for flushing: {e}")
+                return 0
+
+            written = 0
+            for user_id in dirty:
+                with self._lock:
+                    pending = list(self._states[user_id].pending)
+                merged = _UserState.rebased(rows.get(user_id), pending)
+                row = merged.to_row(user_id)
+                try:
+                    if not self._write(supabase, merged, row):
+                        continue
+                except Exception as e:
+                    logging.error(f"Failed to flush preferences of user {user_id}: {e}")
+                    continue
+                with self._lock:
+                    # Updates that arrived during the write stay pending on top of the written row.
+                    state = self._states[user_id] = _UserState.rebased(row, self._states[user_id].pending[len(pending):])
+                    if not state.pending:
+                        self._dirty.discard(user_id)
+                written += 1
+            return written
+
+    @staticmethod
+    def _write(supabase, merged, row):
+        """Writes the merged row unless another worker changed it since it was read."""
+        if not merged.exists:
+            try:
+                supabase.from_('user_preferences').insert(row).execute()
+                return True
+            except Exception as e:
+                # Another worker created the row first (unique user_id): merge again next flush.
+                logging.info(f"Preferences row of user {row['user_id']} was created concurrently: {e}")
+                return False
+        query = supabase.from_('user_preferences').update(row).eq('user_id', row['user_id'])
+        if merged.updated_at is None:
+            query = query.is_('updated_at', 'null')
+        else:
+            query = query.eq('updated_at', merged.updated_at)
+        return bool(query.execute().data)
+
+    def shutdown(self):
+        self._stop.set()
+        self.flush()
+
+
+preferences_store = PreferencesStore()
+atexit.register(preferences_store.shutdown)
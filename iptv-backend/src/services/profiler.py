@@ -0,0 +1,245 @@
+import hmac
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+
+# Opt-in per request with `X-Profile: <PROFILE_TOKEN>`; PROFILE_SAMPLE_RATE
+# additionally profiles a random fraction of all requests. With neither set
+# no hook is installed at all.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+# When set, every finished profile is also written there as a .folded file.
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+SAMPLE_INTERVAL_SECONDS = 0.005
+MAX_STORED_PROFILES = 50
+MAX_STACK_DEPTH = 64
+TOP_ALLOCATIONS = 20
+
+# Wait classification by the innermost matching frame's file path.
+WAIT_CLASSES = (
+    ('supabase', ('/postgrest/', '/supabase/', '/gotrue/', '/storage3/')),
+    ('provider', ('/requests/', '/urllib3/', 'src/services/upstream.py', 'src/services/mirrors.py')),
+)
+
+
+def _frame_label(code):
+    parts = code.co_filename.replace('\\', '/').rsplit('/', 2)
+    return f"{'/'.join(parts[-2:])}:{code.co_name}"
+
+
+def _classify(frame):
+    """Returns 'supabase', 'provider' or 'app' for the stack ending at `frame`."""
+    while frame is not None:
+        filename = frame.f_code.co_filename.replace('\\', '/')
+        for wait_class, markers in WAIT_CLASSES:
+            if any(marker in filename for marker in markers):
+                return wait_class
+        frame = frame.f_back
+    return 'app'
+
+
+class Profile:
+    """Stack samples, timings and allocation deltas of one request."""
+
+    def __init__(self, profile_id, label, thread_id, allocations):
+        self.id = profile_id
+        self.label = label
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self.waits = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self._wall_started = time.perf_counter()
+        self._cpu_started = time.thread_time()
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.status = None
+        self.allocations = None
+        self.traces_allocations = allocations
+        self._snapshot = tracemalloc.take_snapshot() if allocations else None
+
+    def record(self, frame):
+        stack = []
+        current = frame
+        while current is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(_frame_label(current.f_code))
+            current = current.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+        self.waits[_classify(frame)] += 1
+        self.samples += 1
+
+    def finish(self, status):
+        self.wall_seconds = time.perf_counter() - self._wall_started
+        self.cpu_seconds = time.thread_time() - self._cpu_started
+        self.status = status
+        if self._snapshot is not None:
+            diff = tracemalloc.take_snapshot().compare_to(self._snapshot, 'lineno')
+            self.allocations = [{
+                'location': str(stat.traceback[0]),
+                'size_bytes': stat.size_diff,
+                'count': stat.count_diff,
+            } for stat in diff[:TOP_ALLOCATIONS]]
+            self._snapshot = None
+
+    def folded(self):
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self):
+        # Sample shares are scaled to wall time to estimate where it went.
+        total = self.samples or 1
+        wait_seconds = {name: round(self.wall_seconds * self.waits[name] / total, 4)
+                        for name in ('supabase', 'provider', 'app')} if self.wall_seconds is not None else None
+        return {
+            'id': self.id,
+            'label': self.label,
+            'status': self.status,
+            'started_at': self.started_at,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'samples': self.samples,
+            'wait_seconds': wait_seconds,
+            'allocations': self.allocations,
+        }
+
+
+class RequestProfiler:
+    """
+    Sampling profiler for individual requests.
+
+    While at least one profile is active a single daemon thread samples the
+    stacks of the profiled request threads every SAMPLE_INTERVAL_SECONDS;
+    otherwise it sleeps on an event. Samples are classified by the frames on
+    the stack as waiting on Supabase, waiting on the provider or running app
+    code. Opt-in profiles also trace allocations with tracemalloc, which is
+    process-wide while any such profile runs.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SECONDS, max_profiles=MAX_STORED_PROFILES):
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self._active = {}
+        self._finished = OrderedDict()
+        self._ids = itertools.count(1)
+        self._tracing = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler = None
+
+    def start(self, label, allocations=False):
+        thread_id = threading.get_ident()
+        with self._lock:
+            if allocations:
+                if self._tracing == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                self._tracing += 1
+            profile = Profile(f"{int(time.time())}-{next(self._ids)}", label, thread_id, allocations)
+            self._active[thread_id] = profile
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name='request-profiler', daemon=True)
+                self._sampler.start()
+        self._wakeup.set()
+        return profile
+
+    def stop(self, profile, status=None):
+        profile.finish(status)
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+            if profile.traces_allocations:
+                self._tracing -= 1
+                if self._tracing == 0:
+                    tracemalloc.stop()
+            self._finished[profile.id] = profile
+            while len(self._finished) > self.max_profiles:
+                self._finished.popitem(last=False)
+            if not self._active:
+                self._wakeup.clear()
+        if PROFILE_DIR:
+            self._dump(profile)
+
+    def _sample_loop(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for profile in active:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.record(frame)
+
+    def _dump(self, profile):
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, f"{profile.id}.folded"), 'w') as folded_file:
+                folded_file.write(profile.folded())
+        except OSError as e:
+            logging.info(f"Could not write profile {profile.id}: {e}")
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._finished.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return [profile.summary() for profile in reversed(self._finished.values())]
+
+
+request_profiler = RequestProfiler()
+
+
+def is_authorized(value):
+    return bool(PROFILE_TOKEN) and value is not None and hmac.compare_digest(value, PROFILE_TOKEN)
+
+
+def init_app(app):
+    """Installs the per-request hooks and the /debug/profiles endpoints."""
+    from flask import Response, g, jsonify, request
+
+    if PROFILE_TOKEN or PROFILE_SAMPLE_RATE > 0:
+        @app.before_request
+        def _start_profile():
+            opted_in = is_authorized(request.headers.get('X-Profile'))
+            if opted_in or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE):
+                g.profile = request_profiler.start(f"{request.method} {request.path}", allocations=opted_in)
+
+        @app.after_request
+        def _finish_profile(response):
+            profile = g.pop('profile', None)
+            if profile is not None:
+                response.headers['X-Profile-Id'] = profile.id
+                # Closing covers streamed bodies (the /proxy media path) too.
+                response.call_on_close(lambda: request_profiler.stop(profile, response.status_code))
+            return response
+
+    def _authorized():
+        header = request.headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else request.headers.get('X-Profile')
+        return is_authorized(token)
+
+    @app.route('/debug/profiles')
+    def _list_profiles():
+        if not _authorized():
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        return jsonify({'success': True, 'profiles': request_profiler.list()})
+
+    @app.route('/debug/profiles/<profile_id>')
+    def _get_profile(profile_id):
+        if not _authorized():
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        folded = profile_id.endswith('.folded')
+        profile = request_profiler.get(profile_id[:-len('.folded')] if folded else profile_id)
+        if profile is None:
+            return jsonify({'success': False, 'error': 'Profile not found'}), 404
+        if folded:
+            return Response(profile.folded(), mimetype='text/plain')
+        return jsonify({'success': True, 'profile': {**profile.summary(), 'stacks': dict(profile.stacks.most_common(200))}})
@@ -0,0 +1,88 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+from urllib.parse import quote, unquote
+from src.services import upstream
+from src.services.ttl_cache import TTLCache
+
+# A VOD playlist is fetched once and its segments for as long as the movie plays.
+SEGMENT_BASE_TTL_SECONDS = 6 * 3600
+BASE_ID_BYTES = 9
+SIGNATURE_BYTES = 6
+SEGMENT_ROUTE = '/api/iptv/proxy/s'
+# Characters kept as-is when a segment name is put back into a URL path.
+PATH_SAFE = "/:@!$&'()*+,;=-._~"
+
+
+def _b64(digest):
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+class SegmentTokens:
+    """
+    Short signed paths for the segments of rewritten HLS playlists.
+
+    A playlist's segment directory (scheme, host and path, which for Xtream
+    streams include the credentials) is registered once under a base id, an
+    HMAC of the directory, together with the headers sent to its host. Each
+    segment line then becomes /api/iptv/proxy/s/<base id>/<signature>/<name>,
+    where the signature is an HMAC of the base id and the segment name
+    (query string included). Resolving a segment is a table lookup plus one
+    HMAC; the table also lives in the SharedCache, so any worker resolves
+    paths issued by another.
+
+    Playlist optimizer options (hls_optimizer) are stored with the base, so
+    the variant and media playlists a rewritten playlist points to are
+    optimized the same way without carrying the client hints themselves.
+    """
+
+    def __init__(self, secret=None, ttl=SEGMENT_BASE_TTL_SECONDS):
+        secret = secret or os.environ.get('SESSION_SECRET_KEY')
+        if not secret:
+            logging.warning("SESSION_SECRET_KEY is not set; segment paths will only resolve in this process.")
+            secret = secrets.token_hex(32)
+        self._key = hashlib.sha256(b'segment-tokens:' + secret.encode()).digest()
+        self._bases = TTLCache(maxsize=8192, ttl=ttl, shared='segment_bases')
+
+    def _mac(self, message, size):
+        return _b64(hmac.new(self._key, message.encode(), hashlib.sha256).digest()[:size])
+
+    def register_base(self, base_url, options=None):
+        """Returns the base id of a segment directory URL (ending in '/') and playlist options."""
+        message = f'base\0{base_url}'
+        if options:
+            message += '\0' + json.dumps(options, sort_keys=True)
+        base_id = self._mac(message, BASE_ID_BYTES)
+        if self._bases.get(base_id) is None:
+            self._bases.set(base_id, {'url': base_url, 'headers': upstream.proxy_headers(base_url),
+                                      'options': options})
+        return base_id
+
+    def segment_path(self, base_id, name):
+        """The proxy path of segment `name` (relative to its base, query string included)."""
+        path, _, query = name.partition('?')
+        path = unquote(path)
+        sep = '?' if query else ''
+        signature = self._mac(f'{base_id}\0{path}{sep}{query}', SIGNATURE_BYTES)
+        return f'{SEGMENT_ROUTE}/{base_id}/{signature}/{quote(path, safe=PATH_SAFE)}{sep}{query}'
+
+    def verify(self, base_id, signature, path, query=''):
+        """Whether `signature` was issued for this base id and segment (path as decoded by the router)."""
+        sep = '?' if query else ''
+        expected = self._mac(f'{base_id}\0{path}{sep}{query}', SIGNATURE_BYTES)
+        return hmac.compare_digest(expected, signature)
+
+    def resolve(self, base_id, path, query=''):
+        """Returns (upstream url, headers, playlist options) of a verified segment, or None once its base expired."""
+        base = self._bases.get(base_id)
+        if base is None:
+            return None
+        sep = '?' if query else ''
+        return f"{base['url']}{quote(path, safe=PATH_SAFE)}{sep}{query}", base['headers'], base.get('options')
+
+
+segment_tokens = SegmentTokens()
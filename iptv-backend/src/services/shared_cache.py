@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import sqlite3
+import stat
+import threading
+import time
+from src.services.metrics import metrics
+
+# Private (0700) directory of the files the workers of one box share. The
+# files hold provider credentials, so they never live directly in /tmp.
+IPTV_DATA_DIR = os.environ.get('IPTV_DATA_DIR', os.path.join(os.path.expanduser('~'), '.iptv-backend'))
+# One file per box, shared by every worker process. An empty path disables the tier.
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH', os.path.join(IPTV_DATA_DIR, 'shared-cache.sqlite3'))
+SHARED_CACHE_MAX_BYTES = int(os.environ.get('SHARED_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Values larger than this share of the budget are kept per process only.
+MAX_VALUE_FRACTION = 0.125
+# Eviction runs once a process has written this share of the budget, instead
+# of summing sizes on every write: the file overshoots by at most that much.
+EVICT_SLACK_FRACTION = 0.05
+# Eviction frees down to this share of the budget so it does not run again right away.
+EVICT_TARGET_FRACTION = 0.9
+# A read refreshes an entry's LRU position at most this often (reads stay read-only).
+TOUCH_INTERVAL_SECONDS = 30
+BUSY_TIMEOUT_SECONDS = 2
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+    'size INTEGER NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS idx_entries_accessed_at ON entries (accessed_at)',
+)
+
+
+def private_dir(path):
+    """Creates the directory `path` (mode 0700) if missing; refuses it as private_file does."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    _check_private(path, stat.S_ISDIR)
+    return path
+
+
+def private_file(path):
+    """
+    Creates `path` (mode 0600) and its directory (mode 0700) if missing, and
+    refuses to use either when it is a symlink, belongs to another user or
+    is open to group or others: whoever can write the file controls what the
+    workers read from it.
+    """
+    private_dir(os.path.dirname(os.path.abspath(path)))
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    os.close(fd)
+    _check_private(path, stat.S_ISREG)
+
+
+def _check_private(path, is_kind):
+    info = os.lstat(path)
+    if not is_kind(info.st_mode) or info.st_mode & 0o077 or (hasattr(os, 'getuid') and info.st_uid != os.getuid()):
+        raise PermissionError(f"{path} must be a {'directory' if is_kind is stat.S_ISDIR else 'file'} "
+                              f"owned by this user and not accessible to group or others")
+
+
+class LocalDatabase:
+    """
+    SQLite file shared by the processes of one box, in WAL mode with
+    memory-mapped reads. Connections are per thread and per process, since
+    gunicorn may fork after import. The file is private to the app's user
+    (see private_file); SQLite gives its -wal and -shm files the same mode.
+    """
+
+    def __init__(self, path, schema, mmap_bytes=0):
+        self.path = path
+        self.schema = schema
+        self.mmap_bytes = mmap_bytes
+        self._local = threading.local()
+
+    def connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None and self._local.pid == os.getpid():
+            return db
+        try:
+            private_file(self.path)
+        except OSError as e:
+            # Callers treat storage errors as a miss or a lost event.
+            raise sqlite3.OperationalError(f"Unusable local database {self.path}: {e}") from e
+        db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(f'PRAGMA mmap_size={int(self.mmap_bytes)}')
+        for statement in self.schema:
+            db.execute(statement)
+        self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+
+class SharedCache:
+    """
+    Key-value cache shared by the worker processes of one box, kept in a
+    SQLite file.
+
+    The file is in WAL mode with memory-mapped reads, so readers never block
+    the writer and a hit costs a page lookup instead of a network round
+    trip. Every write is a single transaction, so other workers see either
+    the old value or the new one. Entries carry a wall-clock expiry.
+    The total size is capped at max_bytes: expired entries go first, then
+    the least recently read. Values are stored as JSON (values that are
+    not JSON stay in the per-process tier), so a tampered file can at worst
+    poison a cached value, never run code. Any storage error is logged and
+    treated as a miss; the cache never fails a request.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH, max_bytes=SHARED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._database = LocalDatabase(path, SCHEMA, mmap_bytes=max_bytes * 2)
+        self._written = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _db(self):
+        return self._database.connection()
+
+    def get(self, key):
+        """Returns (value, seconds left) or (None, 0) on a miss."""
+        if not self.enabled:
+            return None, 0
+        try:
+            db = self._db()
+            row = db.execute('SELECT value, expires_at, accessed_at FROM entries WHERE key = ?', (key,)).fetchone()
+            now = time.time()
+            if row is None or row[1] <= now:
+                metrics.cache_result('shared', False)
+                return None, 0
+            if row[2] < now - TOUCH_INTERVAL_SECONDS:
+                db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            value = json.loads(row[0])
+        except (sqlite3.Error, ValueError, TypeError) as e:
+            logging.info(f"Shared cache read of {key} failed: {e}")
+            return None, 0
+        metrics.cache_result('shared', True)
+        return value, row[1] - now
+
+    def set(self, key, value, ttl):
+        if not self.enabled:
+            return False
+        try:
+            blob = json.dumps(value, separators=(',', ':')).encode()
+        except (TypeError, ValueError):
+            return False
+        if len(blob) > self.max_bytes * MAX_VALUE_FRACTION:
+            return False
+        now = time.time()
+        try:
+            self._db().execute('INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) '
+                               'VALUES (?, ?, ?, ?, ?)', (key, blob, len(blob), now + ttl, now))
+        except sqlite3.Error as e:
+            logging.info(f"Shared cache write of {key} failed: {e}")
+            return False
+        with self._lock:
+            self._written += len(blob)
+            evict = self._written >= self.max_bytes * EVICT_SLACK_FRACTION
+            if evict:
+                self._written = 0
+        if evict:
+            self.evict()
+        return True
+
+    def acquire(self, key, ttl):
+        """
+        Takes the lease `key` for `ttl` seconds: True for a single caller
+        across the box's workers until it expires, so one worker does a
+        periodic job for all of them. Without a usable shared tier every
+        caller gets it, as if each worker were alone.
+        """
+        if not self.enabled:
+            return True
+        now = time.time()
+        try:
+            cursor = self._db().execute(
+                'INSERT INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, 1, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at, '
+                'accessed_at = excluded.accessed_at WHERE entries.expires_at <= ?',
+                (key, b'1', now + ttl, now, now))
+        except sqlite3.Error as e:
+            logging.info(f"Shared cache lease {key} failed: {e}")
+            return True
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        if not self.enabled:
+            return
+        try:
+            self._db().execute('DELETE FROM entries WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            logging.info(f"Shared cache delete of {key} failed: {e}")
+
+    def clear(self, prefix=''):
+        """Drops every entry whose key starts with `prefix` (everything by default)."""
+        if not self.enabled:
+            return
+        try:
+            self._db().execute('DELETE FROM entries WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+        except sqlite3.Error as e:
+            logging.info(f"Shared cache clear of '{prefix}' failed: {e}")
+
+    def evict(self):
+        """Drops expired entries, then the least recently read until the file is within budget."""
+        try:
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.execute('DELETE FROM entries WHERE expires_at <= ?', (time.time(),))
+                total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - self.max_bytes * EVICT_TARGET_FRACTION
+                    victims = []
+                    for key, size in db.execute('SELECT key, size FROM entries ORDER BY accessed_at'):
+                        if excess <= 0:
+                            break
+                        victims.append((key,))
+                        excess -= size
+                    db.executemany('DELETE FROM entries WHERE key = ?', victims)
+                    metrics.inc('iptv_shared_cache_evictions_total', amount=len(victims))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logging.info(f"Shared cache eviction failed: {e}")
+
+
+shared_cache = SharedCache()
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import time
+from src.services.catalog_cache import catalog_cache
+from src.services.change_log import CatalogChangeLog
+from src.services.sync_events import sync_events
+from src.services.ttl_cache import TTLCache
+
+CONTENT_TYPES = ('live', 'vod', 'series')
+# Catalog tables of each content type, deleted from a connection once it shares another's.
+CATALOG_TABLES = {
+    'live': ('live_categories', 'live_streams'),
+    'vod': ('vod_categories', 'vod_streams'),
+    'series': ('series_categories', 'series'),
+}
+# Per-connection tables derived from the catalog, dropped along with it.
+DERIVED_TABLES = ('catalog_changes', 'sync_category_state', 'series_seasons', 'series_episodes',
+                  'series_crawl_state', 'category_trees')
+OWNER_TTL_SECONDS = 60
+# A follower's sync reuses the owner's catalog when the owner synced this recently.
+FRESH_SYNC_SECONDS = 15 * 60
+
+
+def fingerprint(rows):
+    """Content hash of mapped catalog rows, independent of the connection and of row order."""
+    digests = sorted(
+        hashlib.sha1(json.dumps({k: v for k, v in row.items() if k != 'connection_id'},
+                                sort_keys=True, default=str).encode()).digest()
+        for row in rows
+    )
+    return hashlib.sha1(b''.join(digests)).hexdigest()
+
+
+def _normalize_url(url):
+    return (url or '').strip().rstrip('/').lower()
+
+
+def _fingerprints(row):
+    value = (row or {}).get('catalog_fingerprint') or {}
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            value = {}
+    return value if isinstance(value, dict) else {}
+
+
+def _content(fingerprints):
+    """The part of the fingerprints that identifies the catalog (no sync timestamps)."""
+    return {content_type: (entry.get('categories'), entry.get('items'))
+            for content_type, entry in fingerprints.items() if content_type in CONTENT_TYPES}
+
+
+class SharedCatalogs:
+    """
+    Content-addressed sharing of catalog rows between connections.
+
+    Users often add the same provider account (or reseller panel) several
+    times. After its own sync, every connection records a fingerprint per
+    content type; connections on the same server_url with identical
+    fingerprints for all content types are linked to the lowest id among
+    them (the owner) through xtream_connections.catalog_owner_id, and their
+    own catalog rows are dropped. Catalog reads, the change log and the
+    catalog cache then resolve to the owner, while stream URLs keep being
+    built from each connection's own credentials.
+
+    A follower's sync only fetches its own categories: if they still match
+    the owner's, the owner is synced (or reused when fresh), otherwise the
+    follower is unlinked and gets its own catalog again.
+    """
+
+    def __init__(self, ttl=OWNER_TTL_SECONDS):
+        self._owners = TTLCache(maxsize=4096, ttl=ttl, shared='catalog_owners')
+
+    def owner_of(self, supabase, connection_id):
+        """The connection whose catalog this one shares, or None."""
+        owner_id = self._owners.get(connection_id)
+        if owner_id is None:
+            response = supabase.from_('xtream_connections').select('catalog_owner_id') \
+                .eq('id', connection_id).execute()
+            owner_id = (response.data[0].get('catalog_owner_id') if response.data else None) or 0
+            self._owners.set(connection_id, owner_id)
+        return owner_id or None
+
+    def catalog_id(self, supabase, connection_id):
+        """The connection id the catalog rows are stored under."""
+        return self.owner_of(supabase, connection_id) or connection_id
+
+    def fingerprints(self, supabase, connection_id):
+        response = supabase.from_('xtream_connections').select('catalog_fingerprint') \
+            .eq('id', connection_id).execute()
+        return _fingerprints(response.data[0] if response.data else None)
+
+    def record(self, supabase, connection_id, content_type, categories, items):
+        """
+        Stores the fingerprints of a connection's own sync and links it with
+        the connections that have the same catalog. Returns the owner id the
+        connection now shares, or None.
+        """
+        fingerprints = self.fingerprints(supabase, connection_id)
+        fingerprints[content_type] = {'categories': categories, 'items': items, 'synced_at': int(time.time())}
+        supabase.from_('xtream_connections').update({'catalog_fingerprint': fingerprints}) \
+            .eq('id', connection_id).execute()
+        if all(content_type in fingerprints for content_type in CONTENT_TYPES):
+            return self._link_duplicates(supabase, connection_id, fingerprints)
+        return None
+
+    def _link_duplicates(self, supabase, connection_id, fingerprints):
+        response = supabase.from_('xtream_connections') \
+            .select('id, server_url, catalog_owner_id, catalog_fingerprint').execute()
+        rows = {row['id']: row for row in response.data or []}
+        me = rows.get(connection_id)
+        if me is None:
+            return None
+        group = sorted(
+            row['id'] for row in rows.values()
+            if not row.get('catalog_owner_id')
+            and _normalize_url(row.get('server_url')) == _normalize_url(me.get('server_url'))
+            and _content(_fingerprints(row)) == _content(fingerprints)
+        )
+        if len(group) < 2:
+            return None
+        owner_id = group[0]
+        for follower_id in group[1:]:
+            self._link(supabase, follower_id, owner_id)
+        return owner_id if owner_id != connection_id else None
+
+    def _link(self, supabase, follower_id, owner_id):
+        change_log = CatalogChangeLog(supabase)
+        follower_version = change_log.get_version(follower_id)['version']
+        owner_state = change_log.get_version(owner_id)
+        if follower_version > owner_state['version']:
+            # Replicas of the follower continue from the owner's log; the
+            # owner's version must not be behind what they already hold.
+            supabase.from_('catalog_versions').upsert({
+                'connection_id': owner_id,
+                'version': follower_version,
+                'compacted_through': owner_state['compacted_through'],
+            }, on_conflict='connection_id').execute()
+
+        supabase.from_('xtream_connections').update({'catalog_owner_id': owner_id}) \
+            .eq('id', follower_id).execute()
+        # Connections that shared the follower's catalog move along with it.
+        supabase.from_('xtream_connections').update({'catalog_owner_id': owner_id}) \
+            .eq('catalog_owner_id', follower_id).execute()
+        for tables in CATALOG_TABLES.values():
+            for table in tables:
+                supabase.from_(table).delete().eq('connection_id', follower_id).execute()
+        for table in DERIVED_TABLES:
+            supabase.from_(table).delete().eq('connection_id', follower_id).execute()
+
+        self._owners.clear()
+        catalog_cache.invalidate(follower_id)
+        # The follower's clients reload from the owner's catalog and follow its events.
+        sync_events.publish(follower_id, 'catalog', {
+            'version': max(follower_version, owner_state['version']),
+            'catalog_id': owner_id,
+            'reset': True,
+        })
+        logging.info(f"Connection {follower_id} now shares the catalog of connection {owner_id}.")
+
+    def unlink(self, supabase, connection_id):
+        """Gives a follower its own (initially empty) catalog again."""
+        owner_id = self.owner_of(supabase, connection_id)
+        if owner_id is None:
+            return
+        change_log = CatalogChangeLog(supabase)
+        version = max(change_log.get_version(connection_id)['version'], change_log.get_version(owner_id)['version'])
+        # The follower's replicas hold the owner's catalog: everything up to
+        # and including the next version must be a reset, not a delta.
+        supabase.from_('catalog_versions').upsert({
+            'connection_id': connection_id,
+            'version': version,
+            'compacted_through': version + 1,
+        }, on_conflict='connection_id').execute()
+        supabase.from_('xtream_connections').update({'catalog_owner_id': None, 'catalog_fingerprint': {}}) \
+            .eq('id', connection_id).execute()
+        self._owners.invalidate(connection_id)
+        sync_events.publish(connection_id, 'catalog', {'version': version, 'catalog_id': connection_id, 'reset': True})
+        logging.info(f"Connection {connection_id} no longer shares the catalog of connection {owner_id}.")
+
+
+shared_catalogs = SharedCatalogs()
@@ -0,0 +1,522 @@
+import json
+import operator
+import os
+import threading
+from datetime import datetime
+
+# 'supabase' (default) or 'sql': the local backend on the SQLAlchemy models,
+# for SQLite or PostgreSQL at DATABASE_URL.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'supabase')
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///iptv.db')
+
+COMPARISONS = {
+    'eq': operator.eq, 'neq': operator.ne, 'gt': operator.gt,
+    'gte': operator.ge, 'lt': operator.lt, 'lte': operator.le,
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the process-wide storage client. Both backends expose the same
+    query-builder surface (from_(table).select(...).eq(...).execute()), so
+    services are written once against the Supabase API.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if STORAGE_BACKEND == 'sql':
+                    _client = SQLClient(DATABASE_URL)
+                else:
+                    from supabase import create_client
+                    _client = create_client(os.environ.get('SUPABASE_URL'), os.environ.get('SUPABASE_KEY'))
+    return _client
+
+
+class StorageError(Exception):
+    pass
+
+
+class StorageResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class _TableMapping:
+    """
+    How one Supabase table maps onto a model table: a fixed discriminator
+    (e.g. stream_type='live' on channels), renamed columns, and columns the
+    model lacks, which are kept as JSON in extra_info.
+    """
+
+    def __init__(self, model, fixed=None, renames=None, json_columns=(), expose_fixed=False):
+        self.table = model.__table__
+        self.fixed = fixed or {}
+        self.renames = renames or {}
+        self.reverse_renames = {physical: logical for logical, physical in self.renames.items()}
+        self.json_columns = set(json_columns)
+        self.expose_fixed = expose_fixed
+        self.extra = self.table.c.get('extra_info')
+
+    def column(self, name):
+        column = self.table.c.get(self.renames.get(name, name))
+        if column is None:
+            raise StorageError(f"Column '{name}' cannot be filtered or sorted on in {self.table.name}")
+        return column
+
+    def value(self, column, value):
+        """Converts a PostgREST-style value to the column's Python type."""
+        if value is None:
+            return None
+        python_type = _python_type(column)
+        if python_type is datetime and isinstance(value, str):
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+        if python_type is bool and isinstance(value, str):
+            return value.lower() == 'true'
+        if python_type in (int, float) and isinstance(value, str):
+            return python_type(value) if value.strip() else None
+        if python_type is str and not isinstance(value, str):
+            return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+        return value
+
+    def to_physical(self, row):
+        physical = dict(self.fixed)
+        extras = {}
+        for name, value in row.items():
+            column = self.table.c.get(self.renames.get(name, name))
+            if column is not None:
+                if column.name not in self.fixed:
+                    physical[column.name] = self.value(column, value)
+            elif self.extra is not None:
+                extras[name] = value
+            else:
+                raise StorageError(f"Unknown column '{name}' in {self.table.name}")
+        if extras:
+            physical['extra_info'] = json.dumps(extras)
+        return physical
+
+    def to_logical(self, row, columns=None):
+        logical = {}
+        for name, value in row.items():
+            if name == 'extra_info' and self.extra is not None:
+                if value:
+                    logical.update(json.loads(value))
+                continue
+            if name in self.fixed and not self.expose_fixed:
+                continue
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif name in self.json_columns and isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except json.JSONDecodeError:
+                    pass
+            logical[self.reverse_renames.get(name, name)] = value
+        if columns is not None:
+            logical = {name: logical.get(name) for name in columns}
+        return logical
+
+
+def _python_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def _split_top_level(text):
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    if ''.join(current).strip():
+        parts.append(''.join(current).strip())
+    return parts
+
+
+class _Query:
+    """One PostgREST-style request against a mapped table, built by chaining."""
+
+    def __init__(self, client, mapping):
+        self.client = client
+        self.mapping = mapping
+        self._action = 'select'
+        self._columns = None
+        self._count = None
+        self._conditions = []
+        self._order = []
+        self._limit = None
+        self._offset = None
+        self._single = False
+        self._payload = None
+        self._on_conflict = None
+        self._ignore_duplicates = False
+
+    # --- Actions ---
+    def select(self, columns='*', count=None):
+        columns = [column.strip().strip('"') for column in columns.split(',')]
+        self._columns = None if '*' in columns else columns
+        self._count = count
+        return self
+
+    def insert(self, rows):
+        self._action, self._payload = 'insert', rows
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self._action, self._payload = 'upsert', rows
+        self._on_conflict = on_conflict
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, data):
+        self._action, self._payload = 'update', data
+        return self
+
+    def delete(self):
+        self._action = 'delete'
+        return self
+
+    # --- Filters ---
+    def _filter(self, name, op, value):
+        column = self.mapping.column(name)
+        self._conditions.append(self._condition(column, op, value))
+        return self
+
+    def _condition(self, column, op, value):
+        if op == 'in':
+            return column.in_([self.mapping.value(column, item) for item in value])
+        if op == 'is':
+            return column.is_(None if value in (None, 'null') else self.mapping.value(column, value))
+        if op in ('like', 'ilike'):
+            pattern = str(value).replace('*', '%')
+            return column.ilike(pattern) if op == 'ilike' else column.like(pattern)
+        return COMPARISONS[op](column, self.mapping.value(column, value))
+
+    def eq(self, column, value):
+        return self._filter(column, 'eq', value)
+
+    def neq(self, column, value):
+        return self._filter(column, 'neq', value)
+
+    def gt(self, column, value):
+        return self._filter(column, 'gt', value)
+
+    def gte(self, column, value):
+        return self._filter(column, 'gte', value)
+
+    def lt(self, column, value):
+        return self._filter(column, 'lt', value)
+
+    def lte(self, column, value):
+        return self._filter(column, 'lte', value)
+
+    def in_(self, column, values):
+        return self._filter(column, 'in', list(values))
+
+    def is_(self, column, value):
+        return self._filter(column, 'is', value)
+
+    def like(self, column, pattern):
+        return self._filter(column, 'like', pattern)
+
+    def ilike(self, column, pattern):
+        return self._filter(column, 'ilike', pattern)
+
+    def or_(self, filters):
+        """PostgREST or syntax, e.g. 'alive.is.null,alive.is.true' or 'a.gt.1,and(a.eq.1,b.gt.2)'."""
+        from sqlalchemy import or_
+
+        self._conditions.append(or_(*[self._or_part(part) for part in _split_top_level(filters)]))
+        return self
+
+    def _or_part(self, part):
+        from sqlalchemy import and_
+
+        if part.startswith('and(') and part.endswith(')'):
+            return and_(*[self._or_part(inner) for inner in _split_top_level(part[4:-1])])
+        name, op, value = part.split('.', 2)
+        if op == 'in':
+            value = [item.strip().strip('"') for item in value.strip('()').split(',')]
+        return self._condition(self.mapping.column(name), op, value)
+
+    # --- Modifiers ---
+    def order(self, column, desc=False, nullsfirst=None):
+        expression = self.mapping.column(column)
+        expression = expression.desc() if desc else expression.asc()
+        # PostgreSQL defaults (nulls last ascending, first descending) on every dialect
+        if nullsfirst is None:
+            nullsfirst = desc
+        self._order.append(expression.nulls_first() if nullsfirst else expression.nulls_last())
+        return self
+
+    def limit(self, size):
+        self._limit = size
+        return self
+
+    def range(self, start, end):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def execute(self):
+        return getattr(self.client, f'_{self._action}')(self)
+
+    def where(self, statement):
+        for name, value in self.mapping.fixed.items():
+            statement = statement.where(self.mapping.table.c[name] == value)
+        for condition in self._conditions:
+            statement = statement.where(condition)
+        return statement
+
+
+class SQLClient:
+    """
+    Local storage on the SQLAlchemy models (SQLite or PostgreSQL).
+
+    Implements the part of the supabase-py query builder the services use,
+    translating each request into one SQL statement. Catalog tables share
+    the channels/categories model tables, told apart by stream_type, and
+    upserts become INSERT ... ON CONFLICT DO UPDATE over whole batches.
+    """
+
+    def __init__(self, url):
+        from sqlalchemy import create_engine, event
+        from src.models.user import User, db
+        from src.models.xtream import (CatalogChange, CatalogVersion, Category, CategoryTree, Channel,
+                                       SeriesCrawlState, SeriesEpisode, SeriesSeason, SyncCategoryState,
+                                       UserPreferences, XtreamConnection)
+
+        options = {}
+        if url.startswith('sqlite'):
+            options['connect_args'] = {'check_same_thread': False}
+        self.engine = create_engine(url, **options)
+        if self.engine.dialect.name == 'sqlite':
+            @event.listens_for(self.engine, 'connect')
+            def _sqlite_pragmas(connection, _):
+                cursor = connection.cursor()
+                # WAL lets readers proceed while a sync writes.
+                cursor.execute('PRAGMA journal_mode=WAL')
+                cursor.execute('PRAGMA synchronous=NORMAL')
+                cursor.close()
+        db.metadata.create_all(self.engine)
+        self._upgrade(db.metadata)
+
+        self.mappings = {
+            'xtream_connections': _TableMapping(XtreamConnection, json_columns=('server_info', 'user_info', 'catalog_fingerprint')),
+            'user': _TableMapping(User),
+            'user_preferences': _TableMapping(UserPreferences),
+            'catalog_versions': _TableMapping(CatalogVersion),
+            'catalog_changes': _TableMapping(CatalogChange),
+            'sync_category_state': _TableMapping(SyncCategoryState),
+            'series_seasons': _TableMapping(SeriesSeason),
+            'series_episodes': _TableMapping(SeriesEpisode, json_columns=('info',)),
+            'series_crawl_state': _TableMapping(SeriesCrawlState),
+            'category_trees': _TableMapping(CategoryTree, json_columns=('tree',)),
+            'live_categories': _TableMapping(Category, fixed={'stream_type': 'live'}),
+            'vod_categories': _TableMapping(Category, fixed={'stream_type': 'movie'}),
+            'series_categories': _TableMapping(Category, fixed={'stream_type': 'series'}),
+            'live_streams': _TableMapping(Channel, fixed={'stream_type': 'live'}),
+            'vod_streams': _TableMapping(Channel, fixed={'stream_type': 'movie'}, expose_fixed=True),
+            'series': _TableMapping(Channel, fixed={'stream_type': 'series'}, renames={'series_id': 'stream_id'}),
+        }
+
+    def _upgrade(self, metadata):
+        """
+        Brings tables created by older versions of the models in line with
+        them; create_all() only creates missing tables. Missing columns,
+        unique keys (the upserts' ON CONFLICT targets) and indexes are added,
+        NOT NULL is dropped where the model no longer has it, and columns that
+        became integers (channels.stream_id was a VARCHAR) are converted.
+        SQLite cannot alter columns, so there the outdated table is rebuilt
+        and its rows copied over.
+        """
+        from sqlalchemy import Integer, inspect, text
+
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        quote = self.engine.dialect.identifier_preparer.quote
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column['name']: column for column in inspector.get_columns(table.name)}
+            indexes = inspector.get_indexes(table.name)
+            unique_keys = {tuple(sorted(key['column_names'])) for key in inspector.get_unique_constraints(table.name)}
+            unique_keys |= {tuple(sorted(index['column_names'])) for index in indexes if index.get('unique')}
+            index_names = {index['name'] for index in indexes}
+
+            missing = [column for column in table.columns if column.name not in columns]
+            retyped = [column for column in table.columns if column.name in columns
+                       and isinstance(column.type, Integer) != isinstance(columns[column.name]['type'], Integer)]
+            nullable = [column for column in table.columns if column.name in columns and column.nullable
+                        and not column.primary_key and not columns[column.name]['nullable']]
+            missing_keys = [constraint for constraint in table.constraints
+                            if type(constraint).__name__ == 'UniqueConstraint'
+                            and tuple(sorted(column.name for column in constraint.columns)) not in unique_keys]
+            if not (missing or retyped or nullable or missing_keys
+                    or any(index.name not in index_names for index in table.indexes)):
+                continue
+
+            with self.engine.begin() as connection:
+                if self.engine.dialect.name == 'sqlite' and (missing or retyped or nullable or missing_keys):
+                    self._rebuild_sqlite_table(connection, table, [name for name in columns if name in table.c])
+                    continue
+                for column in missing:
+                    connection.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} '
+                                            f'{column.type.compile(dialect=self.engine.dialect)}'))
+                for column in retyped:
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {quote(table.name)} ALTER COLUMN {quote(column.name)} '
+                                            f'TYPE {column_type} USING {quote(column.name)}::{column_type}'))
+                for column in nullable:
+                    connection.execute(text(f'ALTER TABLE {quote(table.name)} ALTER COLUMN {quote(column.name)} '
+                                            f'DROP NOT NULL'))
+                for constraint in missing_keys:
+                    names = [column.name for column in constraint.columns]
+                    name = constraint.name or f"uq_{table.name}_{'_'.join(names)}"
+                    connection.execute(text(f'CREATE UNIQUE INDEX {quote(name)} ON {quote(table.name)} '
+                                            f"({', '.join(quote(column) for column in names)})"))
+                for index in table.indexes:
+                    if index.name not in index_names:
+                        index.create(connection)
+
+    @staticmethod
+    def _rebuild_sqlite_table(connection, table, kept_columns):
+        """The SQLite table-rebuild procedure: new table, rows copied (values take the new column types), swap."""
+        from sqlalchemy import MetaData, text
+
+        # The copy's foreign keys resolve against copies of the other tables.
+        scratch = MetaData()
+        for other in table.metadata.sorted_tables:
+            if other is not table:
+                other.to_metadata(scratch)
+        staging = table.to_metadata(scratch, name=f'{table.name}__upgrade')
+        staging.indexes.clear()
+        staging.create(connection)
+        columns = ', '.join(f'"{name}"' for name in kept_columns)
+        connection.execute(text(f'INSERT INTO "{staging.name}" ({columns}) SELECT {columns} FROM "{table.name}"'))
+        connection.execute(text(f'DROP TABLE "{table.name}"'))
+        connection.execute(text(f'ALTER TABLE "{staging.name}" RENAME TO "{table.name}"'))
+        for index in table.indexes:
+            index.create(connection)
+
+    def from_(self, table):
+        mapping = self.mappings.get(table)
+        if mapping is None:
+            raise StorageError(f"Table '{table}' is not available in local storage")
+        return _Query(self, mapping)
+
+    table = from_
+
+    def _select(self, query):
+        from sqlalchemy import func, select
+
+        mapping = query.mapping
+        statement = query.where(select(mapping.table))
+        for expression in query._order:
+            statement = statement.order_by(expression)
+        if query._limit is not None:
+            statement = statement.limit(query._limit)
+        if query._offset:
+            statement = statement.offset(query._offset)
+        with self.engine.connect() as connection:
+            rows = [mapping.to_logical(row, query._columns) for row in connection.execute(statement).mappings()]
+            count = None
+            if query._count:
+                count = connection.execute(query.where(select(func.count()).select_from(mapping.table))).scalar()
+        if query._single:
+            if len(rows) != 1:
+                raise StorageError(f'JSON object requested, multiple (or no) rows returned ({len(rows)})')
+            return StorageResponse(rows[0], count)
+        return StorageResponse(rows, count)
+
+    def _rows(self, query):
+        payload = query._payload if isinstance(query._payload, list) else [query._payload]
+        rows = [query.mapping.to_physical(row) for row in payload]
+        # One executemany needs the same keys in every row.
+        keys = set().union(*rows) if rows else set()
+        if any('id' not in row for row in rows):
+            keys.discard('id')
+        return [{key: row.get(key) for key in keys} for row in rows], keys
+
+    def _insert(self, query):
+        from sqlalchemy.exc import IntegrityError
+
+        rows, _ = self._rows(query)
+        if not rows:
+            return StorageResponse([])
+        table = query.mapping.table
+        try:
+            with self.engine.begin() as connection:
+                result = connection.execute(table.insert().returning(*table.c), rows)
+                return StorageResponse([query.mapping.to_logical(row) for row in result.mappings()])
+        except IntegrityError as e:
+            raise StorageError(str(e.orig)) from e
+
+    def _upsert(self, query):
+        rows, keys = self._rows(query)
+        if not rows:
+            return StorageResponse([])
+        mapping = query.mapping
+        table = mapping.table
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif self.engine.dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise StorageError(f'Upsert is not supported on {self.engine.dialect.name}')
+
+        conflict = [mapping.column(name).name for name in (query._on_conflict or 'id').split(',')]
+        conflict = list(mapping.fixed) + [name for name in conflict if name not in mapping.fixed]
+        statement = insert(table)
+        updates = {name: statement.excluded[name] for name in keys if name not in conflict and name != 'id'}
+        if 'extra_info' in updates:
+            # Partial rows only carry some of the extra fields: the others are kept.
+            updates['extra_info'] = self._merged_extra(table.c.extra_info, statement.excluded.extra_info)
+        if query._ignore_duplicates or not updates:
+            statement = statement.on_conflict_do_nothing(index_elements=conflict)
+        else:
+            statement = statement.on_conflict_do_update(index_elements=conflict, set_=updates)
+        with self.engine.begin() as connection:
+            connection.execute(statement, rows)
+        return StorageResponse([mapping.to_logical(row) for row in rows])
+
+    def _update(self, query):
+        mapping = query.mapping
+        values = mapping.to_physical(query._payload)
+        if 'extra_info' in values:
+            values['extra_info'] = self._merged_extra(mapping.table.c.extra_info, values['extra_info'])
+        with self.engine.begin() as connection:
+            result = connection.execute(query.where(mapping.table.update().values(**values))
+                                        .returning(*mapping.table.c))
+            return StorageResponse([mapping.to_logical(row) for row in result.mappings()])
+
+    def _merged_extra(self, current, patch):
+        """SQL for the extra_info JSON with the keys of `patch` set on `current`; other keys are kept."""
+        from sqlalchemy import Text, cast, func
+
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import JSONB
+            return cast(cast(func.coalesce(current, '{}'), JSONB).op('||')(cast(func.coalesce(patch, '{}'), JSONB)),
+                        Text)
+        return func.json_patch(func.coalesce(current, '{}'), func.coalesce(patch, '{}'))
+
+    def _delete(self, query):
+        table = query.mapping.table
+        with self.engine.begin() as connection:
+            result = connection.execute(query.where(table.delete()).returning(*table.c))
+            return StorageResponse([query.mapping.to_logical(row) for row in result.mappings()])
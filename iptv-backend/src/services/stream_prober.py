@@ -0,0 +1,206 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from src.services import upstream
+from src.services.circuit_breaker import OPEN, circuit_breakers
+
+PROBE_BATCH_SIZE = 200
+PROBE_INTERVAL_SECONDS = 120
+PROBE_TIMEOUT_SECONDS = 5
+# Enough for a playlist head or the first TS packets, never a whole segment.
+PROBE_MAX_BYTES = 16 * 1024
+PROBE_BYTES_PER_SECOND = 512 * 1024
+MAX_PROBE_CONCURRENCY = 8
+WRITE_CHUNK_SIZE = 500
+# Answers about the account, not the channel (connection limit, blocked, rate
+# limited): the channel's health is unknown, not dead.
+ACCOUNT_LIMIT_STATUSES = (401, 403, 429, 456, 458, 509)
+ACCOUNT_LIMIT_MARKERS = (b'max connection', b'maximum connection', b'connection limit')
+
+
+def _user_info(row):
+    info = (row or {}).get('user_info') or {}
+    if isinstance(info, str):
+        try:
+            info = json.loads(info)
+        except json.JSONDecodeError:
+            info = {}
+    return info if isinstance(info, dict) else {}
+
+
+def free_connections(service, connection_id):
+    """
+    Connections a background task (probing, warm-ups) may use: the account's
+    max_connections minus those in use right now (active_cons from a fresh
+    authentication call) minus one kept free for a viewer. 0 when that
+    cannot be known.
+    """
+    response = service._make_xtream_request(connection_id, None)
+    if not response.get('success') or response.get('stale'):
+        return 0
+    info = _user_info(response.get('data'))
+    try:
+        max_connections = int(info.get('max_connections') or 1)
+        active = int(info.get('active_cons') or 0)
+    except (TypeError, ValueError):
+        return 0
+    return max_connections - active - 1
+
+
+class _ByteBudget:
+    """Token bucket shared by every probe so probing never exceeds PROBE_BYTES_PER_SECOND."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class StreamProber:
+    """
+    Background liveness checks for live channels.
+
+    Each run takes the PROBE_BATCH_SIZE channels of a connection that were
+    probed longest ago (never-probed first), fetches the head of each stream
+    in parallel and writes alive / probe_latency_ms / probed_at back to
+    live_streams, where /streams can filter and sort on them. Concurrency
+    stays below the account's free connections (max_connections minus the
+    provider's current active_cons, minus one kept for a viewer), so
+    single-connection accounts and accounts in use are not probed at all,
+    and all probes share one bandwidth budget. A connection-limit answer
+    records the channel as unknown (alive NULL) and stops the batch.
+    """
+
+    def __init__(self):
+        self._budget = _ByteBudget(PROBE_BYTES_PER_SECOND)
+        self._scheduled = set()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._service = None
+
+    def schedule(self, service, connection_id):
+        """Registers the connection for incremental probing and starts a batch now."""
+        with self._lock:
+            self._scheduled.add(connection_id)
+            self._service = service
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._schedule_loop, name='stream-prober', daemon=True)
+                self._scheduler.start()
+        threading.Thread(target=self.probe_batch, args=(service, connection_id), daemon=True).start()
+
+    def _schedule_loop(self):
+        while True:
+            time.sleep(PROBE_INTERVAL_SECONDS)
+            with self._lock:
+                connection_ids = list(self._scheduled)
+                service = self._service
+            for connection_id in connection_ids:
+                self.probe_batch(service, connection_id)
+
+    def probe_batch(self, service, connection_id):
+        with self._lock:
+            if connection_id in self._running:
+                return {'success': False, 'error': 'Probe already running for this connection.'}
+            self._running.add(connection_id)
+        try:
+            return self._probe_batch(service, connection_id)
+        except Exception as e:
+            logging.error(f"Stream probe failed for connection {connection_id}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+        finally:
+            with self._lock:
+                self._running.discard(connection_id)
+
+    def _probe_batch(self, service, connection_id):
+        supabase = service.supabase
+        concurrency = free_connections(service, connection_id)
+        if concurrency <= 0:
+            logging.info(f"Skipping stream probe for connection {connection_id}: no free connection on the account.")
+            return {'success': True, 'probed': 0, 'skipped': 'no free connection'}
+        concurrency = min(MAX_PROBE_CONCURRENCY, concurrency)
+
+        # Probed with this connection's credentials, stored on the (possibly shared) catalog.
+        catalog_id = service.catalog_id(connection_id)
+        response = supabase.from_('live_streams').select('stream_id').eq('connection_id', catalog_id) \
+            .order('probed_at', nullsfirst=True).limit(PROBE_BATCH_SIZE).execute()
+        stream_ids = [row['stream_id'] for row in response.data or []]
+        if not stream_ids:
+            return {'success': True, 'probed': 0}
+
+        urls = service.get_stream_urls(connection_id, stream_ids, 'live', 'm3u8')
+        if not urls.get('success'):
+            return urls
+
+        limited = threading.Event()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='stream-probe') as pool:
+            results = list(pool.map(lambda item: self._probe(item[0], item[1], limited), urls['urls'].items()))
+        results = [result for result in results if result is not None]
+
+        # Updates, not upserts: a channel a concurrent sync just deleted must not come back as
+        # a row with only probe columns. Dead and unknown channels share their values, so
+        # they go out in one update per group; live ones differ in latency and go one by one.
+        probed_at = datetime.now(timezone.utc).isoformat()
+        groups = {}
+        for stream_id, alive, latency_ms in results:
+            groups.setdefault((alive, latency_ms), []).append(int(stream_id))
+        for (alive, latency_ms), ids in groups.items():
+            values = {'alive': alive, 'probe_latency_ms': latency_ms, 'probed_at': probed_at}
+            for i in range(0, len(ids), WRITE_CHUNK_SIZE):
+                supabase.from_('live_streams').update(values).eq('connection_id', catalog_id) \
+                    .in_('stream_id', ids[i:i + WRITE_CHUNK_SIZE]).execute()
+
+        alive_count = sum(1 for _, alive, _ in results if alive)
+        logging.info(f"Probed {len(results)} live streams for connection {connection_id}: {alive_count} alive"
+                     f"{' (stopped at the connection limit)' if limited.is_set() else ''}.")
+        return {'success': True, 'probed': len(results), 'alive': alive_count}
+
+    def _probe(self, stream_id, url, limited):
+        """
+        Returns (stream_id, alive, latency_ms), with alive None when the
+        provider refused the account rather than the channel; None when the
+        host's circuit is open or the batch already hit the connection limit.
+        """
+        if limited.is_set() or circuit_breakers.for_url(url).state == OPEN:
+            return None
+        started = time.monotonic()
+        try:
+            with upstream.session.get(url, stream=True, timeout=PROBE_TIMEOUT_SECONDS,
+                                      headers=upstream.proxy_headers(url), verify=False) as response:
+                if response.status_code in ACCOUNT_LIMIT_STATUSES:
+                    limited.set()
+                    return stream_id, None, None
+                if response.status_code >= 400:
+                    return stream_id, False, None
+                self._budget.consume(PROBE_MAX_BYTES)
+                head = next(response.iter_content(chunk_size=PROBE_MAX_BYTES), b'')
+                latency_ms = int((time.monotonic() - started) * 1000)
+                content_type = response.headers.get('content-type', '').lower()
+                if any(marker in head[:512].lower() for marker in ACCOUNT_LIMIT_MARKERS):
+                    limited.set()
+                    return stream_id, None, None
+                if 'mpegurl' in content_type:
+                    return stream_id, head.lstrip().startswith(b'#EXTM3U'), latency_ms
+                return stream_id, len(head) > 0, latency_ms
+        except Exception as e:
+            logging.info(f"Probe failed for stream {stream_id}: {e}")
+            return stream_id, False, None
+
+
+stream_prober = StreamProber()
@@ -0,0 +1,545 @@
+import json
+import logging
+import time
+from src.services.catalog_cache import catalog_cache
+from src.services.category_tree import CategoryTrees
+from src.services.change_log import CatalogChangeLog, ENTITY_KEYS
+from src.services.metrics import DURATION_BUCKETS, metrics
+from src.services.shared_catalog import FRESH_SYNC_SECONDS, fingerprint, shared_catalogs
+from src.services.sync_events import sync_events
+from src.services.sync_planner import SyncPlanner
+
+CHUNK_SIZE = 500
+PAGE_SIZE = 1000
+# Minimum spacing of the per-category 'items' progress events of one sync.
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+
+def _join_list(value):
+    if isinstance(value, list):
+        return ', '.join(filter(None, value)) or None
+    return value
+
+
+def _epoch_seconds(value):
+    """Xtream timestamps are epoch seconds as text; anything else sorts as unknown."""
+    try:
+        seconds = int(float(value))
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds > 0 else None
+
+
+def _rating_value(rating, rating_5based=None):
+    """Rating on a 0-10 scale, from `rating` or twice `rating_5based`."""
+    for value, scale in ((rating, 1), (rating_5based, 2)):
+        try:
+            number = float(value) * scale
+        except (TypeError, ValueError):
+            continue
+        if 0 < number <= 10:
+            return round(number, 2)
+    return None
+
+
+def _release_year(*values):
+    """First plausible year in `year` / `release_date` ('2019', '2019-05-01', ...)."""
+    for value in values:
+        digits = str(value or '').strip()[:4]
+        if digits.isdigit() and 1870 <= int(digits) <= 2100:
+            return int(digits)
+    return None
+
+
+def _map_category(connection_id, item):
+    return {
+        'connection_id': connection_id,
+        'category_id': item.get('category_id'),
+        'category_name': item.get('category_name'),
+        'parent_id': item.get('parent_id'),
+    }
+
+
+def _map_live_stream(connection_id, s):
+    return {
+        'connection_id': connection_id,
+        'stream_id': s.get('stream_id'),
+        'name': s.get('name'),
+        'stream_icon': s.get('stream_icon'),
+        'category_id': s.get('category_id'),
+        'epg_channel_id': s.get('epg_channel_id'),
+        'added': s.get('added'),
+        'is_adult': s.get('is_adult', '0'),
+    }
+
+
+def _map_vod_stream(connection_id, s):
+    return {
+        'connection_id': connection_id,
+        'stream_id': s.get('stream_id'),
+        'name': s.get('name'),
+        'stream_icon': s.get('stream_icon'),
+        'category_id': s.get('category_id'),
+        'added': s.get('added'),
+        'container_extension': s.get('container_extension'),
+        'custom_sid': s.get('custom_sid'),
+        'direct_source': s.get('direct_source'),
+        'num': s.get('num'),
+        'rating': s.get('rating'),
+        'rating_5based': s.get('rating_5based'),
+        'stream_type': 'movie',
+        'year': s.get('year'),
+        'is_adult': s.get('is_adult'),
+        # Typed copies for the ?sort=added|rating|year rails
+        'added_at': _epoch_seconds(s.get('added')),
+        'rating_value': _rating_value(s.get('rating'), s.get('rating_5based')),
+        'release_year': _release_year(s.get('year')),
+    }
+
+
+def _map_series(connection_id, s):
+    return {
+        'connection_id': connection_id,
+        'series_id': s.get('series_id'),
+        'name': s.get('name'),
+        'cover': s.get('cover'),
+        'plot': s.get('plot'),
+        'cast': s.get('cast'),
+        'director': s.get('director'),
+        'genre': s.get('genre'),
+        'release_date': s.get('release_date') or s.get('releaseDate'),
+        'last_modified': s.get('last_modified'),
+        'rating': s.get('rating'),
+        'rating_5based': s.get('rating_5based'),
+        'backdrop_path': _join_list(s.get('backdrop_path')),
+        'youtube_trailer': s.get('youtube_trailer'),
+        'episode_run_time': s.get('episode_run_time'),
+        'category_id': s.get('category_id'),
+        'num': s.get('num'),
+        'title': s.get('title'),
+        'year': s.get('year'),
+        'stream_type': s.get('stream_type'),
+        'is_adult': s.get('is_adult'),
+        # Series carry no `added`; last_modified is when episodes were last added.
+        'added_at': _epoch_seconds(s.get('last_modified')),
+        'rating_value': _rating_value(s.get('rating'), s.get('rating_5based')),
+        'release_year': _release_year(s.get('year'), s.get('release_date') or s.get('releaseDate')),
+    }
+
+
+CONTENT_TYPES = {
+    'live': {
+        'category_table': 'live_categories',
+        'category_action': 'get_live_categories',
+        'item_table': 'live_streams',
+        'item_action': 'get_live_streams',
+        'item_mapper': _map_live_stream,
+    },
+    'vod': {
+        'category_table': 'vod_categories',
+        'category_action': 'get_vod_categories',
+        'item_table': 'vod_streams',
+        'item_action': 'get_vod_streams',
+        'item_mapper': _map_vod_stream,
+    },
+    'series': {
+        'category_table': 'series_categories',
+        'category_action': 'get_series_categories',
+        'item_table': 'series',
+        'item_action': 'get_series',
+        'item_mapper': _map_series,
+    },
+}
+
+
+def _as_list(data):
+    # Some panels answer with an object keyed by id instead of a list.
+    if isinstance(data, dict):
+        return list(data.values())
+    return data or []
+
+
+def _normalize(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (dict, list)):
+        # JSON columns come back with their keys in another order.
+        return json.dumps(value, sort_keys=True)
+    return str(value)
+
+
+def _fingerprint(row, columns):
+    return tuple(_normalize(row.get(column)) for column in columns)
+
+
+class SyncFetchError(Exception):
+    """An item listing could not be downloaded; what was written before is still recorded."""
+
+
+class CatalogSyncEngine:
+    """
+    Diffing sync from the Xtream API into the Supabase catalog tables.
+
+    Instead of deleting and re-inserting a connection's whole catalog, each
+    table is compared against what is stored: only new or modified rows are
+    upserted, only vanished rows are deleted, and every change is recorded in
+    the CatalogChangeLog so clients can pull a delta via /changes. Item
+    listings are downloaded per category, only for the categories the
+    SyncPlanner expects to have changed.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.supabase = service.supabase
+        self.change_log = CatalogChangeLog(service.supabase)
+
+    def sync(self, connection_id, content_type, full=False):
+        """
+        Syncs one content type. Unless `full` is set (or nothing was synced
+        before), the SyncPlanner decides which categories are downloaded.
+        Progress is published as 'sync' events for the connection.
+        """
+        self._progress(connection_id, content_type, 'started', full=full)
+        result = self._sync(connection_id, content_type, full)
+        if result.get('success'):
+            self._progress(connection_id, content_type, 'done', version=result.get('version'),
+                           changes=result.get('changes'), plan=result.get('plan'), shared_with=result.get('shared_with'))
+        else:
+            self._progress(connection_id, content_type, 'failed', error=result.get('error'))
+        return result
+
+    @staticmethod
+    def _progress(connection_id, content_type, phase, **data):
+        sync_events.publish(connection_id, 'sync', {'content_type': content_type, 'phase': phase, **data})
+
+    def _sync(self, connection_id, content_type, full):
+        spec = CONTENT_TYPES[content_type]
+        started = time.monotonic()
+        logging.info(f"Starting {content_type} sync for connection_id: {connection_id}")
+        changes = []
+        try:
+            categories_res = self.service._make_xtream_request(connection_id, spec['category_action'])
+            if not categories_res.get('success'):
+                return {'success': False, 'error': categories_res.get('error', 'Failed to fetch categories.')}
+            category_rows = [_map_category(connection_id, item) for item in _as_list(categories_res['data'])]
+            self._progress(connection_id, content_type, 'categories', total=len(category_rows))
+
+            owner_id = shared_catalogs.owner_of(self.supabase, connection_id)
+            if owner_id is not None:
+                shared = self._sync_shared(connection_id, owner_id, content_type, fingerprint(category_rows), full)
+                if shared is not None:
+                    return shared
+
+            changes += self.apply(connection_id, spec['category_table'], category_rows)
+            category_ids = list(dict.fromkeys(str(row['category_id']) for row in category_rows
+                                              if row.get('category_id') is not None))
+            planner = SyncPlanner(self.supabase)
+            state = planner.load(connection_id, content_type)
+            if full or not state:
+                item_count, state = self._sync_everything(connection_id, content_type, planner, state,
+                                                          category_ids, changes)
+                plan = {'full': True}
+            else:
+                item_count, plan = self._sync_planned(connection_id, content_type, planner, state,
+                                                      category_ids, changes)
+
+            version = self.change_log.record(connection_id, changes)
+            if changes:
+                catalog_cache.invalidate(connection_id)
+            CategoryTrees(self.supabase).save(connection_id, content_type, category_rows, state, version)
+            shared_catalogs.record(self.supabase, connection_id, content_type,
+                                   fingerprint(category_rows), planner.catalog_fingerprint(state))
+
+            elapsed = time.monotonic() - started
+            labels = {'content_type': content_type}
+            metrics.observe('iptv_sync_duration_seconds', elapsed, {**labels, 'outcome': 'ok'}, DURATION_BUCKETS)
+            metrics.inc('iptv_sync_rows_total', labels, len(category_rows) + item_count)
+            metrics.inc('iptv_sync_changes_total', labels, len(changes))
+            logging.info(f"{content_type} sync for connection {connection_id} completed in {elapsed:.1f}s: "
+                         f"{len(changes)} changes, version {version}, plan {plan}.")
+            return {
+                'success': True,
+                'message': f'{content_type} sync completed.',
+                'version': version,
+                'changes': len(changes),
+                'rows': len(category_rows) + item_count,
+                'plan': plan,
+            }
+        except Exception as e:
+            logging.error(f"Error during {content_type} sync for connection {connection_id}: {e}", exc_info=True)
+            metrics.observe('iptv_sync_duration_seconds', time.monotonic() - started,
+                            {'content_type': content_type, 'outcome': 'error'}, DURATION_BUCKETS)
+            if changes:
+                # Categories already written stay written; clients still get their delta.
+                try:
+                    self.change_log.record(connection_id, changes)
+                    catalog_cache.invalidate(connection_id)
+                except Exception as record_error:
+                    logging.error(f"Could not record partial {content_type} sync for connection "
+                                  f"{connection_id}: {record_error}")
+            return {'success': False, 'error': str(e)}
+
+    def _sync_everything(self, connection_id, content_type, planner, state, category_ids, changes):
+        """Downloads the whole listing in one request and re-baselines every category's state."""
+        spec = CONTENT_TYPES[content_type]
+        items_res = self.service._make_xtream_request(connection_id, spec['item_action'])
+        if not items_res.get('success'):
+            raise SyncFetchError(items_res.get('error', 'Failed to fetch streams.'))
+        item_rows = [spec['item_mapper'](connection_id, item) for item in _as_list(items_res['data'])]
+        self._progress(connection_id, content_type, 'items', done=0, total=1, rows=len(item_rows))
+        changes += self.apply(connection_id, spec['item_table'], item_rows)
+        self._progress(connection_id, content_type, 'items', done=1, total=1, rows=len(item_rows))
+
+        by_category = {}
+        for row in item_rows:
+            by_category.setdefault(str(row.get('category_id')), []).append(row)
+        # The listing's validators describe the whole listing, not a category.
+        fresh = {category_id: planner.new_state(connection_id, content_type, category_id,
+                                                by_category.get(category_id, []))
+                 for category_id in category_ids}
+        planner.save(connection_id, content_type, fresh.values(),
+                     removed=[category_id for category_id in state if category_id not in fresh])
+        return len(item_rows), fresh
+
+    def _sync_planned(self, connection_id, content_type, planner, state, category_ids, changes):
+        """Downloads only the categories the plan selects; `state` is updated in place."""
+        spec = CONTENT_TYPES[content_type]
+        plan = planner.plan(category_ids, state)
+        item_count = 0
+        updated = []
+        seen = set()
+        orphans = {}
+        reported_at = 0.0
+        try:
+            for done, (category_id, headers) in enumerate(plan.fetch.items()):
+                if time.monotonic() - reported_at >= PROGRESS_INTERVAL_SECONDS:
+                    reported_at = time.monotonic()
+                    self._progress(connection_id, content_type, 'items', done=done, total=len(plan.fetch))
+                items_res = self.service._make_xtream_request(connection_id, spec['item_action'],
+                                                              {'category_id': category_id}, headers=headers)
+                if not items_res.get('success'):
+                    raise SyncFetchError(items_res.get('error', f'Failed to fetch category {category_id}.'))
+                if items_res.get('stale'):
+                    # Served from the stale-response cache: proves nothing about the provider.
+                    continue
+                previous = state.get(category_id)
+                if items_res.get('not_modified'):
+                    current = planner.reverified(previous)
+                else:
+                    # Some panels ignore category_id and answer with everything.
+                    rows = [row for row in (spec['item_mapper'](connection_id, item)
+                                            for item in _as_list(items_res['data']))
+                            if str(row.get('category_id')) == category_id]
+                    item_count += len(rows)
+                    current = planner.new_state(connection_id, content_type, category_id, rows,
+                                                items_res.get('validators'))
+                    if previous is None or not planner.unchanged(previous, current):
+                        writer = self._diff(connection_id, spec['item_table'], rows,
+                                            scope={'category_id': category_id}, deletes=False)
+                        changes += writer.finish()
+                        seen.update(writer.seen)
+                        orphans.update(dict.fromkeys(writer.unseen, category_id))
+                state[category_id] = current
+                updated.append(current)
+        except SyncFetchError:
+            planner.save(connection_id, content_type, updated)
+            raise
+
+        for category_id in plan.removed:
+            writer = self._diff(connection_id, spec['item_table'], [], scope={'category_id': category_id},
+                                deletes=False)
+            orphans.update(dict.fromkeys(writer.unseen, category_id))
+        # A row that left a category may have moved to one this plan did not download.
+        orphans = {key: category_id for key, category_id in orphans.items() if key not in seen}
+        if orphans:
+            try:
+                changes += self._settle_orphans(connection_id, content_type, orphans)
+            except SyncFetchError:
+                # Those categories are downloaded again next time instead of being trusted as synced.
+                left = set(orphans.values())
+                planner.save(connection_id, content_type,
+                             [current for current in updated if current['category_id'] not in left])
+                raise
+        for category_id in plan.removed:
+            state.pop(category_id, None)
+        planner.save(connection_id, content_type, updated, removed=plan.removed)
+        return item_count, plan.summary()
+
+    def _settle_orphans(self, connection_id, content_type, orphans):
+        """
+        Resolves the rows that vanished from the downloaded categories
+        (`orphans`, item key -> category it left) against the whole listing:
+        the ones still listed are moved to their new category, only the
+        others are deleted. Returns the changes written.
+        """
+        spec = CONTENT_TYPES[content_type]
+        table = spec['item_table']
+        items_res = self.service._make_xtream_request(connection_id, spec['item_action'])
+        if not items_res.get('success') or items_res.get('stale'):
+            raise SyncFetchError(items_res.get('error', 'Failed to confirm removed streams.'))
+        key = ENTITY_KEYS[table]
+        moved = [row for row in (spec['item_mapper'](connection_id, item) for item in _as_list(items_res['data']))
+                 if _normalize(row.get(key)) in orphans]
+        writer = self._diff(connection_id, table, moved, keys=list(orphans), deletes=False)
+        changes = writer.finish()
+        return changes + writer.delete([item_key for item_key in orphans if item_key not in writer.seen])
+
+    def _sync_shared(self, connection_id, owner_id, content_type, categories_fingerprint, full=False):
+        """
+        Syncs a connection that shares `owner_id`'s catalog through the owner.
+        Returns None after unlinking it when its own categories no longer
+        match the shared catalog.
+        """
+        owned = shared_catalogs.fingerprints(self.supabase, owner_id).get(content_type) or {}
+        result = None
+        if time.time() - owned.get('synced_at', 0) >= FRESH_SYNC_SECONDS:
+            # The owner may just be behind the provider: refresh it before comparing.
+            result = self.sync(owner_id, content_type, full)
+            if not result.get('success'):
+                return dict(result, shared_with=owner_id)
+            owned = shared_catalogs.fingerprints(self.supabase, owner_id).get(content_type) or {}
+        if owned.get('categories') != categories_fingerprint:
+            shared_catalogs.unlink(self.supabase, connection_id)
+            return None
+        if result is None:
+            logging.info(f"{content_type} catalog of connection {connection_id} is shared with the fresh "
+                         f"catalog of connection {owner_id}; nothing to sync.")
+            result = {
+                'success': True,
+                'message': f'{content_type} sync completed.',
+                'version': self.change_log.get_version(owner_id)['version'],
+                'changes': 0,
+                'rows': 0,
+            }
+        return dict(result, shared_with=owner_id)
+
+    def apply(self, connection_id, table, rows, scope=None):
+        """
+        Brings `table` in line with `rows` for one connection (restricted to
+        the rows matching `scope`, e.g. one category) and returns the
+        (entity, item_key, op) changes that were written.
+        """
+        return self._diff(connection_id, table, rows, scope).finish()
+
+    def _diff(self, connection_id, table, rows, scope=None, keys=None, deletes=True):
+        columns = sorted({column for row in rows for column in row if column != 'connection_id'})
+        writer = BatchedDiffWriter(self.supabase, connection_id, table, columns, scope, keys=keys,
+                                   deletes=deletes)
+        for row in rows:
+            writer.add(row)
+        return writer
+
+
+class BatchedDiffWriter:
+    """
+    Streams rows into one catalog table for one connection.
+
+    Only a fingerprint hash per stored row is held in memory; incoming rows
+    are compared as they arrive and changed ones are upserted in CHUNK_SIZE
+    batches, so feeding a very large source costs memory proportional to the
+    number of keys, not to the row data. finish() deletes the stored rows
+    that were never seen (or, with deletes=False, leaves them in `unseen`)
+    and returns the changes for the change log. `keys` restricts the
+    comparison to those item keys.
+    """
+
+    def __init__(self, supabase, connection_id, table, columns, scope=None, key=None, keys=None,
+                 deletes=True):
+        self.supabase = supabase
+        self.connection_id = connection_id
+        self.table = table
+        self.scope = scope or {}
+        self.key = key or ENTITY_KEYS[table]
+        self.keys = None if keys is None else list(keys)
+        self.deletes = deletes
+        self.unseen = []
+        self.columns = list(columns)
+        if self.key not in self.columns:
+            self.columns.append(self.key)
+        self._existing = None
+        self._seen = set()
+        self._pending = []
+        self._changes = []
+
+    def _load_existing(self):
+        self._existing = {}
+        if self.keys is None:
+            self._load_pages()
+            return
+        for i in range(0, len(self.keys), CHUNK_SIZE):
+            self._load_pages(self.keys[i:i + CHUNK_SIZE])
+
+    def _load_pages(self, keys=None):
+        start = 0
+        select = ', '.join(self.columns)
+        while True:
+            query = self.supabase.from_(self.table).select(select).eq('connection_id', self.connection_id)
+            for column, value in self.scope.items():
+                query = query.eq(column, value)
+            if keys is not None:
+                query = query.in_(self.key, keys)
+            response = query.order('id').range(start, start + PAGE_SIZE - 1).execute()
+            batch = response.data or []
+            for row in batch:
+                self._existing[_normalize(row.get(self.key))] = hash(_fingerprint(row, self.columns))
+            if len(batch) < PAGE_SIZE:
+                return
+            start += PAGE_SIZE
+
+    def add(self, row):
+        if self._existing is None:
+            self._load_existing()
+        row_key = _normalize(row.get(self.key))
+        if row_key is None or row_key in self._seen:
+            return
+        self._seen.add(row_key)
+        if self._existing.pop(row_key, None) != hash(_fingerprint(row, self.columns)):
+            self._pending.append(row)
+            if len(self._pending) >= CHUNK_SIZE:
+                self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        self.supabase.from_(self.table).upsert(self._pending, on_conflict=f'connection_id,{self.key}').execute()
+        self._changes += [(self.table, _normalize(row.get(self.key)), 'upsert') for row in self._pending]
+        self._pending = []
+
+    @property
+    def changes(self):
+        """Changes written so far."""
+        return list(self._changes)
+
+    @property
+    def seen(self):
+        """Keys of the rows added so far."""
+        return set(self._seen)
+
+    def delete(self, keys):
+        """Deletes the stored rows with these keys (within the scope) and returns the changes."""
+        keys = list(keys)
+        for i in range(0, len(keys), CHUNK_SIZE):
+            query = self.supabase.from_(self.table).delete().eq('connection_id', self.connection_id)
+            for column, value in self.scope.items():
+                query = query.eq(column, value)
+            query.in_(self.key, keys[i:i + CHUNK_SIZE]).execute()
+        changes = [(self.table, item_key, 'delete') for item_key in keys]
+        self._changes += changes
+        if keys:
+            logging.info(f"Sync {self.connection_id}: {self.table} -{len(keys)}")
+        return changes
+
+    def finish(self):
+        if self._existing is None:
+            self._load_existing()
+        self.flush()
+        if self._changes:
+            logging.info(f"Sync {self.connection_id}: {self.table} +/~{len(self._changes)}")
+        if self.deletes:
+            self.delete(self._existing.keys())
+        else:
+            self.unseen = list(self._existing.keys())
+        self._existing = {}
+        return list(self._changes)
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from src.services.shared_cache import IPTV_DATA_DIR, LocalDatabase
+
+# Event log shared by the workers of one box and by sync_local.py. An empty path disables events.
+SYNC_EVENTS_PATH = os.environ.get('SYNC_EVENTS_PATH', os.path.join(IPTV_DATA_DIR, 'sync-events.sqlite3'))
+# Long enough for a client to reconnect with Last-Event-ID and miss nothing.
+EVENT_RETENTION_SECONDS = 15 * 60
+POLL_INTERVAL_SECONDS = 0.5
+POLL_BATCH_SIZE = 1000
+# Replayed on reconnect; a client further behind gets a resync event instead.
+REPLAY_LIMIT = 500
+SUBSCRIBER_QUEUE_SIZE = 256
+PRUNE_EVERY_SECONDS = 60
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, connection_id INTEGER NOT NULL, '
+    'event TEXT NOT NULL, data TEXT NOT NULL, created_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS idx_events_connection_seq ON events (connection_id, seq)',
+)
+
+
+class Subscription:
+    """Events for a set of connection ids, queued for one SSE client."""
+
+    def __init__(self, channels):
+        self.channels = set(channels)
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Set when the client fell too far behind; it must reload everything.
+        self.overflowed = False
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def next(self, timeout):
+        """The next (seq, connection_id, event, data), or None after `timeout` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class SyncEventBroadcaster:
+    """
+    Pushes sync progress and catalog version bumps to SSE subscribers.
+
+    Publishers (sync jobs in any worker or in sync_local.py) append to an
+    events table in a SQLite file on the box. Each worker runs one poller
+    thread that reads new events with a single indexed query and hands them
+    to the subscriptions of the connection, so idle subscribers cost a
+    blocked queue each and nothing per poll. Events are kept for
+    EVENT_RETENTION_SECONDS so reconnecting clients replay what they missed.
+    """
+
+    def __init__(self, path=SYNC_EVENTS_PATH):
+        self.path = path
+        self._database = LocalDatabase(path, SCHEMA)
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._poller = None
+        self._last_seq = 0
+        self._pruned_at = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def publish(self, connection_id, event, data):
+        """Appends an event; never raises, a lost event only costs the client a refetch."""
+        if not self.enabled:
+            return
+        try:
+            db = self._database.connection()
+            db.execute('INSERT INTO events (connection_id, event, data, created_at) VALUES (?, ?, ?, ?)',
+                       (connection_id, event, json.dumps(data, default=str), time.time()))
+            if time.time() - self._pruned_at > PRUNE_EVERY_SECONDS:
+                self._pruned_at = time.time()
+                db.execute('DELETE FROM events WHERE created_at < ?', (time.time() - EVENT_RETENTION_SECONDS,))
+        except sqlite3.Error as e:
+            logging.info(f"Could not publish {event} event for connection {connection_id}: {e}")
+
+    def subscribe(self, channels, last_event_id=None):
+        """
+        Registers a subscription to the given connection ids. With
+        `last_event_id` the retained events after it are queued first.
+        """
+        subscription = Subscription(channels)
+        if last_event_id is not None:
+            self._replay(subscription, last_event_id)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions.setdefault(channel, set()).add(subscription)
+            if self._poller is None and self.enabled:
+                # Subscribers get what is published from now on (plus their replay).
+                self._last_seq = self._latest_seq()
+                self._poller = threading.Thread(target=self._poll_loop, name='sync-events', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def resubscribe(self, subscription, channels):
+        """Moves a subscription to other connection ids (e.g. after a catalog became shared)."""
+        with self._lock:
+            self._remove(subscription)
+            subscription.channels = set(channels)
+            for channel in subscription.channels:
+                self._subscriptions.setdefault(channel, set()).add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._remove(subscription)
+
+    def _remove(self, subscription):
+        for channel in subscription.channels:
+            subscribers = self._subscriptions.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({subscription for subscribers in self._subscriptions.values() for subscription in subscribers})
+
+    def _replay(self, subscription, last_event_id):
+        if not self.enabled:
+            return
+        channels = sorted(subscription.channels)
+        try:
+            rows = self._database.connection().execute(
+                f"SELECT seq, connection_id, event, data FROM events WHERE seq > ? "
+                f"AND connection_id IN ({', '.join('?' * len(channels))}) ORDER BY seq LIMIT ?",
+                (last_event_id, *channels, REPLAY_LIMIT + 1)).fetchall()
+        except sqlite3.Error as e:
+            logging.info(f"Could not replay events after {last_event_id}: {e}")
+            subscription.overflowed = True
+            return
+        if len(rows) > REPLAY_LIMIT:
+            subscription.overflowed = True
+            return
+        for row in rows:
+            subscription.offer(row)
+
+    def _poll_loop(self):
+        while True:
+            try:
+                self._poll()
+            except sqlite3.Error as e:
+                logging.info(f"Sync event poll failed: {e}")
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+    def _latest_seq(self):
+        try:
+            return self._database.connection().execute('SELECT COALESCE(MAX(seq), 0) FROM events').fetchone()[0]
+        except sqlite3.Error as e:
+            logging.info(f"Could not read the latest sync event: {e}")
+            return 0
+
+    def _poll(self):
+        with self._lock:
+            idle = not self._subscriptions
+        if idle:
+            self._last_seq = self._latest_seq()
+            return
+        rows = self._database.connection().execute(
+            'SELECT seq, connection_id, event, data FROM events WHERE seq > ? ORDER BY seq LIMIT ?',
+            (self._last_seq, POLL_BATCH_SIZE)).fetchall()
+        for row in rows:
+            self._last_seq = row[0]
+            with self._lock:
+                subscribers = list(self._subscriptions.get(row[1], ()))
+            for subscription in subscribers:
+                subscription.offer(row)
+
+
+sync_events = SyncEventBroadcaster()
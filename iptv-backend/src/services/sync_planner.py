@@ -0,0 +1,163 @@
+import math
+import os
+from datetime import datetime, timezone
+from src.services.category_tree import category_summary
+from src.services.shared_catalog import fingerprint
+
+# Share of the categories that did not signal a change which are still
+# downloaded on every sync, oldest verification first: with 0.15 every
+# category is verified at least once every 7 syncs.
+VERIFY_FRACTION = float(os.environ.get('SYNC_VERIFY_FRACTION', '0.15'))
+PAGE_SIZE = 1000
+
+
+def _timestamp(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def category_fingerprint(rows):
+    """Item count, newest added/last_modified timestamp and content hash of one category's rows."""
+    stamps = [_timestamp(row.get('added') or row.get('last_modified')) for row in rows]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    return {
+        'item_count': len(rows),
+        'max_added': max(stamps) if stamps else None,
+        'content_hash': fingerprint(rows),
+    }
+
+
+def _epoch(value):
+    if not value:
+        return 0
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return 0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class SyncPlan:
+    def __init__(self):
+        # category_id -> request headers ({} for an unconditional download)
+        self.fetch = {}
+        self.skipped = []
+        self.removed = []
+
+    def summary(self):
+        conditional = sum(1 for headers in self.fetch.values() if headers)
+        return {'fetched': len(self.fetch) - conditional, 'conditional': conditional,
+                'skipped': len(self.skipped), 'removed': len(self.removed)}
+
+
+class SyncPlanner:
+    """
+    Plans which categories a sync downloads.
+
+    The state of every category after the previous sync (item count, newest
+    added timestamp, content hash and the provider's ETag/Last-Modified) is
+    kept in sync_category_state. Given the fresh, cheap category list, new
+    categories are downloaded, removed ones dropped, categories with HTTP
+    validators are re-requested conditionally (a 304 costs no body), and of
+    the remaining ones only the VERIFY_FRACTION verified longest ago are
+    downloaded again. Everything else is left as stored.
+    """
+
+    def __init__(self, supabase, verify_fraction=VERIFY_FRACTION):
+        self.supabase = supabase
+        self.verify_fraction = verify_fraction
+
+    def load(self, connection_id, content_type):
+        state = {}
+        start = 0
+        while True:
+            response = self.supabase.from_('sync_category_state').select('*') \
+                .eq('connection_id', connection_id).eq('content_type', content_type) \
+                .order('id').range(start, start + PAGE_SIZE - 1).execute()
+            batch = response.data or []
+            for row in batch:
+                state[str(row['category_id'])] = row
+            if len(batch) < PAGE_SIZE:
+                return state
+            start += PAGE_SIZE
+
+    def plan(self, category_ids, state):
+        plan = SyncPlan()
+        listed = set(category_ids)
+        plan.removed = [category_id for category_id in state if category_id not in listed]
+
+        unsignalled = []
+        for category_id in category_ids:
+            previous = state.get(category_id)
+            if previous is None:
+                plan.fetch[category_id] = {}
+            elif previous.get('etag') or previous.get('last_modified'):
+                plan.fetch[category_id] = self.conditional_headers(previous)
+            else:
+                unsignalled.append(category_id)
+
+        unsignalled.sort(key=lambda category_id: _epoch(state[category_id].get('verified_at')))
+        verify = math.ceil(len(unsignalled) * self.verify_fraction)
+        for category_id in unsignalled[:verify]:
+            plan.fetch[category_id] = {}
+        plan.skipped = unsignalled[verify:]
+        return plan
+
+    @staticmethod
+    def conditional_headers(previous):
+        headers = {}
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+        return headers
+
+    @staticmethod
+    def new_state(connection_id, content_type, category_id, rows, validators=None):
+        # Adult flag and artwork feed the category tree (category_tree.py).
+        summary = category_summary(rows)
+        return {
+            'connection_id': connection_id,
+            'content_type': content_type,
+            'category_id': category_id,
+            **category_fingerprint(rows),
+            'adult': summary['adult'],
+            'artwork': summary['artwork'],
+            'etag': (validators or {}).get('etag'),
+            'last_modified': (validators or {}).get('last_modified'),
+            'verified_at': datetime.now(timezone.utc).isoformat(),
+        }
+
+    @staticmethod
+    def reverified(previous):
+        """State of a category the provider confirmed unchanged (HTTP 304)."""
+        return dict(previous, verified_at=datetime.now(timezone.utc).isoformat())
+
+    @staticmethod
+    def unchanged(previous, current):
+        return all(previous.get(key) == current[key] for key in ('item_count', 'max_added', 'content_hash'))
+
+    def save(self, connection_id, content_type, states, removed=()):
+        rows = [{key: row.get(key) for key in ('connection_id', 'content_type', 'category_id', 'item_count',
+                                                'max_added', 'content_hash', 'adult', 'artwork', 'etag',
+                                                'last_modified', 'verified_at')}
+                for row in states]
+        for i in range(0, len(rows), PAGE_SIZE):
+            self.supabase.from_('sync_category_state').upsert(
+                rows[i:i + PAGE_SIZE], on_conflict='connection_id,content_type,category_id').execute()
+        removed = list(removed)
+        for i in range(0, len(removed), PAGE_SIZE):
+            self.supabase.from_('sync_category_state').delete().eq('connection_id', connection_id) \
+                .eq('content_type', content_type).in_('category_id', removed[i:i + PAGE_SIZE]).execute()
+
+    @staticmethod
+    def catalog_fingerprint(state):
+        """Hash of the whole content type's items, from the per-category hashes."""
+        return fingerprint([{'category_id': category_id, 'content_hash': row.get('content_hash')}
+                            for category_id, row in state.items()])
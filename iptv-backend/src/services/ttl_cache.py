@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from src.services.shared_cache import shared_cache as default_shared_cache
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire `ttl` seconds after being set.
+
+    With a `shared` namespace the LRU sits in front of the cross-worker
+    SharedCache: a local miss is looked up there (and kept locally for the
+    rest of its lifetime), and every set, invalidate and clear goes to both
+    tiers. Another worker's local copy of an invalidated key can live until
+    its own TTL, so shared caches keep short TTLs for data that must not lag.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, shared=None, shared_cache=default_shared_cache):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self._shared_cache = shared_cache
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _shared_key(self, key):
+        return f'{self.shared}:{json.dumps(key, sort_keys=True, default=str)}'
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at >= time.monotonic():
+                    self._data.move_to_end(key)
+                    return value
+                del self._data[key]
+        if self.shared is None:
+            return default
+        value, remaining = self._shared_cache.get(self._shared_key(key))
+        if value is None:
+            return default
+        self._set_local(key, value, remaining)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._set_local(key, value, ttl)
+        if self.shared is not None:
+            self._shared_cache.set(self._shared_key(key), value, ttl)
+
+    def _set_local(self, key, value, ttl):
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.shared is not None:
+            self._shared_cache.delete(self._shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self.shared is not None:
+            self._shared_cache.clear(f'{self.shared}:')
+
+    def __len__(self):
+        return len(self._data)
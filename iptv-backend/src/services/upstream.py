@@ -0,0 +1,35 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36'
+POOL_SIZE = 64
+
+
+def _build_session():
+    session = requests.Session()
+    # One keep-alive pool per provider host, shared by the proxy and warm-ups,
+    # so a channel switch reuses an already open upstream connection.
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+session = _build_session()
+
+
+def proxy_headers(url):
+    """Headers sent to stream hosts, with the Referer set to the URL's origin."""
+    try:
+        parsed_url = urlparse(url)
+        referer_domain = f"{parsed_url.scheme}://{parsed_url.netloc}/"
+    except Exception:
+        referer_domain = ""  # Fallback se a URL for malformada
+    return {
+        'User-Agent': USER_AGENT,
+        'Accept': '*/*',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Connection': 'keep-alive',
+        'Referer': referer_domain,
+    }
@@ -1,18 +1,112 @@
 import requests
 import logging
 import json
-import os
 import time
 from datetime import datetime
-from supabase import create_client, Client
-from werkzeug.security import generate_password_hash, check_password_hash
+from src.services import upstream
+from src.services.auth import HASH_RETRY_AFTER_SECONDS, HashingBusyError, password_hasher, session_tokens
+from src.services.circuit_breaker import circuit_breakers
+from src.services.episode_crawler import episode_crawler
+from src.services.catalog_cache import catalog_cache, STREAM_TABLES
+from src.services.category_tree import CategoryTrees
+from src.services.change_log import CatalogChangeLog, ENTITY_KEYS
+from src.services.image_cache import image_cache
+from src.services.m3u_import import M3UImporter
+from src.services.metrics import LOG_SAMPLE_RATE, log_event, metrics, preview
+from src.services.mirrors import mirror_selector
+from src.services.preferences import preferences_store
+from src.services import storage
+from src.services.shared_catalog import shared_catalogs
+from src.services.stream_prober import stream_prober
+from src.services.sync_engine import CatalogSyncEngine
+from src.services.ttl_cache import TTLCache
+
+IN_QUERY_CHUNK_SIZE = 200
+# Short TTL: credentials rarely change, and invalidate_connection_details()
+# covers the cases where they do.
+CONNECTION_DETAILS_TTL_SECONDS = 60
+
+# Last good API response per request, served while the provider is down.
+# Only authentication and category listings: they are small and enough to
+# browse the local catalog, while full stream listings would cost megabytes
+# per call in every worker and in the shared cache.
+STALE_RESPONSE_TTL_SECONDS = 6 * 3600
+STALE_RESPONSE_MAX_BYTES = 256 * 1024
+STALE_RESPONSE_ACTIONS = (None, 'get_live_categories', 'get_vod_categories', 'get_series_categories')
+
+# /streams?sort= for VOD and series -> typed column filled by the sync engine
+SORT_COLUMNS = {'added': 'added_at', 'rating': 'rating_value', 'year': 'release_year'}
+
+# Both also live in the cross-worker SharedCache, so each is filled once per box.
+connection_details_cache = TTLCache(maxsize=1024, ttl=CONNECTION_DETAILS_TTL_SECONDS, shared='connection_details')
+stale_responses = TTLCache(maxsize=128, ttl=STALE_RESPONSE_TTL_SECONDS, shared='stale_responses')
+
+
+def _parse_stream_ref(ref):
+    """Normalizes a stream reference to (stream_type or None, id as str)."""
+    stream_type = None
+    if isinstance(ref, dict):
+        stream_type = ref.get('stream_type') or ref.get('type')
+        item_id = ref.get('stream_id') or ref.get('series_id') or ref.get('id')
+    elif isinstance(ref, str) and ':' in ref:
+        stream_type, item_id = ref.split(':', 1)
+    else:
+        item_id = ref
+    if stream_type == 'movie':
+        stream_type = 'vod'
+    if stream_type not in STREAM_TABLES:
+        stream_type = None
+    return stream_type, str(item_id)
+
+
+def _keyset_cursor(row, column):
+    """Opaque cursor '<value>:<id>' of the last row of a sorted page (empty value for NULL)."""
+    value = row.get(column)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{'' if value is None else value}:{row['id']}"
+
+
+def _keyset_filter(column, cursor):
+    """
+    PostgREST `or` filter selecting the rows after `cursor` in
+    (column DESC NULLS LAST, id DESC) order.
+    """
+    value, _, row_id = cursor.rpartition(':')
+    row_id = int(row_id)
+    if value == '':
+        return f'and({column}.is.null,id.lt.{row_id})'
+    float(value)  # rejects anything that is not a number before it reaches the filter
+    return f'{column}.lt.{value},and({column}.eq.{value},id.lt.{row_id}),{column}.is.null'
+
+
+def build_stream_url(conn_details, stream_id, stream_type, container=None, server_url=None):
+    server_url = (server_url or conn_details['server_url']).rstrip('/')
+    username = conn_details['username']
+    password = conn_details['password']
+
+    # The stream_type should be 'movie' for VOD content as per Xtream standards.
+    type_for_url = 'movie' if stream_type == 'vod' else stream_type
+
+    # Determine the container if not provided. Prioritize m3u8 for live.
+    # This fallback logic is primarily for cases where the frontend doesn't specify.
+    # The frontend's preferredContainers logic is more robust.
+    if not container:
+        if type_for_url == 'live':
+            container = 'm3u8'
+        else:
+            container = 'ts' # Default for VOD/series if not specified
+
+    # Format: http://<server_url>/<type>/<username>/<password>/<stream_id>.<container>
+    return f"{server_url}/{type_for_url}/{username}/{password}/{stream_id}.{container}"
+
 
 class XtreamService:
     def __init__(self, app):
         self.app = app
-        self.supabase_url: str = os.environ.get("SUPABASE_URL")
-        self.supabase_key: str = os.environ.get("SUPABASE_KEY")
-        self.supabase: Client = create_client(self.supabase_url, self.supabase_key)
+        # Supabase or the local SQL backend (STORAGE_BACKEND); both share one
+        # client per process and the same query-builder API.
+        self.supabase = storage.get_client()
 
     def get_connections(self):
         try:
@@ -29,7 +123,7 @@ class XtreamService:
             if existing_user.data:
                 return {'success': False, 'error': 'Username already exists'}
 
-            hashed_password = generate_password_hash(password)
+            hashed_password = password_hasher.generate(password)
 
             response = self.supabase.from_('user').insert({
                 'username': username,
@@ -41,71 +135,75 @@ class XtreamService:
                 return {'success': True, 'user': response.data[0]}
             else:
                 return {'success': False, 'error': 'Failed to register user'}
+        except HashingBusyError as e:
+            return {'success': False, 'error': str(e), 'retry_after': HASH_RETRY_AFTER_SECONDS}
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
     def login(self, username, password):
         try:
-            response = self.supabase.from_('user').select('*').eq('username', username).single().execute()
+            response = self.supabase.from_('user').select('id, username, email, password').eq('username', username).execute()
 
             if not response.data:
                 return {'success': False, 'error': 'Invalid username or password'}
 
-            user = response.data
+            user = response.data[0]
             if not user.get('password'):
                 return {'success': False, 'error': 'Password not set for this user'}
 
-            if check_password_hash(user['password'], password):
+            if password_hasher.check(user['password'], password):
                 del user['password']
-                return {'success': True, 'user': user}
+                return {'success': True, 'user': user, 'token': session_tokens.issue(user)}
             else:
                 return {'success': False, 'error': 'Invalid username or password'}
+        except HashingBusyError as e:
+            return {'success': False, 'error': str(e), 'retry_after': HASH_RETRY_AFTER_SECONDS}
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
-    def login(self, username, password):
-        try:
-            response = self.supabase.from_('user').select('*').eq('username', username).single().execute()
-
-            if not response.data:
-                return {'success': False, 'error': 'Invalid username or password'}
-
-            user = response.data
-            if not user.get('password'):
-                return {'success': False, 'error': 'Password not set for this user'}
-
-            if check_password_hash(user['password'], password):
-                del user['password']
-                return {'success': True, 'user': user}
-            else:
-                return {'success': False, 'error': 'Invalid username or password'}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+    def verify_session(self, token):
+        """Resolves a session token issued by login() without touching the database."""
+        user = session_tokens.verify(token)
+        if user is None:
+            return {'success': False, 'error': 'Invalid or expired session'}
+        return {'success': True, 'user': user}
 
     def _get_xtream_connection_details(self, connection_id):
+        conn_details = connection_details_cache.get(connection_id)
+        metrics.cache_result('connection_details', conn_details is not None)
+        if conn_details is not None:
+            return conn_details
         try:
-            response = self.supabase.from_('xtream_connections').select('server_url, username, password').eq('id', connection_id).single().execute()
+            response = self.supabase.from_('xtream_connections').select('server_url, username, password, server_info').eq('id', connection_id).single().execute()
             if response.data:
+                connection_details_cache.set(connection_id, response.data)
                 return response.data
             return None
         except Exception as e:
             print(f"Error fetching Xtream connection details: {e}")
             return None
 
-    def _make_xtream_request(self, connection_id, action, params=None):
+    def invalidate_connection_details(self, connection_id):
+        connection_details_cache.invalidate(connection_id)
+
+    def catalog_id(self, connection_id):
+        """Connection id the catalog rows are stored under (the owner's when the catalog is shared)."""
+        return shared_catalogs.catalog_id(self.supabase, connection_id)
+
+    def _make_xtream_request(self, connection_id, action, params=None, headers=None):
+        """
+        Calls player_api.php. Extra `headers` (e.g. If-None-Match) are sent
+        along; a 304 answer returns {'success': True, 'not_modified': True},
+        and the response's ETag/Last-Modified come back as 'validators'.
+        """
         conn_details = self._get_xtream_connection_details(connection_id)
         if not conn_details:
             logging.error(f"Xtream connection details not found for connection_id: {connection_id}")
             return {'success': False, 'error': 'Xtream connection details not found.'}
 
-        base_url = conn_details['server_url'].rstrip('/')
         username = conn_details['username']
         password = conn_details['password']
 
-        # Ensure the base URL ends with player_api.php
-        if not base_url.endswith('/player_api.php'):
-            base_url = f"{base_url}/player_api.php"
-
         url_params = {
             'username': username,
             'password': password,
@@ -113,17 +211,27 @@ class XtreamService:
         }
         if params:
             url_params.update(params)
+        stale_key = (connection_id, action, tuple(sorted((params or {}).items())))
 
+        started = time.perf_counter()
+        outcome = 'error'
         try:
-            logging.warning(f"Making Xtream API request to {base_url} for action: {action}") # Changed to WARNING
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            request_headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                **(headers or {}),
             }
-            response = requests.get(base_url, params=url_params, headers=headers, timeout=10)
+            # Fastest healthy mirror, hedged to the runner-up when it is slow
+            response = mirror_selector.get(connection_id, conn_details, 'player_api.php', params=url_params, headers=request_headers, timeout=10)
             response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+            if response.status_code == 304:
+                outcome = 'not_modified'
+                return {'success': True, 'not_modified': True}
+            validators = {key: response.headers[header] for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified'))
+                          if response.headers.get(header)}
             
             # Check for empty or non-JSON response
             if not response.text:
+                outcome = 'empty'
                 logging.warning(f"Xtream API returned empty response for action: {action}")
                 return {'success': True, 'data': []} # Return success with empty data
 
@@ -131,59 +239,85 @@ class XtreamService:
             try:
                 data = response.json()
             except json.JSONDecodeError:
-                logging.error(f"Failed to decode JSON from Xtream API for action: {action}. Response text: {response.text}")
+                outcome = 'invalid_json'
+                log_event('xtream_invalid_json', logging.ERROR, connection_id=connection_id, action=action,
+                          status=response.status_code, body=preview(response.text))
                 return {'success': False, 'error': 'Failed to decode JSON from Xtream API.'}
 
-            logging.warning(f"Successfully received data from Xtream API for action: {action}. Data: {data}") # Changed to WARNING
-            return {'success': True, 'data': data}
+            outcome = 'ok'
+            log_event('xtream_response', sample_rate=LOG_SAMPLE_RATE, connection_id=connection_id, action=action,
+                      bytes=len(response.content), items=len(data) if isinstance(data, (list, dict)) else None,
+                      body=preview(response.text))
+            if action in STALE_RESPONSE_ACTIONS and len(response.content) <= STALE_RESPONSE_MAX_BYTES:
+                stale_responses.set(stale_key, data)
+            return {'success': True, 'data': data, 'validators': validators}
         except requests.exceptions.Timeout:
-            logging.error(f"Xtream API request timed out for action: {action} at URL: {base_url}")
-            return {'success': False, 'error': f'Xtream API request timed out for action: {action}'}
+            outcome = 'timeout'
+            logging.error(f"Xtream API request timed out for action: {action} on connection {connection_id}")
+            return self._stale_or_error(stale_key, f'Xtream API request timed out for action: {action}')
         except requests.exceptions.RequestException as e:
             logging.error(f"Xtream API request failed for {action}: {e}")
-            return {'success': False, 'error': f'Xtream API request failed: {e}'}
+            return self._stale_or_error(stale_key, f'Xtream API request failed: {e}')
+        finally:
+            metrics.observe('iptv_upstream_request_duration_seconds', time.perf_counter() - started,
+                            {'action': action, 'outcome': outcome})
+
+    def _stale_or_error(self, stale_key, error):
+        """Falls back to the last good response for the same request when the provider is down."""
+        data = stale_responses.get(stale_key)
+        metrics.cache_result('stale_response', data is not None)
+        if data is not None:
+            return {'success': True, 'data': data, 'stale': True}
+        return {'success': False, 'error': error}
 
     # --- Category Methods ---
     def get_live_categories(self, connection_id):
-        """Fetches live categories from Supabase."""
-        try:
-            response = self.supabase.from_('live_categories').select('*').eq('connection_id', connection_id).execute()
-            if response.data:
-                return {'success': True, 'categories': response.data}
-            return {'success': True, 'categories': []}
-        except Exception as e:
-            logging.error(f"Error fetching live categories from Supabase for connection {connection_id}: {e}", exc_info=True)
-            return {'success': False, 'error': str(e)}
+        """Fetches live categories with counts, adult flags and artwork (see _get_categories)."""
+        return self._get_categories(connection_id, 'live', 'live_categories')
 
     def get_vod_categories(self, connection_id):
-        """Fetches VOD categories from Supabase."""
-        try:
-            response = self.supabase.from_('vod_categories').select('*').eq('connection_id', connection_id).execute()
-            if response.data:
-                return {'success': True, 'categories': response.data}
-            return {'success': True, 'categories': []}
-        except Exception as e:
-            logging.error(f"Error fetching VOD categories from Supabase for connection {connection_id}: {e}", exc_info=True)
-            return {'success': False, 'error': str(e)}
+        """Fetches VOD categories with counts, adult flags and artwork (see _get_categories)."""
+        return self._get_categories(connection_id, 'vod', 'vod_categories')
 
     def get_series_categories(self, connection_id):
-        """Fetches series categories from Supabase."""
+        """Fetches series categories with counts, adult flags and artwork (see _get_categories)."""
+        return self._get_categories(connection_id, 'series', 'series_categories')
+
+    def _get_categories(self, connection_id, content_type, table):
+        """
+        Serves the category tree precomputed by the last sync: every category
+        with item_count, total_count (its subtree), adult, artwork and
+        children, plus the root ids. Catalogs not synced since the tree was
+        introduced get the plain rows from Supabase.
+        """
         try:
-            response = self.supabase.from_('series_categories').select('*').eq('connection_id', connection_id).execute()
-            if response.data:
-                return {'success': True, 'categories': response.data}
-            return {'success': True, 'categories': []}
+            catalog_id = self.catalog_id(connection_id)
+            tree = CategoryTrees(self.supabase).load(catalog_id, content_type)
+            if tree is not None:
+                return {'success': True, 'categories': tree['categories'], 'roots': tree['roots'],
+                        'version': tree['version']}
+            response = self.supabase.from_(table).select('*').eq('connection_id', catalog_id).execute()
+            return {'success': True, 'categories': response.data or []}
         except Exception as e:
-            logging.error(f"Error fetching series categories from Supabase for connection {connection_id}: {e}", exc_info=True)
+            logging.error(f"Error fetching {content_type} categories from Supabase for connection {connection_id}: {e}", exc_info=True)
             return {'success': False, 'error': str(e)}
 
     # --- Stream Methods ---
-    def get_live_streams(self, connection_id, category_id=None, page=1, page_size=50):
-        """Fetches live streams from Supabase with pagination."""
+    def get_live_streams(self, connection_id, category_id=None, page=1, page_size=50, only_alive=False, sort=None):
+        """
+        Fetches live streams from Supabase with pagination. `only_alive` hides
+        channels the stream prober found dead; sort='latency' orders by probe latency.
+        """
         try:
-            query = self.supabase.from_('live_streams').select('*').eq('connection_id', connection_id)
+            catalog_id = self.catalog_id(connection_id)
+            query = self.supabase.from_('live_streams').select('*').eq('connection_id', catalog_id)
             if category_id:
                 query = query.eq('category_id', category_id)
+            if only_alive:
+                # Channels not probed yet are kept
+                query = query.or_('alive.is.null,alive.is.true')
+            if sort == 'latency':
+                query = query.order('probe_latency_ms', nullsfirst=False).order('id')
             
             # Supabase pagination (range is 0-indexed)
             start_range = (page - 1) * page_size
@@ -196,48 +330,60 @@ class XtreamService:
             # A simpler way is to fetch one more item than page_size to check for has_more.
             # For now, we'll assume has_more if we get page_size items.
             has_more = len(response.data) == page_size
+            catalog_cache.put_rows(catalog_id, 'live', response.data)
 
             return {'success': True, 'streams': response.data, 'pagination': {'has_more': has_more}}
         except Exception as e:
             logging.error(f"Error fetching live streams from Supabase for connection {connection_id}: {e}", exc_info=True)
             return {'success': False, 'error': str(e)}
 
-    def get_vod_streams(self, connection_id, category_id=None, page=1, page_size=50):
-        """Fetches VOD streams from Supabase with pagination."""
-        try:
-            query = self.supabase.from_('vod_streams').select('*').eq('connection_id', connection_id)
-            if category_id:
-                query = query.eq('category_id', category_id)
-            
-            start_range = (page - 1) * page_size
-            end_range = start_range + page_size - 1
-            
-            response = query.range(start_range, end_range).execute()
-            
-            has_more = len(response.data) == page_size
+    def get_vod_streams(self, connection_id, category_id=None, page=1, page_size=50, sort=None, cursor=None):
+        """
+        Fetches VOD streams from Supabase with pagination. sort='added',
+        'rating' or 'year' returns a rail ordered newest/best first, paged
+        with `cursor` (pagination.next_cursor of the previous page).
+        """
+        return self._stream_page('vod_streams', 'vod', connection_id, category_id, page, page_size, sort, cursor)
 
-            return {'success': True, 'streams': response.data, 'pagination': {'has_more': has_more}}
-        except Exception as e:
-            logging.error(f"Error fetching VOD streams from Supabase for connection {connection_id}: {e}", exc_info=True)
-            return {'success': False, 'error': str(e)}
+    def get_series(self, connection_id, category_id=None, page=1, page_size=50, sort=None, cursor=None):
+        """Fetches series from Supabase with pagination; `sort`/`cursor` as in get_vod_streams."""
+        return self._stream_page('series', 'series', connection_id, category_id, page, page_size, sort, cursor)
 
-    def get_series(self, connection_id, category_id=None, page=1, page_size=50):
-        """Fetches series from Supabase with pagination."""
+    def _stream_page(self, table, content_type, connection_id, category_id, page, page_size, sort, cursor):
+        if sort and sort not in SORT_COLUMNS:
+            return {'success': False, 'error': f"Invalid sort '{sort}'. Use one of: {', '.join(SORT_COLUMNS)}."}
         try:
-            query = self.supabase.from_('series').select('*').eq('connection_id', connection_id)
+            catalog_id = self.catalog_id(connection_id)
+            query = self.supabase.from_(table).select('*').eq('connection_id', catalog_id)
             if category_id:
                 query = query.eq('category_id', category_id)
-            
-            start_range = (page - 1) * page_size
-            end_range = start_range + page_size - 1
-            
-            response = query.range(start_range, end_range).execute()
-            
-            has_more = len(response.data) == page_size
 
-            return {'success': True, 'streams': response.data, 'pagination': {'has_more': has_more}}
+            pagination = {}
+            if sort:
+                # Keyset paging over the (value, id) indexes: every page costs the same, however deep.
+                column = SORT_COLUMNS[sort]
+                if cursor:
+                    try:
+                        query = query.or_(_keyset_filter(column, cursor))
+                    except ValueError:
+                        return {'success': False, 'error': 'Invalid cursor.'}
+                response = query.order(column, desc=True, nullsfirst=False).order('id', desc=True) \
+                    .limit(page_size + 1).execute()
+                rows = response.data[:page_size]
+                has_more = len(response.data) > page_size
+                pagination['next_cursor'] = _keyset_cursor(rows[-1], column) if has_more else None
+            else:
+                start_range = (page - 1) * page_size
+                end_range = start_range + page_size - 1
+
+                response = query.range(start_range, end_range).execute()
+                rows = response.data
+                has_more = len(rows) == page_size
+            catalog_cache.put_rows(catalog_id, content_type, rows)
+
+            return {'success': True, 'streams': rows, 'pagination': {'has_more': has_more, **pagination}}
         except Exception as e:
-            logging.error(f"Error fetching series from Supabase for connection {connection_id}: {e}", exc_info=True)
+            logging.error(f"Error fetching {table} from Supabase for connection {connection_id}: {e}", exc_info=True)
             return {'success': False, 'error': str(e)}
 
     # --- Other Methods (Placeholders for now) ---
@@ -253,8 +399,19 @@ class XtreamService:
             'password': password,
         }
 
+        breaker = circuit_breakers.for_url(base_url)
         try:
-            response = requests.get(base_url, params=url_params, timeout=10)
+            breaker.check()
+            started = time.monotonic()
+            try:
+                response = upstream.session.get(base_url, params=url_params, timeout=breaker.timeout(10))
+            except requests.exceptions.RequestException:
+                breaker.record_failure()
+                raise
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success(time.monotonic() - started)
             response.raise_for_status()
             data = response.json()
             if data.get('user_info') and data.get('server_info'):
@@ -263,194 +420,112 @@ class XtreamService:
         except requests.exceptions.RequestException as e:
             return {'success': False, 'error': f'Xtream API authentication failed: {e}'}
 
-    def sync_live_data(self, connection_id):
+    def sync_live_data(self, connection_id, full=False):
         """
         Synchronizes live channels and categories from Xtream API to Supabase.
         """
-        logging.warning(f"Starting live data sync for connection_id: {connection_id}")
-        try:
-            self.supabase.from_('live_streams').delete().eq('connection_id', connection_id).execute()
-            self.supabase.from_('live_categories').delete().eq('connection_id', connection_id).execute()
-            logging.warning(f"Sync {connection_id}: Old live data deleted.")
-
-            live_cats_res = self.get_live_categories(connection_id)
-            live_streams_res = self.get_live_streams(connection_id)
-            logging.warning(f"Sync {connection_id}: New live data fetched.")
-
-            if live_cats_res.get('success') and live_cats_res.get('categories'):
-                categories_to_insert = []
-                for item in live_cats_res['categories']:
-                    categories_to_insert.append({
-                        'connection_id': connection_id,
-                        'category_id': item.get('category_id'),
-                        'category_name': item.get('category_name'),
-                        'parent_id': item.get('parent_id')
-                    })
-                if categories_to_insert:
-                    self.supabase.from_('live_categories').insert(categories_to_insert).execute()
-                    logging.warning(f"Inserted {len(categories_to_insert)} live categories.")
-                else:
-                    logging.warning("No live categories to insert.")
-            else:
-                logging.error(f"Failed to fetch live categories: {live_cats_res.get('error', 'Unknown error')}")
-
-            if live_streams_res.get('success') and live_streams_res.get('streams'):
-                streams_to_insert = []
-                for s in live_streams_res['streams']:
-                    streams_to_insert.append({
-                        'connection_id': connection_id,
-                        'stream_id': s.get('stream_id'),
-                        'name': s.get('name'),
-                        'stream_icon': s.get('stream_icon'),
-                        'category_id': s.get('category_id'),
-                        'epg_channel_id': s.get('epg_channel_id'),
-                        'added': s.get('added'),
-                        'is_adult': s.get('is_adult', '0')
-                    })
-                if streams_to_insert:
-                    self.supabase.from_('live_streams').insert(streams_to_insert).execute()
-                    logging.warning(f"Inserted {len(streams_to_insert)} live streams.")
-                else:
-                    logging.warning("No live streams to insert.")
-            else:
-                logging.error(f"Failed to fetch live streams: {live_streams_res.get('error', 'Unknown error')}")
-            
-            logging.warning(f"Live data sync for connection {connection_id} completed.")
-            return {'success': True, 'message': 'Live data sync completed.'}
-        except Exception as e:
-            logging.error(f"Error during live data sync for connection {connection_id}: {e}", exc_info=True)
-            return {'success': False, 'error': str(e)}
+        return self._sync_and_prewarm(connection_id, 'live', full)
 
-    def sync_vod_data(self, connection_id):
+    def sync_vod_data(self, connection_id, full=False):
         """
         Synchronizes VOD (movies) and categories from Xtream API to Supabase.
         """
-        logging.warning(f"Starting VOD data sync for connection_id: {connection_id}")
-        try:
-            self.supabase.from_('vod_streams').delete().eq('connection_id', connection_id).execute()
-            self.supabase.from_('vod_categories').delete().eq('connection_id', connection_id).execute()
-            logging.warning(f"Sync {connection_id}: Old VOD data deleted.")
-
-            vod_cats_res = self.get_vod_categories(connection_id)
-            vod_streams_res = self.get_vod_streams(connection_id)
-            logging.warning(f"Sync {connection_id}: New VOD data fetched.")
-
-            if vod_cats_res.get('success') and vod_cats_res.get('categories'):
-                categories_to_insert = []
-                for item in vod_cats_res['data']:
-                    categories_to_insert.append({
-                        'connection_id': connection_id,
-                        'category_id': item.get('category_id'),
-                        'category_name': item.get('category_name'),
-                        'parent_id': item.get('parent_id')
-                    })
-                if categories_to_insert:
-                    self.supabase.from_('vod_categories').insert(categories_to_insert).execute()
-                    logging.warning(f"Inserted {len(categories_to_insert)} VOD categories.")
-                else:
-                    logging.warning("No VOD categories to insert.")
-            else:
-                logging.error(f"Failed to fetch VOD categories: {vod_cats_res.get('error', 'Unknown error')}")
-
-            if vod_streams_res.get('success') and vod_streams_res.get('streams'):
-                streams_to_insert = []
-                for s in vod_streams_res['data']:
-                    streams_to_insert.append({
-                        'connection_id': connection_id,
-                        'stream_id': s.get('stream_id'),
-                        'name': s.get('name'),
-                        'stream_icon': s.get('stream_icon'),
-                        'category_id': s.get('category_id'),
-                        'rating': s.get('rating'),
-                        'added': s.get('added')
-                    })
-                if streams_to_insert:
-                    self.supabase.from_('vod_streams').insert(streams_to_insert).execute()
-                    logging.warning(f"Inserted {len(streams_to_insert)} VOD streams.")
-                else:
-                    logging.warning("No VOD streams to insert.")
-            else:
-                logging.error(f"Failed to fetch VOD streams: {vod_streams_res.get('error', 'Unknown error')}")
-
-            logging.warning(f"VOD data sync for connection {connection_id} completed.")
-            return {'success': True, 'message': 'VOD data sync completed.'}
-        except Exception as e:
-            logging.error(f"Error during VOD data sync for connection {connection_id}: {e}", exc_info=True)
-            return {'success': False, 'error': str(e)}
+        return self._sync_and_prewarm(connection_id, 'vod', full)
 
-    def sync_series_data(self, connection_id):
+    def sync_series_data(self, connection_id, full=False):
         """
         Synchronizes series and categories from Xtream API to Supabase.
         """
-        logging.warning(f"Starting series data sync for connection_id: {connection_id}")
+        return self._sync_and_prewarm(connection_id, 'series', full)
+
+    def import_m3u_playlist(self, connection_id, source):
+        """Imports a plain M3U playlist (URL or local file) as the connection's catalog."""
+        return M3UImporter(self).import_playlist(connection_id, source)
+
+    def _sync_and_prewarm(self, connection_id, content_type, full=False):
+        result = CatalogSyncEngine(self).sync(connection_id, content_type, full)
+        if result.get('success'):
+            # Thumbnails for the first categories users open after a sync
+            image_cache.prewarm(self, self.catalog_id(connection_id), content_type)
+            if content_type == 'series':
+                episode_crawler.schedule(self, connection_id)
+        return result
+
+    def get_catalog_version(self, connection_id):
+        return CatalogChangeLog(self.supabase).get_version(self.catalog_id(connection_id))['version']
+
+    def get_catalog_changes(self, connection_id, since):
+        """Returns the catalog delta recorded by the sync engine after version `since`."""
         try:
-            self.supabase.from_('series').delete().eq('connection_id', connection_id).execute()
-            self.supabase.from_('series_categories').delete().eq('connection_id', connection_id).execute()
-            logging.warning(f"Sync {connection_id}: Old series data deleted.")
-
-            series_cats_res = self.get_series_categories(connection_id)
-            series_res = self.get_series(connection_id)
-            logging.warning(f"Sync {connection_id}: New series data fetched.")
-
-            if series_cats_res.get('success') and series_cats_res.get('categories'):
-                categories_to_insert = []
-                for item in series_cats_res['data']:
-                    categories_to_insert.append({
-                        'connection_id': connection_id,
-                        'category_id': item.get('category_id'),
-                        'category_name': item.get('category_name'),
-                        'parent_id': item.get('parent_id')
-                    })
-                if categories_to_insert:
-                    self.supabase.from_('series_categories').insert(categories_to_insert).execute()
-                    logging.warning(f"Inserted {len(categories_to_insert)} series categories.")
-                else:
-                    logging.warning("No series categories to insert.")
-            else:
-                logging.error(f"Failed to fetch series categories: {series_cats_res.get('error', 'Unknown error')}")
-
-            if series_res.get('success') and series_res.get('streams'):
-                series_to_insert = []
-                for s in series_res['data']:
-                    series_to_insert.append({
-                        'connection_id': connection_id,
-                        'series_id': s.get('series_id'),
-                        'name': s.get('name'),
-                        'cover': s.get('cover'),
-                        'plot': s.get('plot'),
-                        'cast': s.get('cast'),
-                        'director': s.get('director'),
-                        'genre': s.get('genre'),
-                        'release_date': s.get('releaseDate'),
-                        'last_modified': s.get('last_modified'),
-                        'rating': s.get('rating'),
-                        'category_id': s.get('category_id')
-                    })
-                if series_to_insert:
-                    self.supabase.from_('series').insert(series_to_insert).execute()
-                    logging.warning(f"Inserted {len(series_to_insert)} series.")
-                else:
-                    logging.warning("No series to insert.")
-            else:
-                logging.error(f"Failed to fetch series: {series_res.get('error', 'Unknown error')}")
-
-            logging.warning(f"Series data sync for connection {connection_id} completed.")
-            return {'success': True, 'message': 'Series data sync completed.'}
+            return CatalogChangeLog(self.supabase).changes_since(self.catalog_id(connection_id), since)
         except Exception as e:
-            logging.error(f"Error during series data sync for connection {connection_id}: {e}", exc_info=True)
+            logging.error(f"Error fetching catalog changes for connection {connection_id}: {e}", exc_info=True)
             return {'success': False, 'error': str(e)}
 
+    def probe_live_streams(self, connection_id):
+        """Schedules incremental liveness probing of the connection's live channels."""
+        stream_prober.schedule(self, connection_id)
+        return {'success': True, 'message': 'Stream probing scheduled.'}
+
     def search_streams(self, connection_id, stream_type, query_text):
         # Placeholder for stream search
         return {'success': False, 'error': 'Stream search not implemented.'}
 
-    def get_streams_by_ids(self, stream_ids):
-        # Placeholder for getting stream details by IDs
-        return {'success': False, 'error': 'Get streams by IDs not implemented.'}
+    def get_streams_by_ids(self, connection_id, stream_ids):
+        """
+        Resolves a mixed list of live/VOD/series ids, returned in request order.
+
+        Ids may be {'stream_id' | 'series_id' | 'id', 'stream_type'} objects,
+        'type:id' strings or bare ids (tried as live, then VOD, then series).
+        Hits come from the catalog cache index; misses cost one chunked in()
+        query per table.
+        """
+        try:
+            requested = [_parse_stream_ref(ref) for ref in stream_ids]
+            catalog_id = self.catalog_id(connection_id)
+            catalog_cache.validate(catalog_id, lambda: CatalogChangeLog(self.supabase).get_version(catalog_id)['version'])
+
+            resolved = {}
+            for stream_type, table in STREAM_TABLES.items():
+                ids = list(dict.fromkeys(item_id for ref_type, item_id in requested if ref_type in (stream_type, None)))
+                if not ids:
+                    continue
+                found, missing = catalog_cache.get_rows(catalog_id, stream_type, ids)
+                if missing:
+                    key = ENTITY_KEYS[table]
+                    rows = []
+                    for i in range(0, len(missing), IN_QUERY_CHUNK_SIZE):
+                        response = self.supabase.from_(table).select('*').eq('connection_id', catalog_id) \
+                            .in_(key, missing[i:i + IN_QUERY_CHUNK_SIZE]).execute()
+                        rows.extend(response.data or [])
+                    catalog_cache.put_rows(catalog_id, stream_type, rows)
+                    for row in rows:
+                        found[str(row[key])] = row
+                for item_id, row in found.items():
+                    resolved[(stream_type, item_id)] = row
+
+            streams = []
+            not_found = []
+            for ref_type, item_id in requested:
+                for stream_type in ((ref_type,) if ref_type else tuple(STREAM_TABLES)):
+                    row = resolved.get((stream_type, item_id))
+                    if row is not None:
+                        streams.append(dict(row, content_type=stream_type))
+                        break
+                else:
+                    not_found.append(f"{ref_type}:{item_id}" if ref_type else item_id)
+
+            return {'success': True, 'streams': streams, 'missing': not_found}
+        except Exception as e:
+            logging.error(f"Error resolving stream ids for connection {connection_id}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
 
     def clear_local_data(self, connection_id):
-        # Placeholder for clearing local data
-        return {'success': False, 'error': 'Clear local data not implemented.'}
+        """Drops this process's cached catalog rows and credentials for the connection."""
+        catalog_cache.invalidate(connection_id)
+        catalog_cache.invalidate(self.catalog_id(connection_id))
+        self.invalidate_connection_details(connection_id)
+        return {'success': True, 'message': 'Local cache cleared.'}
 
     def get_stream_url(self, connection_id, stream_id, stream_type, container=None):
         """Builds the final, playable stream URL with the specified container."""
@@ -458,34 +533,77 @@ class XtreamService:
             conn_details = self._get_xtream_connection_details(connection_id)
             if not conn_details:
                 return {'success': False, 'error': 'Xtream connection details not found.'}
-
-            server_url = conn_details['server_url'].rstrip('/')
-            username = conn_details['username']
-            password = conn_details['password']
-            
-            # The stream_type should be 'movie' for VOD content as per Xtream standards.
-            type_for_url = 'movie' if stream_type == 'vod' else stream_type
-
-            # Determine the container if not provided. Prioritize m3u8 for live.
-            # This fallback logic is primarily for cases where the frontend doesn't specify.
-            # The frontend's preferredContainers logic is more robust.
-            if not container:
-                if type_for_url == 'live':
-                    container = 'm3u8'
-                else:
-                    container = 'ts' # Default for VOD/series if not specified
-
-            # Format: http://<server_url>/<type>/<username>/<password>/<stream_id>.<container>
-            stream_url = f"{server_url}/{type_for_url}/{username}/{password}/{stream_id}.{container}"
-
-            return {'success': True, 'url': stream_url}
+            direct_source = self._direct_sources(connection_id, [stream_id], stream_type).get(str(stream_id))
+            if direct_source:
+                return {'success': True, 'url': direct_source}
+            server_url = mirror_selector.best(connection_id, conn_details)
+            return {'success': True, 'url': build_stream_url(conn_details, stream_id, stream_type, container, server_url)}
         except Exception as e:
             logging.error(f"Error generating stream URL for connection {connection_id}, stream {stream_id}: {e}")
             return {'success': False, 'error': 'Failed to generate stream URL.'}
 
+    def _direct_sources(self, connection_id, stream_ids, stream_type):
+        """
+        The direct_source of the given live/VOD rows that have one (entries
+        imported from a plain M3U playlist), by stream id. Those URLs are
+        played as they are instead of through the Xtream URL layout.
+        """
+        stream_type = 'vod' if stream_type == 'movie' else stream_type
+        if stream_type not in ('live', 'vod') or not stream_ids or not self._has_direct_sources(connection_id, stream_type):
+            return {}
+        result = self.get_streams_by_ids(connection_id, [{'stream_id': stream_id, 'stream_type': stream_type}
+                                                         for stream_id in stream_ids])
+        if not result['success']:
+            raise RuntimeError(result['error'])
+        return {str(row['stream_id']): row['direct_source'] for row in result['streams'] if row.get('direct_source')}
+
+    def _has_direct_sources(self, connection_id, stream_type):
+        """Whether any row of the catalog has a direct_source; known once per catalog version."""
+        catalog_id = self.catalog_id(connection_id)
+        catalog_cache.validate(catalog_id, lambda: CatalogChangeLog(self.supabase).get_version(catalog_id)['version'])
+        fact = f'direct_sources:{stream_type}'
+        has_direct_sources = catalog_cache.get_fact(catalog_id, fact)
+        if has_direct_sources is None:
+            response = self.supabase.from_(STREAM_TABLES[stream_type]).select('id').eq('connection_id', catalog_id) \
+                .neq('direct_source', '').limit(1).execute()
+            has_direct_sources = bool(response.data)
+            catalog_cache.put_fact(catalog_id, fact, has_direct_sources)
+        return has_direct_sources
+
+    def get_stream_urls(self, connection_id, stream_ids, stream_type, container=None):
+        """Builds playable URLs for a whole channel list with a single credentials lookup."""
+        try:
+            conn_details = self._get_xtream_connection_details(connection_id)
+            if not conn_details:
+                return {'success': False, 'error': 'Xtream connection details not found.'}
+            direct_sources = self._direct_sources(connection_id, stream_ids, stream_type)
+            server_url = mirror_selector.best(connection_id, conn_details)
+            urls = {str(stream_id): direct_sources.get(str(stream_id))
+                    or build_stream_url(conn_details, stream_id, stream_type, container, server_url)
+                    for stream_id in stream_ids}
+            return {'success': True, 'urls': urls}
+        except Exception as e:
+            logging.error(f"Error generating stream URLs for connection {connection_id}: {e}")
+            return {'success': False, 'error': 'Failed to generate stream URLs.'}
+
     def get_series_info(self, connection_id, series_id):
-        # Placeholder for getting series info
-        return {'success': False, 'error': 'Get series info not implemented.'}
+        """Seasons and episodes materialized by the EpisodeCrawler (crawled on demand the first time)."""
+        try:
+            series_info = episode_crawler.series_info(self, connection_id, series_id)
+            if series_info is None:
+                return {'success': False, 'error': 'Failed to fetch series info.'}
+            return {'success': True, 'series_info': series_info}
+        except Exception as e:
+            logging.error(f"Error fetching series info {series_id} for connection {connection_id}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+
+    def get_next_episode(self, connection_id, series_id, episode_id):
+        try:
+            return {'success': True,
+                    'episode': episode_crawler.next_episode(self, connection_id, series_id, episode_id)}
+        except Exception as e:
+            logging.error(f"Error fetching next episode of {episode_id} for connection {connection_id}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
 
     def get_all_streams_by_category(self, connection_id, stream_type):
         # Placeholder for getting all streams by category
@@ -495,9 +613,17 @@ class XtreamService:
     # It's called via supabase.rpc in the route.
 
     def get_user_preferences(self, user_id):
-        # Placeholder for user preferences
-        return {'success': False, 'error': 'Get user preferences not implemented.'}
+        """Returns the user's preferences from the in-memory write-behind store."""
+        try:
+            return {'success': True, 'preferences': preferences_store.get(self.supabase, user_id)}
+        except Exception as e:
+            logging.error(f"Error fetching preferences for user {user_id}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
 
     def update_user_preferences(self, user_id, data):
-        # Placeholder for user preferences
-        return {'success': False, 'error': 'Update user preferences not implemented.'}
\ No newline at end of file
+        """Applies a preferences update in memory; it reaches Supabase on the next flush."""
+        try:
+            return {'success': True, 'preferences': preferences_store.update(self.supabase, user_id, data or {})}
+        except Exception as e:
+            logging.error(f"Error updating preferences for user {user_id}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
@@ -0,0 +1,70 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from src.services import upstream
+from src.services.ttl_cache import TTLCache
+
+# A live playlist is only worth serving while it is roughly one target
+# duration old; after that the player would start behind the live edge.
+WARM_PLAYLIST_TTL_SECONDS = 6
+WARM_TIMEOUT_SECONDS = 5
+MAX_WARM_STREAMS = 4
+
+HLS_CONTENT_TYPES = ('application/vnd.apple.mpegurl', 'application/x-mpegurl')
+
+
+def is_hls_content_type(content_type):
+    return any(hls_type in content_type for hls_type in HLS_CONTENT_TYPES)
+
+
+class ZappingAccelerator:
+    """
+    Pre-fetches the first playlist of the channels adjacent to the one being
+    watched. The fetch goes through the shared upstream session, so besides
+    caching the playlist it leaves a warm keep-alive connection to the
+    provider; /proxy then answers the channel switch from memory.
+    """
+
+    def __init__(self, workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zapping-warmup')
+        # Shared across workers: /warmup and the /proxy request it prepares rarely hit the same one.
+        self._playlists = TTLCache(maxsize=256, ttl=WARM_PLAYLIST_TTL_SECONDS, shared='warm_playlists')
+        self._pending = TTLCache(maxsize=256, ttl=WARM_TIMEOUT_SECONDS)
+
+    def warm(self, urls, limit=MAX_WARM_STREAMS):
+        """
+        Schedules a warm-up for up to `limit` (at most MAX_WARM_STREAMS) HLS
+        urls; returns how many were queued. Each one holds a provider
+        connection while it runs, so callers pass the account's free
+        connections as the limit.
+        """
+        queued = 0
+        for url in urls[:max(0, min(limit, MAX_WARM_STREAMS))]:
+            if not url.split('?', 1)[0].endswith('.m3u8'):
+                continue
+            if self._playlists.get(url) is not None or self._pending.get(url) is not None:
+                continue
+            self._pending.set(url, True)
+            self._executor.submit(self._fetch, url)
+            queued += 1
+        return queued
+
+    def _fetch(self, url):
+        try:
+            response = upstream.session.get(url, timeout=WARM_TIMEOUT_SECONDS, headers=upstream.proxy_headers(url), verify=False)
+            content_type = response.headers.get('content-type', '').lower()
+            if response.status_code < 400 and is_hls_content_type(content_type):
+                self._playlists.set(url, {'content_type': content_type, 'text': response.text})
+        except Exception as e:
+            logging.info(f"Warm-up failed for {url}: {e}")
+        finally:
+            self._pending.invalidate(url)
+
+    def take_playlist(self, url):
+        """Returns and forgets the warmed playlist for `url`, if still fresh."""
+        playlist = self._playlists.get(url)
+        if playlist is not None:
+            self._playlists.invalidate(url)
+        return playlist
+
+
+zapping_accelerator = ZappingAccelerator()
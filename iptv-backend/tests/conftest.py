@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Os serviços leem o ambiente na importação: os testes usam SQLite e um diretório de dados próprio.
+os.environ.setdefault('STORAGE_BACKEND', 'sql')
+os.environ.setdefault('SESSION_SECRET_KEY', 'test')
+os.environ.setdefault('IPTV_DATA_DIR', os.path.join(tempfile.mkdtemp(prefix='iptv-tests-'), 'data'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def supabase(tmp_path):
+    """Cliente SQL local sobre um banco SQLite novo."""
+    from src.services.storage import SQLClient
+    return SQLClient(f"sqlite:///{tmp_path / 'iptv.db'}")
+
+
+@pytest.fixture
+def connection_id(supabase):
+    response = supabase.from_('xtream_connections').insert({
+        'server_url': 'http://provider.test', 'username': 'user', 'password': 'pass',
+    }).execute()
+    return response.data[0]['id']
@@ -0,0 +1,42 @@
+from src.services.catalog_cache import CatalogCache
+
+
+def _rows(count, start=0):
+    return [{'stream_id': start + i, 'name': f'Channel {start + i}', 'category_id': '1'} for i in range(count)]
+
+
+def test_rows_stay_within_byte_budget():
+    one_connection = CatalogCache._row_bytes(_rows(1)[0]) * 100
+    cache = CatalogCache(max_bytes=int(one_connection * 2.5))
+    for connection_id in (1, 2, 3):
+        cache.put_rows(connection_id, 'live', _rows(100))
+
+    assert cache.size_bytes <= cache.max_bytes
+    found, missing = cache.get_rows(1, 'live', [0, 1])
+    assert not found and missing == [0, 1]
+    for connection_id in (2, 3):
+        found, _ = cache.get_rows(connection_id, 'live', [0, 99])
+        assert set(found) == {'0', '99'}
+
+
+def test_recently_read_connection_is_kept():
+    one_connection = CatalogCache._row_bytes(_rows(1)[0]) * 100
+    cache = CatalogCache(max_bytes=int(one_connection * 2.5))
+    cache.put_rows(1, 'live', _rows(100))
+    cache.put_rows(2, 'live', _rows(100))
+    cache.get_rows(1, 'live', [0])
+    cache.put_rows(3, 'live', _rows(100))
+
+    assert cache.get_rows(1, 'live', [0])[0]
+    assert not cache.get_rows(2, 'live', [0])[0]
+
+
+def test_replaced_rows_are_not_counted_twice():
+    cache = CatalogCache()
+    cache.put_rows(1, 'live', _rows(50))
+    size = cache.size_bytes
+    cache.put_rows(1, 'live', _rows(50))
+
+    assert cache.size_bytes == size
+    cache.invalidate(1)
+    assert cache.size_bytes == 0
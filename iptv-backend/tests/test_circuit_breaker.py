@@ -0,0 +1,22 @@
+from src.services.circuit_breaker import MIN_SAMPLES, MIN_TIMEOUT_SECONDS, CircuitBreaker
+from src.services.mirrors import _latency_kind
+
+
+def test_bulk_listing_is_not_timed_by_small_calls():
+    breaker = CircuitBreaker('provider.test')
+    small = _latency_kind({'action': 'get_vod_categories'})
+    for _ in range(MIN_SAMPLES * 5):
+        breaker.record_success(0.05, small)
+
+    assert breaker.timeout(60, small) == MIN_TIMEOUT_SECONDS
+    assert breaker.timeout(60, _latency_kind({'action': 'get_vod_streams'})) == 60
+
+
+def test_category_listing_and_whole_listing_have_separate_windows():
+    breaker = CircuitBreaker('provider.test')
+    for _ in range(MIN_SAMPLES):
+        breaker.record_success(0.5, _latency_kind({'action': 'get_vod_streams', 'category_id': '1'}))
+        breaker.record_success(8.0, _latency_kind({'action': 'get_vod_streams'}))
+
+    assert breaker.timeout(60, _latency_kind({'action': 'get_vod_streams', 'category_id': '2'})) == MIN_TIMEOUT_SECONDS
+    assert breaker.timeout(60, _latency_kind({'action': 'get_vod_streams'})) == 24.0
@@ -0,0 +1,51 @@
+from src.services.m3u_import import M3UImporter, _stable_id
+
+# crc32 & 0x7fffffff of these two URLs is the same 31-bit id.
+COLLIDING_URLS = ('http://cdn.example.com/live/ch29685295.ts', 'http://cdn.example.com/live/ch32060020.ts')
+
+
+class FakeService:
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def _get_xtream_connection_details(self, connection_id):
+        return {'server_url': 'http://provider.test', 'username': 'user', 'password': 'pass'}
+
+
+def _playlist(tmp_path, urls):
+    path = tmp_path / 'playlist.m3u'
+    lines = ['#EXTM3U']
+    for index, url in enumerate(urls):
+        lines += [f'#EXTINF:-1 group-title="News",Channel {index}', url]
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def _direct_sources(supabase, connection_id):
+    rows = supabase.from_('live_streams').select('stream_id, direct_source') \
+        .eq('connection_id', connection_id).execute().data
+    return {row['direct_source']: int(row['stream_id']) for row in rows}
+
+
+def test_colliding_urls_are_both_imported(supabase, connection_id, tmp_path):
+    assert _stable_id(COLLIDING_URLS[0]) == _stable_id(COLLIDING_URLS[1])
+    importer = M3UImporter(FakeService(supabase))
+
+    result = importer.import_playlist(connection_id, _playlist(tmp_path, COLLIDING_URLS))
+
+    assert result['success'] and result['entries'] == 2
+    stored = _direct_sources(supabase, connection_id)
+    assert set(stored) == set(COLLIDING_URLS)
+    assert len(set(stored.values())) == 2
+
+
+def test_reimport_keeps_ids_of_colliding_urls(supabase, connection_id, tmp_path):
+    importer = M3UImporter(FakeService(supabase))
+    source = _playlist(tmp_path, COLLIDING_URLS)
+    importer.import_playlist(connection_id, source)
+    first = _direct_sources(supabase, connection_id)
+
+    result = importer.import_playlist(connection_id, source)
+
+    assert result['success'] and result['changes'] == 0
+    assert _direct_sources(supabase, connection_id) == first
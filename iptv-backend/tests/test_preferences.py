@@ -0,0 +1,50 @@
+from src.services.preferences import PreferencesStore
+
+
+def _store():
+    # No background flusher interval in play: the tests flush explicitly.
+    return PreferencesStore(flush_interval=3600)
+
+
+def test_toggle_replayed_on_fresher_row_keeps_favorite(supabase):
+    first, second = _store(), _store()
+    first.get(supabase, 'user')
+    second.update(supabase, 'user', {'toggle_favorite': 7})
+    second.flush()
+
+    # The first worker's cached row predates the favorite: there the toggle means "add".
+    first.update(supabase, 'user', {'toggle_favorite': 7})
+    first.flush()
+
+    assert _store().get(supabase, 'user')['favorite_channels'] == [7]
+
+
+def test_toggle_off_is_not_undone_by_a_concurrent_add(supabase):
+    first, second = _store(), _store()
+    first.update(supabase, 'user', {'toggle_favorite': 7})
+    first.flush()
+
+    second.get(supabase, 'user')
+    first.update(supabase, 'user', {'toggle_favorite': 7})
+    second.update(supabase, 'user', {'add_favorite': 8})
+    second.flush()
+    first.flush()
+
+    assert _store().get(supabase, 'user')['favorite_channels'] == [8]
+
+
+def test_update_of_cached_user_does_not_read_the_database(supabase, monkeypatch):
+    store = _store()
+    store.revalidate_seconds = 0
+    store.get(supabase, 'user')
+    loads = []
+    load = store._load
+    monkeypatch.setattr(store, '_load', lambda *args: loads.append(args) or load(*args))
+
+    for channel in range(5):
+        store.update(supabase, 'user', {'add_recent': channel})
+
+    assert loads == []
+    assert store.flush() == 1
+    assert len(loads) == 1
+    assert _store().get(supabase, 'user')['recent_channels'] == [4, 3, 2, 1, 0]
@@ -0,0 +1,15 @@
+import time
+
+from src.services.shared_cache import SharedCache
+
+
+def test_lease_has_a_single_holder_until_it_expires(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    first, second = SharedCache(path=path), SharedCache(path=path)
+
+    assert first.acquire('mirror_probe_lease:http://a', 0.2)
+    assert not second.acquire('mirror_probe_lease:http://a', 0.2)
+    assert second.acquire('mirror_probe_lease:http://b', 0.2)
+    time.sleep(0.25)
+    assert second.acquire('mirror_probe_lease:http://a', 0.2)
+    assert not first.acquire('mirror_probe_lease:http://a', 0.2)
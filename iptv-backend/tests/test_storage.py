@@ -0,0 +1,42 @@
+import sqlite3
+
+from src.services.storage import SQLClient
+
+
+def test_partial_upsert_keeps_other_extra_fields(supabase, connection_id):
+    series = supabase.from_('series')
+    series.upsert([{'connection_id': connection_id, 'series_id': 1, 'name': 'Show', 'plot': 'A plot',
+                    'cast': 'Someone'}], on_conflict='connection_id,series_id').execute()
+    supabase.from_('series').upsert([{'connection_id': connection_id, 'series_id': 1, 'plot': 'New plot'}],
+                                    on_conflict='connection_id,series_id').execute()
+    supabase.from_('series').update({'genre': 'Drama'}).eq('connection_id', connection_id).execute()
+
+    row = supabase.from_('series').select('*').eq('connection_id', connection_id).single().execute().data
+    assert (row['name'], row['plot'], row['cast'], row['genre']) == ('Show', 'New plot', 'Someone', 'Drama')
+
+
+def test_tables_of_older_models_are_upgraded(tmp_path):
+    path = tmp_path / 'old.db'
+    connection = sqlite3.connect(path)
+    # channels and categories as the models created them before the local storage backend.
+    connection.executescript('''
+        CREATE TABLE xtream_connections (id INTEGER PRIMARY KEY, server_url VARCHAR(255) NOT NULL,
+            username VARCHAR(100) NOT NULL, password VARCHAR(100) NOT NULL, is_active BOOLEAN,
+            created_at DATETIME, last_used DATETIME, last_synced_at DATETIME, server_info TEXT, user_info TEXT);
+        CREATE TABLE channels (id INTEGER PRIMARY KEY, stream_id VARCHAR(50) NOT NULL, name VARCHAR(255) NOT NULL,
+            stream_type VARCHAR(50) NOT NULL, stream_icon VARCHAR(500), epg_channel_id VARCHAR(100),
+            added VARCHAR(50), category_id VARCHAR(50), custom_sid VARCHAR(50), tv_archive INTEGER,
+            direct_source VARCHAR(500), tv_archive_duration INTEGER, connection_id INTEGER NOT NULL,
+            extra_info TEXT, created_at DATETIME, updated_at DATETIME);
+        INSERT INTO xtream_connections (id, server_url, username, password) VALUES (1, 'http://p', 'u', 'p');
+        INSERT INTO channels (stream_id, name, stream_type, connection_id) VALUES ('42', 'Old', 'live', 1);
+    ''')
+    connection.commit()
+    connection.close()
+
+    client = SQLClient(f'sqlite:///{path}')
+    client.from_('live_streams').upsert([{'connection_id': 1, 'stream_id': 42, 'name': None, 'alive': True}],
+                                        on_conflict='connection_id,stream_id').execute()
+
+    rows = client.from_('live_streams').select('stream_id, name, alive').eq('connection_id', 1).execute().data
+    assert rows == [{'stream_id': 42, 'name': None, 'alive': True}]
@@ -0,0 +1,94 @@
+from src.services.sync_engine import CatalogSyncEngine
+from src.services.sync_planner import SyncPlanner
+
+
+class FakeProvider:
+    """Responde às actions de VOD de um painel Xtream a partir de listas em memória."""
+
+    def __init__(self, supabase, categories, streams):
+        self.supabase = supabase
+        self.categories = categories
+        self.streams = streams
+        self.requests = []
+
+    def _make_xtream_request(self, connection_id, action, params=None, headers=None):
+        self.requests.append((action, (params or {}).get('category_id')))
+        if action == 'get_vod_categories':
+            return {'success': True, 'data': [{'category_id': c, 'category_name': f'Cat {c}'}
+                                              for c in self.categories]}
+        data = [dict(s) for s in self.streams
+                if not params or s['category_id'] == params['category_id']]
+        return {'success': True, 'data': data}
+
+
+def _vod(stream_id, category_id):
+    return {'stream_id': stream_id, 'name': f'Movie {stream_id}', 'category_id': category_id,
+            'container_extension': 'mp4', 'added': '1700000000'}
+
+
+def _stored(supabase, connection_id):
+    rows = supabase.from_('vod_streams').select('stream_id, category_id') \
+        .eq('connection_id', connection_id).execute().data
+    return {int(row['stream_id']): str(row['category_id']) for row in rows}
+
+
+def _fetch_only(monkeypatch, category_ids):
+    plan = SyncPlanner.plan
+
+    def planned(self, listed, state):
+        result = plan(self, listed, state)
+        result.fetch = {c: {} for c in listed if c in category_ids}
+        return result
+    monkeypatch.setattr(SyncPlanner, 'plan', planned)
+
+
+def _changes(supabase, connection_id):
+    rows = supabase.from_('catalog_changes').select('item_key, op') \
+        .eq('connection_id', connection_id).eq('entity', 'vod_streams').execute().data
+    return [(str(row['item_key']), row['op']) for row in rows]
+
+
+def test_planned_sync_keeps_title_moved_to_unfetched_category(supabase, connection_id, monkeypatch):
+    provider = FakeProvider(supabase, ['1', '2', '10'], [_vod(100, '1'), _vod(101, '1'), _vod(200, '2')])
+    engine = CatalogSyncEngine(provider)
+    assert engine.sync(connection_id, 'vod', full=True)['success']
+    baseline = len(_changes(supabase, connection_id))
+
+    provider.streams = [_vod(100, '10'), _vod(101, '1'), _vod(200, '2')]
+    _fetch_only(monkeypatch, {'1', '2'})
+    result = engine.sync(connection_id, 'vod')
+
+    assert result['success']
+    assert _stored(supabase, connection_id) == {100: '10', 101: '1', 200: '2'}
+    assert ('100', 'delete') not in _changes(supabase, connection_id)[baseline:]
+    assert ('get_vod_streams', '10') not in provider.requests
+
+
+def test_planned_sync_moves_title_between_fetched_categories(supabase, connection_id, monkeypatch):
+    provider = FakeProvider(supabase, ['1', '2'], [_vod(100, '1'), _vod(200, '2')])
+    engine = CatalogSyncEngine(provider)
+    assert engine.sync(connection_id, 'vod', full=True)['success']
+    baseline = len(_changes(supabase, connection_id))
+
+    provider.streams = [_vod(100, '2'), _vod(200, '2')]
+    _fetch_only(monkeypatch, {'1', '2'})
+    provider.requests = []
+    assert engine.sync(connection_id, 'vod')['success']
+
+    assert _stored(supabase, connection_id) == {100: '2', 200: '2'}
+    assert ('100', 'delete') not in _changes(supabase, connection_id)[baseline:]
+    # Seen in another downloaded category: no whole-listing lookup is needed.
+    assert ('get_vod_streams', None) not in provider.requests
+
+
+def test_planned_sync_deletes_title_gone_from_whole_listing(supabase, connection_id, monkeypatch):
+    provider = FakeProvider(supabase, ['1', '2'], [_vod(100, '1'), _vod(101, '1'), _vod(200, '2')])
+    engine = CatalogSyncEngine(provider)
+    assert engine.sync(connection_id, 'vod', full=True)['success']
+
+    provider.streams = [_vod(101, '1'), _vod(200, '2')]
+    _fetch_only(monkeypatch, {'1'})
+    assert engine.sync(connection_id, 'vod')['success']
+
+    assert _stored(supabase, connection_id) == {101: '1', 200: '2'}
+    assert ('100', 'delete') in _changes(supabase, connection_id)